@@ -1,39 +1,55 @@
 #!/usr/bin/env python3
 """
 git worktreeを作成してClaude Code CLIを起動し、並列でCodexにブランチ名を提案させる
-初期ブランチ名: ai/YYYYMMDD-HHMMSS-ランダム8文字
+初期ブランチ名: ai/接頭辞/プロンプト中の英単語-ランダム8文字（例: ai/fix/login-timeout-1a2b3c4d）
+  英単語が無ければ ai/接頭辞/YYYYMMDD-HHMMSS-ランダム8文字。接頭辞は feature/fix/refactor/docs/test
+  同じプロンプトで以前Codexが提案した名前があれば、最初から ai/提案名-ランダム8文字 にする
 Codex提案後: ai/提案名-同じランダム8文字
 """
 
 import argparse
-import json
-import secrets
-import subprocess
 import sys
-import tempfile
-import threading
-from datetime import datetime
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent))
 
 from base.assistant import AssistantCli, run_assistant
+from base.branch_namer import (
+    is_valid_branch_name,
+    lookup_cached_branch_name,
+    start_branch_naming,
+    suggest_local_branch_name,
+)
+from base.dep_cache import materialize_dependencies
 from base.git import check_commands, is_git_repository
+from base.metrics import phase
+from base.process import enable_profile
+from base.sparse_worktree import (
+    compute_sparse_stats,
+    format_bytes,
+    get_sparse_profile,
+    start_background_hydration,
+)
 from base.worktree_manager import (
     branch_exists,
     copy_local_configs,
     create_new_branch_worktree,
     create_worktree,
+    get_repo_root,
     get_worktree_path,
     worktree_exists,
 )
+from base.worktree_pool import take_pooled_worktree
+
+# ブランチ名や worktree のパスが既存のものと衝突したときに、接尾辞を変えて作り直す回数
+_BRANCH_NAME_ATTEMPTS = 3
 
 
 def main() -> None:
     CODEX_TIMEOUT = 15
     RANDOM_SUFFIX_LENGTH = 8
 
-    base_branch, existing_branch, assistant, prompt = parse_arguments()
+    base_branch, existing_branch, assistant, sparse, prompt = parse_arguments()
     if assistant == "claude":
         check_commands(["git", "codex", "claude"])
     else:
@@ -47,14 +63,14 @@ def main() -> None:
         sys.exit(1)
 
     if existing_branch:
-        handle_existing_branch_mode(existing_branch, assistant, prompt)
+        handle_existing_branch_mode(existing_branch, assistant, prompt, sparse)
     else:
         handle_new_branch_mode(
-            base_branch, assistant, prompt, RANDOM_SUFFIX_LENGTH, CODEX_TIMEOUT
+            base_branch, assistant, prompt, sparse, RANDOM_SUFFIX_LENGTH, CODEX_TIMEOUT
         )
 
 
-def parse_arguments() -> tuple[str | None, str | None, AssistantCli, str]:
+def parse_arguments() -> tuple[str | None, str | None, AssistantCli, bool, str]:
     """コマンドライン引数を解析する"""
     parser = argparse.ArgumentParser(
         description="git worktreeを作成してAI コーディング CLI（Claude/Codex）を起動する"
@@ -75,9 +91,21 @@ def parse_arguments() -> tuple[str | None, str | None, AssistantCli, str]:
         default="claude",
         help="起動するCLI（デフォルト: claude）",
     )
+    parser.add_argument(
+        "--sparse",
+        action="store_true",
+        help="設定またはプロンプト中のパスに絞って sparse-checkout し、残りは裏でチェックアウトする",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="起動した外部コマンドの所要時間を Chrome の trace 形式で PATH に書き出す",
+    )
     parser.add_argument("prompt", nargs="*", help="タスクの内容")
 
     args = parser.parse_args()
+    if args.profile:
+        enable_profile(args.profile)
 
     if args.base_branch and args.branch:
         print(
@@ -88,7 +116,7 @@ def parse_arguments() -> tuple[str | None, str | None, AssistantCli, str]:
 
     prompt = " ".join(args.prompt).strip()
 
-    return args.base_branch, args.branch, args.ai, prompt
+    return args.base_branch, args.branch, args.ai, args.sparse, prompt
 
 
 def get_prompt_from_stdin() -> str:
@@ -109,7 +137,7 @@ def get_prompt_from_stdin() -> str:
 
 
 def handle_existing_branch_mode(
-    branch_name: str, assistant: AssistantCli, prompt: str
+    branch_name: str, assistant: AssistantCli, prompt: str, sparse: bool
 ) -> None:
     """既存ブランチで worktree を作成・再利用する"""
     if not branch_exists(branch_name):
@@ -125,14 +153,22 @@ def handle_existing_branch_mode(
         print(f"既存ブランチ '{branch_name}' の worktree を使用します")
         print(f"worktree パス: {worktree_path}")
     else:
-        if not create_worktree(worktree_path, branch_name):
+        sparse_dirs = get_sparse_profile(prompt, branch_name) if sparse else None
+        with phase("worktree"):
+            created = create_worktree(worktree_path, branch_name, sparse_dirs=sparse_dirs)
+        if not created:
             print("エラー: worktreeの作成に失敗しました。", file=sys.stderr)
             sys.exit(1)
         print(f"ブランチ '{branch_name}' の worktree を作成しました")
         print(f"worktree パス: {worktree_path}")
+        if sparse_dirs is not None:
+            report_sparse_checkout(worktree_path, sparse_dirs)
 
     if assistant == "claude":
-        copy_local_configs(worktree_path)
+        with phase("config_copy"):
+            copy_local_configs(worktree_path)
+    with phase("dependencies"):
+        materialize_dependencies(worktree_path, Path(get_repo_root()))
 
     run_assistant(assistant, prompt, str(worktree_path))
 
@@ -141,6 +177,7 @@ def handle_new_branch_mode(
     base_branch: str | None,
     assistant: AssistantCli,
     prompt: str,
+    sparse: bool,
     random_suffix_length: int,
     codex_timeout: int,
 ) -> None:
@@ -152,13 +189,35 @@ def handle_new_branch_mode(
         )
         sys.exit(1)
 
-    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-    random_suffix = generate_random_suffix(random_suffix_length)
-    initial_branch = f"ai/{timestamp}-{random_suffix}"
-
-    worktree_path = get_worktree_path(initial_branch)
-
-    if not create_new_branch_worktree(worktree_path, initial_branch, base_branch):
+    # 以前 codex が提案した名前か、プロンプトから即座に作った名前で始め、後者は後で codex の提案に置き換える
+    cached_name = lookup_cached_branch_name(prompt)
+    name = cached_name or suggest_local_branch_name(prompt)
+
+    sparse_dirs = get_sparse_profile(prompt, base_branch or "HEAD") if sparse else None
+    for _ in range(_BRANCH_NAME_ATTEMPTS):
+        random_suffix = generate_random_suffix(random_suffix_length)
+        initial_branch = f"ai/{name}-{random_suffix}"
+        worktree_path = get_worktree_path(initial_branch)
+        with phase("worktree"):
+            pooled = sparse_dirs is None and take_pooled_worktree(
+                worktree_path, initial_branch, base_branch
+            )
+            created = pooled or create_new_branch_worktree(
+                worktree_path, initial_branch, base_branch, sparse_dirs=sparse_dirs
+            )
+        if created:
+            break
+        # 以前のキャッシュに git が受け付けない名前が残っていた場合は、プロンプトから作った名前でやり直す
+        if cached_name is not None and not is_valid_branch_name(initial_branch):
+            cached_name = None
+            name = suggest_local_branch_name(prompt)
+            continue
+        # 既存のブランチや worktree と衝突した場合だけ接尾辞を変えてやり直し、それ以外の失敗は諦める
+        if not branch_exists(initial_branch) and not worktree_path.exists():
+            break
+    if pooled:
+        print("プール済みの worktree を使用します")
+    elif not created:
         print("エラー: worktreeの作成に失敗しました。", file=sys.stderr)
         sys.exit(1)
 
@@ -167,94 +226,41 @@ def handle_new_branch_mode(
     else:
         print(f"新規ブランチ '{initial_branch}' を作成しました")
     print(f"worktree パス: {worktree_path}")
+    if sparse_dirs is not None:
+        report_sparse_checkout(worktree_path, sparse_dirs)
 
-    thread = threading.Thread(
-        target=suggest_branch_name,
-        args=(prompt, random_suffix, str(worktree_path), codex_timeout),
-        daemon=True,
-    )
-    thread.start()
+    if cached_name is None:
+        # アシスタントの exec 後も続くよう、ブランチ名の提案とリネームは別プロセスに任せる
+        start_branch_naming(prompt, worktree_path, initial_branch, random_suffix, codex_timeout)
 
     if assistant == "claude":
-        copy_local_configs(worktree_path)
+        with phase("config_copy"):
+            copy_local_configs(worktree_path)
+    with phase("dependencies"):
+        materialize_dependencies(worktree_path, Path(get_repo_root()))
 
     run_assistant(assistant, prompt, str(worktree_path))
 
 
+def report_sparse_checkout(worktree_path: Path, sparse_dirs: list[str]) -> None:
+    """sparse-checkout で省いた書き込み量を表示し、残りのチェックアウトを裏で開始する"""
+    stats = compute_sparse_stats(worktree_path)
+    target = ", ".join(sparse_dirs) if sparse_dirs else "(ルート直下のみ)"
+    print(f"sparse-checkout: {target}")
+    print(
+        f"{stats['total_files']} ファイル中 {stats['skipped_files']} ファイル "
+        f"({format_bytes(stats['skipped_bytes'])}) の書き込みを省きました。残りは裏でチェックアウトします"
+    )
+    start_background_hydration(worktree_path)
+
+
 def generate_random_suffix(length: int) -> str:
     """指定した長さのランダムな英数字文字列を生成する"""
+    import secrets
+
     alphabet = "abcdefghijklmnopqrstuvwxyz0123456789"
     return "".join(secrets.choice(alphabet) for _ in range(length))
 
 
-def suggest_branch_name(
-    prompt: str, random_suffix: str, worktree_path: str, timeout: int
-) -> None:
-    """codex を使ってブランチ名を提案し、現在のブランチをリネームする"""
-    codex_prompt = f"Generate a git branch name for this task: '{prompt}'. Use kebab-case with prefix (feature/fix/refactor/docs/test). Max 50 chars."
-
-    with (
-        tempfile.NamedTemporaryFile(
-            mode="w", suffix=".json", delete=False
-        ) as output_file,
-        tempfile.NamedTemporaryFile(
-            mode="w", suffix=".json", delete=False
-        ) as schema_file,
-    ):
-        output_path = output_file.name
-        schema_path = schema_file.name
-
-        schema = {
-            "type": "object",
-            "properties": {"branchName": {"type": "string"}},
-            "required": ["branchName"],
-            "additionalProperties": False,
-        }
-        json.dump(schema, schema_file)
-        schema_file.flush()
-
-        try:
-            result = subprocess.run(
-                [
-                    "codex",
-                    "exec",
-                    "--output-last-message",
-                    output_path,
-                    "--output-schema",
-                    schema_path,
-                    codex_prompt,
-                ],
-                stdin=subprocess.DEVNULL,
-                capture_output=True,
-                timeout=timeout,
-            )
-
-            if result.returncode == 0:
-                data = json.loads(Path(output_path).read_text())
-                suggested_name = data.get("branchName", "")
-
-                if suggested_name and len(suggested_name) <= 50:
-                    new_branch = f"ai/{suggested_name}-{random_suffix}"
-                    ok = (
-                        subprocess.run(
-                            ["git", "check-ref-format", "--branch", new_branch],
-                            cwd=worktree_path,
-                            capture_output=True,
-                        ).returncode
-                        == 0
-                    )
-                    if ok:
-                        subprocess.run(
-                            ["git", "branch", "-m", new_branch],
-                            cwd=worktree_path,
-                            capture_output=True,
-                        )
-        except subprocess.TimeoutExpired:
-            pass
-        finally:
-            Path(output_path).unlink(missing_ok=True)
-            Path(schema_path).unlink(missing_ok=True)
-
-
 if __name__ == "__main__":
     main()
@@ -5,26 +5,31 @@ PR のブランチを worktree にチェックアウトして AI CLI を起動
 """
 
 import argparse
-import json
-import re
-import subprocess
 import sys
+import threading
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent))
 
 from base.assistant import AssistantCli, run_assistant
-from base.git import check_commands, is_git_repository
-from base.github import (
-    add_fork_remote,
-    get_current_org_repo,
-    get_current_user,
-    get_pr_fork_info,
+from base.cache import disable_cache
+from base.dep_cache import materialize_dependencies
+from base.git import (
+    cancel_pull_request_prefetch,
+    check_commands,
+    fetch_remote_branch,
+    find_local_branch_for_remote,
+    is_git_repository,
+    start_pull_request_prefetch,
 )
+from base.github import add_fork_remote, fetch_pr_context
+from base.metrics import phase
 from base.pr_parser import parse_pr_info, validate_org_repo
+from base.process import enable_profile
 from base.worktree_manager import (
     copy_local_configs,
     create_worktree,
+    get_repo_root,
     get_worktree_path,
     worktree_exists,
 )
@@ -53,14 +58,19 @@ def main() -> None:
         sys.exit(1)
 
     pr_number = pr_info["number"]
+    # PR の head は番号だけで origin から取れるので、メタデータの取得と並行して fetch しておく
+    prefetch = start_pull_request_prefetch(pr_number)
 
-    current_org, current_repo = get_current_org_repo()
+    with phase("metadata"):
+        context = fetch_pr_context(pr_number)
+    current_org, current_repo = context["org"], context["repo"]
     validate_org_repo(pr_info, current_org, current_repo)
 
-    pr_author = get_pr_author(pr_number)
-    current_user = get_current_user()
-
-    fork_owner, fork_repo, branch_name = get_pr_fork_info(pr_number)
+    pr_author = context["author"]
+    current_user = context["viewer"]
+    fork_owner = context["fork_owner"]
+    fork_repo = context["fork_repo"]
+    branch_name = context["branch"]
 
     print(f"PR #{pr_number} のブランチ '{branch_name}' をチェックアウトします")
     print(f"PR 作者: {pr_author}")
@@ -78,8 +88,15 @@ def main() -> None:
 
     local_branch = find_local_branch_for_remote(remote_name, branch_name)
 
-    if not local_branch:
-        if not fetch_and_create_local_branch(remote_name, branch_name):
+    if local_branch:
+        # 既存のブランチを使うので、アシスタントの起動後に裏で fetch が続かないよう先行 fetch を止める
+        cancel_pull_request_prefetch(prefetch, pr_number)
+    else:
+        with phase("git_fetch"):
+            fetched = fetch_and_create_local_branch(
+                remote_name, branch_name, pr_number, prefetch
+            )
+        if not fetched:
             print(
                 f"エラー: ブランチ '{branch_name}' のfetchに失敗しました。",
                 file=sys.stderr,
@@ -92,13 +109,18 @@ def main() -> None:
     if worktree_exists(worktree_path):
         print(f"既存のworktreeを使用します: {worktree_path}")
     else:
-        if not create_worktree(worktree_path, local_branch):
+        with phase("worktree"):
+            created = create_worktree(worktree_path, local_branch, pr_number)
+        if not created:
             print("エラー: worktreeの作成に失敗しました。", file=sys.stderr)
             sys.exit(1)
         print(f"worktreeを作成しました: {worktree_path}")
 
     if assistant == "claude":
-        copy_local_configs(worktree_path)
+        with phase("config_copy"):
+            copy_local_configs(worktree_path)
+    with phase("dependencies"):
+        materialize_dependencies(worktree_path, Path(get_repo_root()))
 
     checkout_pr_prompt = build_checkout_pr_prompt(
         pr_number,
@@ -127,8 +149,22 @@ def parse_arguments() -> tuple[AssistantCli, str]:
         default="claude",
         help="起動するCLI（デフォルト: claude）",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="GitHub メタデータのキャッシュを使わずに取得する",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="起動した外部コマンドの所要時間を Chrome の trace 形式で PATH に書き出す",
+    )
     parser.add_argument("prompt", nargs="*", help="PR URLまたはプロンプト")
     args = parser.parse_args()
+    if args.profile:
+        enable_profile(args.profile)
+    if args.no_cache:
+        disable_cache()
     prompt = " ".join(args.prompt).strip()
     return args.ai, prompt
 
@@ -150,44 +186,6 @@ def get_prompt_from_stdin(stdin_message: str) -> str:
     return prompt
 
 
-def get_pr_author(pr_number: int) -> str:
-    """PR の作者を取得する"""
-    result = subprocess.run(
-        ["gh", "pr", "view", str(pr_number), "--json", "author"],
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode != 0:
-        raise Exception(f"PR #{pr_number} の情報を取得できませんでした")
-
-    data = json.loads(result.stdout)
-    return data["author"]["login"]
-
-
-def find_local_branch_for_remote(remote_name: str, remote_branch: str) -> str | None:
-    """リモートブランチに対応するローカルブランチを検索する"""
-    result = subprocess.run(
-        ["git", "branch", "-vv"],
-        capture_output=True,
-        encoding="utf-8",
-        errors="replace",
-    )
-    if result.returncode != 0:
-        return None
-
-    pattern = re.compile(rf"^\*?\s+(\S+)\s+\w+\s+\[{remote_name}/([^:\]]+)")
-
-    for line in result.stdout.splitlines():
-        match = pattern.match(line)
-        if match:
-            local_branch = match.group(1)
-            tracking_branch = match.group(2)
-            if tracking_branch == remote_branch:
-                return local_branch
-
-    return None
-
-
 def build_checkout_pr_prompt(
     pr_number: int,
     current_org: str,
@@ -216,24 +214,18 @@ PR作者: {pr_author}
 {user_prompt}"""
 
 
-def fetch_and_create_local_branch(remote_name: str, branch_name: str) -> bool:
-    """リモートブランチを fetch してローカルブランチを作成または更新する"""
-    check_result = subprocess.run(
-        ["git", "rev-parse", "--verify", branch_name],
-        capture_output=True,
-    )
-    if check_result.returncode == 0:
-        update_result = subprocess.run(
-            ["git", "fetch", remote_name, f"{branch_name}:{branch_name}"],
-            capture_output=True,
+def fetch_and_create_local_branch(
+    remote_name: str, branch_name: str, pr_number: int, prefetch: threading.Thread
+) -> bool:
+    """先行 fetch 済みの PR の head かリモートブランチから、ローカルブランチを作成または fast-forward で更新する"""
+    try:
+        fetch_remote_branch(
+            remote_name, branch_name, pr_number, local_branch=branch_name, prefetch=prefetch
         )
-        return update_result.returncode == 0
-
-    fetch_result = subprocess.run(
-        ["git", "fetch", remote_name, f"{branch_name}:{branch_name}"],
-        capture_output=True,
-    )
-    return fetch_result.returncode == 0
+    except Exception as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        return False
+    return True
 
 
 if __name__ == "__main__":
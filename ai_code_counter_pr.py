@@ -5,25 +5,23 @@ PRの送り主のfork/branchに対して変更を加え、PRを出す作業をCl
 """
 
 import argparse
-import datetime
-import secrets
 import sys
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent))
 
 from base.assistant import AssistantCli, run_assistant
+from base.cache import disable_cache
+from base.dep_cache import materialize_dependencies
 from base.git import check_commands, fetch_remote_branch, is_git_repository
-from base.github import (
-    add_fork_remote,
-    get_current_org_repo,
-    get_current_user,
-    get_pr_fork_info,
-)
+from base.github import add_fork_remote, fetch_pr_context
+from base.metrics import phase
 from base.pr_parser import parse_pr_info, validate_org_repo
+from base.process import enable_profile
 from base.worktree_manager import (
     copy_local_configs,
     create_new_branch_worktree,
+    get_repo_root,
     get_worktree_path,
 )
 
@@ -52,13 +50,18 @@ def main() -> None:
 
     pr_number = pr_info["number"]
 
-    current_org, current_repo = get_current_org_repo()
-    validate_org_repo(pr_info, current_org, current_repo)
+    with phase("metadata"):
+        context = fetch_pr_context(pr_number)
+    current_repo = context["repo"]
+    validate_org_repo(pr_info, context["org"], current_repo)
 
-    fork_owner, fork_repo, target_branch = get_pr_fork_info(pr_number)
+    fork_owner = context["fork_owner"]
+    fork_repo = context["fork_repo"]
+    target_branch = context["branch"]
 
     remote_name = add_fork_remote(fork_owner, current_repo)
-    fetch_remote_branch(remote_name, target_branch)
+    with phase("git_fetch"):
+        fetch_remote_branch(remote_name, target_branch, pr_number)
 
     branch_name = generate_branch_name()
     base_branch = f"{remote_name}/{target_branch}"
@@ -68,15 +71,22 @@ def main() -> None:
 
     worktree_path = get_worktree_path(branch_name)
 
-    if not create_new_branch_worktree(worktree_path, branch_name, base_branch):
+    with phase("worktree"):
+        created = create_new_branch_worktree(
+            worktree_path, branch_name, base_branch, pr_number
+        )
+    if not created:
         print("エラー: worktreeの作成に失敗しました。", file=sys.stderr)
         sys.exit(1)
     print(f"worktree パス: {worktree_path}")
 
     if assistant == "claude":
-        copy_local_configs(worktree_path)
+        with phase("config_copy"):
+            copy_local_configs(worktree_path)
+    with phase("dependencies"):
+        materialize_dependencies(worktree_path, Path(get_repo_root()))
 
-    my_user = get_current_user()
+    my_user = context["viewer"]
     counter_pr_prompt = build_counter_pr_prompt(
         fork_owner, fork_repo, target_branch, my_user, branch_name, prompt
     )
@@ -95,8 +105,22 @@ def parse_arguments() -> tuple[AssistantCli, str]:
         default="claude",
         help="起動するCLI（デフォルト: claude）",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="GitHub メタデータのキャッシュを使わずに取得する",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="起動した外部コマンドの所要時間を Chrome の trace 形式で PATH に書き出す",
+    )
     parser.add_argument("prompt", nargs="*", help="PR URLまたはプロンプト")
     args = parser.parse_args()
+    if args.profile:
+        enable_profile(args.profile)
+    if args.no_cache:
+        disable_cache()
     prompt = " ".join(args.prompt).strip()
     return args.ai, prompt
 
@@ -120,6 +144,9 @@ def get_prompt_from_stdin(stdin_message: str) -> str:
 
 def generate_branch_name() -> str:
     """timestamp + random suffixでブランチ名生成する"""
+    import datetime
+    import secrets
+
     timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
     random_suffix = secrets.token_hex(4)
     return f"ai/counter-pr/{timestamp}-{random_suffix}"
@@ -0,0 +1,30 @@
+"""呼び出し元が exec した後も動き続けるバックグラウンドプロセスを起動する"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from base.process import record_spawn
+
+
+def spawn_detached(module: str, args: list[str], cwd: str | None = None) -> None:
+    """base 配下のモジュールを、別セッションの python プロセスとして起動する"""
+    package_dir = str(Path(__file__).resolve().parent.parent)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [package_dir, env.get("PYTHONPATH")])
+    )
+    # 親のプロファイルを上書きしないよう、子プロセスには引き継がない
+    env.pop("HIHO_PROFILE", None)
+    command = [sys.executable, "-m", module, *args]
+    record_spawn(command, cwd, name=module)
+    subprocess.Popen(
+        command,
+        cwd=cwd,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
@@ -0,0 +1,253 @@
+"""
+AI タスク用の worktree のブランチ名を決める
+
+まずプロンプト中の英単語から即座に名前を作り、あとで codex の提案に置き換える。
+codex の提案は正規化したプロンプトのハッシュをキーに LRU キャッシュへ保存し、同じタスクでは最初から使う。
+codex への問い合わせとリネームは、呼び出し元がアシスタントを exec した後も動き続けるよう別プロセスで行う。
+進み具合はジャーナルに記録し、途中で落ちても同じ worktree に対して再実行すれば続きから処理する。
+"""
+
+import json
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from base.background import spawn_detached
+from base.cache import get_cache_dir, is_cache_disabled, write_json_atomic
+from base.journal import clear_journal, load_journal, record_step
+from base.metrics import phase
+from base.process import run_command
+from base.worktree_registry import read_worktree_branch, update_worktree_branch
+
+_MAX_NAME_LENGTH = 50
+_LOCAL_MAX_WORDS = 4
+_LOCAL_MAX_LENGTH = 40
+_CACHE_MAX_ENTRIES = 256
+_STOPWORDS = frozenset(
+    "a an the to of for in on at by with and or not is are be was it its this that these "
+    "from as into onto please should would could can will when if then so do does add "
+    "implement make use using update new".split()
+)
+# ブランチ名の接頭辞と、それを選ぶ手がかりになる語。英語は単語単位、日本語は部分一致で探す
+_PREFIX_KEYWORDS = {
+    "fix": ("fix", "bug", "bugs", "error", "crash", "修正", "バグ", "不具合", "エラー"),
+    "refactor": ("refactor", "cleanup", "リファクタ", "整理"),
+    "docs": ("doc", "docs", "readme", "documentation", "ドキュメント"),
+    "test": ("test", "tests", "テスト"),
+}
+_RENAME_ATTEMPTS = 3
+_RENAME_RETRY_SECONDS = 1.0
+
+
+def suggest_local_branch_name(prompt: str) -> str:
+    """
+    プロンプト中の英単語からブランチ名を即座に作る。
+    日本語だけのプロンプトなど使える単語が無ければ、判定した接頭辞に日時を付けた名前にする。
+    """
+    lowered = prompt.lower()
+    words = list(dict.fromkeys(re.findall(r"[a-z0-9]+", lowered)))
+    prefix = "feature"
+    for candidate, keywords in _PREFIX_KEYWORDS.items():
+        if any(keyword in words if keyword.isascii() else keyword in lowered for keyword in keywords):
+            prefix = candidate
+            break
+
+    keywords = [
+        word
+        for word in words
+        if len(word) > 1 and word not in _STOPWORDS and word not in _PREFIX_KEYWORDS.get(prefix, ())
+    ]
+    name = ""
+    for word in keywords[:_LOCAL_MAX_WORDS]:
+        if len(name) + len(word) + 1 > _LOCAL_MAX_LENGTH:
+            break
+        name = f"{name}-{word}" if name else word
+    if not name:
+        from datetime import datetime
+
+        name = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return f"{prefix}/{name}"
+
+
+def lookup_cached_branch_name(prompt: str) -> str | None:
+    """同じプロンプトで以前 codex が提案したブランチ名を返す。キャッシュが無効化されていれば None を返す"""
+    if is_cache_disabled():
+        return None
+    entries = _load_name_cache()
+    key = _prompt_key(prompt)
+    name = entries.pop(key, None)
+    if name is None:
+        return None
+    entries[key] = name
+    write_json_atomic(_get_name_cache_path(), entries)
+    return name
+
+
+def store_cached_branch_name(prompt: str, name: str) -> None:
+    """codex が提案したブランチ名を保存し、古いものから捨てる"""
+    entries = _load_name_cache()
+    key = _prompt_key(prompt)
+    entries.pop(key, None)
+    entries[key] = name
+    while len(entries) > _CACHE_MAX_ENTRIES:
+        entries.pop(next(iter(entries)))
+    write_json_atomic(_get_name_cache_path(), entries)
+
+
+def start_branch_naming(
+    prompt: str, worktree_path: Path, initial_branch: str, random_suffix: str, timeout: int
+) -> None:
+    """ブランチ名の提案とリネームを別プロセスで開始する。呼び出し元は待たない"""
+    record_step(
+        _journal_name(worktree_path),
+        "requested",
+        {
+            "prompt": prompt,
+            "initial_branch": initial_branch,
+            "random_suffix": random_suffix,
+            "timeout": timeout,
+        },
+    )
+    spawn_detached("base.branch_namer", ["run", str(worktree_path)])
+
+
+def run_branch_naming(worktree_path: Path) -> None:
+    """ジャーナルに記録された依頼を、記録済みのステップを飛ばしながら最後まで処理する"""
+    journal = _journal_name(worktree_path)
+    steps = load_journal(journal)
+    request = steps.get("requested")
+    if request is None:
+        return
+
+    name = steps.get("suggested")
+    if name is None:
+        with phase("branch_name"):
+            name = suggest_branch_name(request["prompt"], request["timeout"])
+        if name is None:
+            clear_journal(journal)
+            return
+        record_step(journal, "suggested", name)
+
+    new_branch = f"ai/{name}-{request['random_suffix']}"
+    # git が受け付けない名前をキャッシュすると、次回から worktree を作れなくなるので確かめてから保存する
+    if is_valid_branch_name(new_branch, worktree_path):
+        store_cached_branch_name(request["prompt"], name)
+        rename_worktree_branch(worktree_path, request["initial_branch"], new_branch)
+    clear_journal(journal)
+
+
+def suggest_branch_name(prompt: str, timeout: int) -> str | None:
+    """codex にブランチ名を提案させる。提案が得られなければ None を返す"""
+    import tempfile
+
+    codex_prompt = f"Generate a git branch name for this task: '{prompt}'. Use kebab-case with prefix (feature/fix/refactor/docs/test). Max 50 chars."
+    schema = {
+        "type": "object",
+        "properties": {"branchName": {"type": "string"}},
+        "required": ["branchName"],
+        "additionalProperties": False,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = Path(tmp) / "output.json"
+        schema_path = Path(tmp) / "schema.json"
+        schema_path.write_text(json.dumps(schema), encoding="utf-8")
+        try:
+            result = run_command(
+                [
+                    "codex",
+                    "exec",
+                    "--output-last-message",
+                    str(output_path),
+                    "--output-schema",
+                    str(schema_path),
+                    codex_prompt,
+                ],
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                timeout=timeout,
+            )
+        except subprocess.TimeoutExpired:
+            return None
+        if result.returncode != 0:
+            return None
+        try:
+            name = json.loads(output_path.read_text(encoding="utf-8")).get("branchName", "")
+        except (OSError, ValueError):
+            return None
+
+    if not name or len(name) > _MAX_NAME_LENGTH:
+        return None
+    return name
+
+
+def rename_worktree_branch(worktree_path: Path, initial_branch: str, new_branch: str) -> bool:
+    """
+    worktree がまだ initial_branch のままならリネームし、レジストリも更新する。
+    アシスタントが並行して git を使っていると ref のロックで失敗しうるので、数回だけやり直す。
+    """
+    if not is_valid_branch_name(new_branch, worktree_path):
+        return False
+
+    for attempt in range(_RENAME_ATTEMPTS):
+        # ユーザーが既にブランチを切り替え・リネームしていたら触らない
+        if read_worktree_branch(worktree_path) != initial_branch:
+            return False
+        result = run_command(
+            ["git", "branch", "-m", initial_branch, new_branch],
+            cwd=worktree_path,
+            capture_output=True,
+        )
+        if result.returncode == 0:
+            update_worktree_branch(worktree_path, new_branch)
+            return True
+        if attempt + 1 < _RENAME_ATTEMPTS:
+            time.sleep(_RENAME_RETRY_SECONDS)
+    return False
+
+
+def is_valid_branch_name(branch_name: str, cwd: Path | None = None) -> bool:
+    """git がブランチ名として受け付ける名前かどうかを check-ref-format で確かめる"""
+    result = run_command(
+        ["git", "check-ref-format", "--branch", branch_name],
+        cwd=cwd,
+        capture_output=True,
+    )
+    return result.returncode == 0
+
+
+def _prompt_key(prompt: str) -> str:
+    """大文字小文字・空白・記号の違いを無視したプロンプトのハッシュを返す"""
+    import hashlib
+
+    normalized = " ".join(re.findall(r"\w+", prompt.lower()))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def _get_name_cache_path() -> Path:
+    """ブランチ名の LRU キャッシュのパスを取得する。挿入順が新しいものほど後ろに並ぶ"""
+    return get_cache_dir() / "branch_names.json"
+
+
+def _load_name_cache() -> dict[str, str]:
+    """ブランチ名の LRU キャッシュを読み込む。無い・壊れている場合は空とみなす"""
+    try:
+        data = json.loads(_get_name_cache_path().read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _journal_name(worktree_path: Path) -> str:
+    """worktree ごとのジャーナル名を返す"""
+    return f"branch_namer/{worktree_path}"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "run":
+        run_branch_naming(Path(sys.argv[2]))
+    else:
+        print("使い方: python -m base.branch_namer run <worktree_path>", file=sys.stderr)
+        sys.exit(1)
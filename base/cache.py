@@ -0,0 +1,137 @@
+"""~/.cache/hiho 以下に置く永続キャッシュと、~/.local/state/hiho 以下の状態ファイルの置き場所を提供する"""
+
+import json
+import os
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+FieldTtl = tuple[float, float]
+"""(fresh_ttl, stale_ttl) の組。fresh_ttl 秒までは新鮮、stale_ttl 秒までは再検証しつつ返す"""
+
+_disabled = os.environ.get("HIHO_NO_CACHE") == "1"
+_write_lock = threading.Lock()
+_revalidating: set[tuple[str, str]] = set()
+
+
+def get_cache_dir() -> Path:
+    """キャッシュディレクトリのパスを取得する"""
+    base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "hiho"
+
+
+def get_state_dir() -> Path:
+    """消えると困る状態ファイル（レジストリやジャーナル）を置くディレクトリのパスを取得する"""
+    base = os.environ.get("XDG_STATE_HOME") or str(Path.home() / ".local" / "state")
+    return Path(base) / "hiho"
+
+
+def disable_cache() -> None:
+    """キャッシュの読み出しを無効化する（取得結果の書き込みは行う）"""
+    global _disabled
+    _disabled = True
+
+
+def is_cache_disabled() -> bool:
+    """キャッシュの読み出しが無効化されているかどうかを返す"""
+    return _disabled
+
+
+def get_fields(
+    namespace: str,
+    key: str,
+    ttls: dict[str, FieldTtl],
+    fetch: Callable[[], dict[str, Any]],
+) -> dict[str, Any]:
+    """
+    ttls に列挙したフィールドをキャッシュから取得する。
+    全フィールドが新鮮ならそのまま返し、期限切れでも stale_ttl 以内なら返しつつ裏で再取得する。
+    それ以外は fetch を呼んで結果を保存してから返す。
+    """
+    if not _disabled:
+        fields = read_fields(namespace, key)
+        now = time.time()
+        ages = {
+            name: now - fields[name]["fetched_at"] for name in ttls if name in fields
+        }
+        if len(ages) == len(ttls):
+            values = {name: fields[name]["value"] for name in ttls}
+            if all(ages[name] < ttls[name][0] for name in ttls):
+                return values
+            if all(ages[name] < ttls[name][1] for name in ttls):
+                _revalidate_in_background(namespace, key, fetch)
+                return values
+
+    values = fetch()
+    store_fields(namespace, key, values)
+    return {name: values[name] for name in ttls}
+
+
+def store_fields(namespace: str, key: str, values: dict[str, Any]) -> None:
+    """フィールドの値をキャッシュに書き込む"""
+    now = time.time()
+    path = _entry_path(namespace, key)
+    with _write_lock:
+        fields = read_fields(namespace, key)
+        for name, value in values.items():
+            fields[name] = {"value": value, "fetched_at": now}
+        write_json_atomic(path, {"key": key, "fields": fields})
+
+
+def read_fields(namespace: str, key: str) -> dict[str, Any]:
+    """キャッシュファイルからフィールドを {名前: {"value", "fetched_at"}} の形で読み出す。壊れている場合は空とみなす"""
+    path = _entry_path(namespace, key)
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("key") != key:
+        return {}
+    fields = data.get("fields")
+    return fields if isinstance(fields, dict) else {}
+
+
+def _revalidate_in_background(
+    namespace: str, key: str, fetch: Callable[[], dict[str, Any]]
+) -> None:
+    """古いエントリを裏で再取得する。プロセスが先に exec された場合は次回に持ち越す"""
+    with _write_lock:
+        if (namespace, key) in _revalidating:
+            return
+        _revalidating.add((namespace, key))
+
+    def worker() -> None:
+        try:
+            store_fields(namespace, key, fetch())
+        except Exception:
+            pass
+        finally:
+            with _write_lock:
+                _revalidating.discard((namespace, key))
+
+    threading.Thread(target=worker, daemon=True).start()
+
+
+def _entry_path(namespace: str, key: str) -> Path:
+    """キーに対応するキャッシュファイルのパスを返す"""
+    import hashlib
+
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+    return get_cache_dir() / namespace / f"{digest}.json"
+
+
+def write_json_atomic(path: Path, data: Any) -> None:
+    """JSON を一時ファイル経由でアトミックに書き込む"""
+    import tempfile
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
@@ -4,6 +4,9 @@ import os
 import shlex
 import sys
 
+from base.metrics import flush_metrics
+from base.process import flush_profile, record_spawn
+
 
 def run_claude(prompt: str, worktree_path: str) -> None:
     """Claude Code CLI を起動する"""
@@ -12,7 +15,11 @@ def run_claude(prompt: str, worktree_path: str) -> None:
         f'claude --permission-mode acceptEdits {shlex.quote(prompt)}; '
         f'exec bash -i'
     )
-    os.execvp("bash", ["bash", "-lc", script])
+    command = ["bash", "-lc", script]
+    record_spawn(command, worktree_path, name="claude")
+    flush_profile()
+    flush_metrics()
+    os.execvp("bash", command)
 
 
 def get_prompt(stdin_message: str) -> str:
@@ -3,6 +3,9 @@
 import os
 import shlex
 
+from base.metrics import flush_metrics
+from base.process import flush_profile, record_spawn
+
 
 def run_codex(prompt: str, worktree_path: str) -> None:
     """Codex CLI を起動する"""
@@ -11,4 +14,8 @@ def run_codex(prompt: str, worktree_path: str) -> None:
         f'codex --ask-for-approval untrusted {shlex.quote(prompt)}; '
         f'exec bash -i'
     )
-    os.execvp("bash", ["bash", "-lc", script])
+    command = ["bash", "-lc", script]
+    record_spawn(command, worktree_path, name="codex")
+    flush_profile()
+    flush_metrics()
+    os.execvp("bash", command)
@@ -0,0 +1,243 @@
+"""
+リポジトリや GitHub の状態をメモリに保持し、Unix ソケット越しに返す常駐プロセスを提供する
+起動: hiho daemon start / 停止: hiho daemon stop
+
+デーモンは値を自分で計算せず、スクリプトが直接計算した値を受け取って保持する。
+git の状態に依存する値は .git 以下の HEAD・config・refs などの更新時刻を記録しておき、
+参照時に stat で変化を確かめて無効化する。GitHub の値は TTL が切れたら無効にする。
+デーモンが動いていない場合、クライアントは何もせずに直接計算する経路へ戻る。
+"""
+
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any, TypeVar
+
+from base.background import spawn_detached
+from base.cache import get_state_dir, is_cache_disabled
+
+T = TypeVar("T")
+
+_CONNECT_TIMEOUT = 0.2
+_MAX_ENTRIES = 4096
+# git の状態を表すファイル。これらの更新時刻が変われば、そのリポジトリの値を捨てる
+_GIT_DIR_FILES = ["HEAD"]
+_COMMON_DIR_FILES = ["config", "packed-refs", "refs/heads", "refs/remotes", "worktrees"]
+
+
+def get_socket_path() -> Path:
+    """デーモンの Unix ソケットのパスを取得する"""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir) / "hiho" / "daemon.sock"
+    return get_state_dir() / "daemon.sock"
+
+
+def get_or_compute(
+    namespace: str, compute: Callable[[], T], ttl: float | None = None
+) -> T:
+    """
+    カレントディレクトリに対する namespace の値をデーモンから引く。
+    無ければ compute で直接計算し、デーモンが動いていれば結果を預ける。
+    ttl を指定しない値は git の状態が変わるまで有効とする。
+    """
+    cwd = os.getcwd()
+    if is_cache_disabled():
+        # --no-cache / HIHO_NO_CACHE では引かずに計算し直し、新しい値だけ預ける
+        value = compute()
+        _request({"op": "put", "namespace": namespace, "cwd": cwd, "value": value, "ttl": ttl})
+        return value
+
+    response = _request({"op": "get", "namespace": namespace, "cwd": cwd})
+    if response is not None and response.get("hit"):
+        return response["value"]
+
+    value = compute()
+    if response is not None:
+        _request(
+            {"op": "put", "namespace": namespace, "cwd": cwd, "value": value, "ttl": ttl}
+        )
+    return value
+
+
+def _request(message: dict[str, Any]) -> dict[str, Any] | None:
+    """デーモンに 1 行の JSON を送り、応答を返す。動いていなければ None を返す"""
+    socket_path = get_socket_path()
+    if not socket_path.exists():
+        return None
+
+    # ソケットがあるときだけ import して、デーモンを使わない場合の起動時間を増やさない
+    import socket
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(_CONNECT_TIMEOUT)
+            client.connect(str(socket_path))
+            client.sendall(json.dumps(message).encode("utf-8") + b"\n")
+            with client.makefile("rb") as reader:
+                line = reader.readline()
+    except OSError:
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+class _Store:
+    """(namespace, cwd) ごとの値と、その有効性を確かめるための情報を保持する"""
+
+    def __init__(self) -> None:
+        self._entries: dict[tuple[str, str], dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, cwd: str) -> tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get((namespace, cwd))
+        if entry is None:
+            return False, None
+        if entry["expires_at"] is not None and time.time() >= entry["expires_at"]:
+            self._discard(namespace, cwd)
+            return False, None
+        if _stat_files(entry["watched"]) != entry["stamps"]:
+            self._discard(namespace, cwd)
+            return False, None
+        return True, entry["value"]
+
+    def put(self, namespace: str, cwd: str, value: Any, ttl: float | None) -> None:
+        watched = _find_watched_files(Path(cwd))
+        entry = {
+            "value": value,
+            "expires_at": None if ttl is None else time.time() + ttl,
+            "watched": watched,
+            "stamps": _stat_files(watched),
+        }
+        with self._lock:
+            if len(self._entries) >= _MAX_ENTRIES:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[(namespace, cwd)] = entry
+
+    def _discard(self, namespace: str, cwd: str) -> None:
+        with self._lock:
+            self._entries.pop((namespace, cwd), None)
+
+
+def _find_watched_files(cwd: Path) -> list[str]:
+    """cwd を含むリポジトリの .git と、状態を表すファイルの一覧を、git を呼ばずに求める"""
+    for directory in [cwd, *cwd.parents]:
+        dot_git = directory / ".git"
+        if dot_git.is_dir():
+            git_dir = dot_git
+            break
+        if dot_git.is_file():
+            content = dot_git.read_text(encoding="utf-8").strip()
+            git_dir = directory / content.removeprefix("gitdir: ")
+            break
+    else:
+        return []
+
+    common_dir = git_dir
+    try:
+        common_dir = git_dir / (git_dir / "commondir").read_text(encoding="utf-8").strip()
+    except OSError:
+        pass
+
+    return [
+        str(dot_git),
+        *(str(git_dir / name) for name in _GIT_DIR_FILES),
+        *(str(common_dir / name) for name in _COMMON_DIR_FILES),
+    ]
+
+
+def _stat_files(paths: list[str]) -> list[int | None]:
+    """各ファイルの更新時刻を返す。存在しなければ None とする"""
+    stamps: list[int | None] = []
+    for path in paths:
+        try:
+            stamps.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            stamps.append(None)
+    return stamps
+
+
+def serve() -> None:
+    """ソケットで待ち受け、1 接続につき 1 行の要求に応答する"""
+    import socketserver
+
+    store = _Store()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self) -> None:
+            try:
+                message = json.loads(self.rfile.readline())
+            except ValueError:
+                return
+            if message.get("op") == "get":
+                hit, value = store.get(message["namespace"], message["cwd"])
+                response = {"hit": hit, "value": value}
+            elif message.get("op") == "put":
+                store.put(
+                    message["namespace"], message["cwd"], message["value"], message["ttl"]
+                )
+                response = {}
+            else:
+                response = {"pid": os.getpid()}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    socket_path = get_socket_path()
+    socket_path.parent.mkdir(parents=True, exist_ok=True, mode=0o700)
+    socket_path.unlink(missing_ok=True)
+    old_umask = os.umask(0o077)
+    try:
+        server = Server(str(socket_path), Handler)
+    finally:
+        os.umask(old_umask)
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        socket_path.unlink(missing_ok=True)
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="hiho の状態を保持するデーモンを操作する")
+    parser.add_argument("action", choices=["start", "stop", "status", "serve"])
+    action = parser.parse_args().action
+
+    if action == "serve":
+        serve()
+        return
+
+    response = _request({"op": "ping"})
+    if action == "status":
+        if response is None:
+            print("デーモンは停止しています")
+        else:
+            print(f"デーモンは動作中です (PID: {response['pid']}, ソケット: {get_socket_path()})")
+    elif action == "start":
+        if response is not None:
+            print(f"デーモンは既に動作中です (PID: {response['pid']})")
+            return
+        spawn_detached("base.daemon", ["serve"])
+        print(f"デーモンを起動しました (ソケット: {get_socket_path()})")
+    elif response is None:
+        print("デーモンは動作していません")
+    else:
+        os.kill(response["pid"], signal.SIGTERM)
+        print(f"デーモンを停止しました (PID: {response['pid']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""ロックファイルのハッシュをキーにした依存ディレクトリのキャッシュを提供する
+
+キャッシュは ~/.cache/hiho/deps に置き、上限は `git config hiho.depCacheLimit 20g` で設定する。
+worktree への展開は reflink、hardlink、コピーの順に試す。hardlink の場合はキャッシュと実体を
+共有するため、展開先でファイルをその場で書き換えるとキャッシュ側にも反映される点に注意する。
+"""
+
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import TypedDict
+
+from base.background import spawn_detached
+from base.cache import get_cache_dir, write_json_atomic
+from base.process import run_command
+
+# ロックファイル名と、それによって内容が決まる依存ディレクトリ名
+DEPENDENCY_LOCKFILES = {
+    "package-lock.json": "node_modules",
+    "uv.lock": ".venv",
+    "poetry.lock": ".venv",
+}
+
+_DEFAULT_LIMIT_BYTES = 20 * 1024**3
+_META_FILE_NAME = "meta.json"
+_VENV_DIR_NAME = ".venv"
+
+
+class DepCacheMeta(TypedDict):
+    """キャッシュエントリのメタデータを表す型"""
+
+    lockfile: str
+    directory: str
+    source_path: str
+    size: int
+    last_used: float
+
+
+def materialize_dependencies(worktree_path: Path, repo_root: Path) -> None:
+    """
+    worktree のロックファイルに対応する依存ディレクトリをキャッシュから展開する。
+    キャッシュに無く、元リポジトリに同じロックファイルの依存ディレクトリがあれば裏でキャッシュに取り込む。
+    """
+    for lockfile, directory in DEPENDENCY_LOCKFILES.items():
+        lockfile_path = worktree_path / lockfile
+        destination = worktree_path / directory
+        if not lockfile_path.is_file() or destination.exists():
+            continue
+
+        key = _cache_key(lockfile_path)
+        entry = get_dep_cache_dir() / key
+        meta = _read_meta(entry)
+        if meta is not None:
+            method = link_tree(entry / directory, destination)
+            if directory == _VENV_DIR_NAME:
+                relocate_venv(destination, meta["source_path"])
+            meta["last_used"] = time.time()
+            write_json_atomic(entry / _META_FILE_NAME, meta)
+            print(f"依存キャッシュから {directory} を展開しました ({method})")
+            continue
+
+        source_lockfile = repo_root / lockfile
+        if (
+            (repo_root / directory).is_dir()
+            and source_lockfile.is_file()
+            and _cache_key(source_lockfile) == key
+        ):
+            spawn_detached("base.dep_cache", ["store", str(repo_root), lockfile])
+            print(f"{directory} を依存キャッシュに取り込みます（次回から展開されます）")
+
+
+def store_dependencies(repo_root: Path, lockfile: str) -> None:
+    """元リポジトリの依存ディレクトリをキャッシュに取り込み、上限を超えた分を古い順に消す"""
+    import shutil
+
+    directory = DEPENDENCY_LOCKFILES[lockfile]
+    entry = get_dep_cache_dir() / _cache_key(repo_root / lockfile)
+    if entry.exists():
+        return
+
+    staging = entry.with_name(f".tmp-{entry.name}-{os.getpid()}")
+    try:
+        link_tree(repo_root / directory, staging / directory, allow_hardlink=False)
+        meta = DepCacheMeta(
+            lockfile=lockfile,
+            directory=directory,
+            source_path=str(repo_root / directory),
+            size=_tree_size(staging / directory),
+            last_used=time.time(),
+        )
+        write_json_atomic(staging / _META_FILE_NAME, meta)
+        os.rename(staging, entry)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        return
+
+    evict_dependencies(get_dep_cache_limit())
+
+
+def evict_dependencies(limit: int) -> None:
+    """キャッシュの合計サイズが上限以下になるまで、最も長く使われていないエントリを消す"""
+    import shutil
+
+    entries = []
+    for entry in get_dep_cache_dir().iterdir():
+        # 取り込み中のステージングは meta.json を書いてから rename するので、消さないよう飛ばす
+        if entry.name.startswith(".tmp-"):
+            continue
+        meta = _read_meta(entry)
+        if meta is not None:
+            entries.append((meta["last_used"], meta["size"], entry))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= limit:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def link_tree(source: Path, destination: Path, allow_hardlink: bool = True) -> str:
+    """ディレクトリを reflink、hardlink、コピーの順に複製し、使った方法を返す"""
+    import shutil
+
+    destination.parent.mkdir(parents=True, exist_ok=True)
+
+    for command in (
+        ["cp", "-a", "--reflink=always", str(source), str(destination)],
+        ["cp", "-c", "-R", "-p", str(source), str(destination)],
+    ):
+        result = run_command(command, capture_output=True)
+        if result.returncode == 0:
+            return "reflink"
+        shutil.rmtree(destination, ignore_errors=True)
+
+    if allow_hardlink:
+        try:
+            shutil.copytree(source, destination, symlinks=True, copy_function=os.link)
+            return "hardlink"
+        except (OSError, shutil.Error):
+            shutil.rmtree(destination, ignore_errors=True)
+
+    shutil.copytree(source, destination, symlinks=True)
+    return "copy"
+
+
+def relocate_venv(venv_path: Path, source_path: str) -> None:
+    """
+    複製した venv に埋め込まれた元リポジトリの絶対パスを worktree のパスに書き換える。
+    スクリプトだけでなく editable install の .pth・finder・direct_url.json も対象にし、
+    worktree の venv が元リポジトリのソースを import しないようにする。
+    """
+    import re
+
+    targets = [venv_path / "pyvenv.cfg"]
+    bin_dir = venv_path / ("Scripts" if os.name == "nt" else "bin")
+    if bin_dir.is_dir():
+        targets += [path for path in bin_dir.iterdir() if path.is_file() and not path.is_symlink()]
+    site_packages_dirs = [venv_path / "Lib" / "site-packages"] if os.name == "nt" else []
+    site_packages_dirs += venv_path.glob("lib/python*/site-packages")
+    for site_packages in site_packages_dirs:
+        for pattern in ("*.pth", "__editable__*.py", "*.dist-info/direct_url.json"):
+            targets += site_packages.glob(pattern)
+
+    # 元リポジトリのルート自体を置き換えれば venv 内のパスも同時に直る。
+    # /repo が /repo2 や /repo.worktrees の一部にも一致しないよう、直後が区切りの場合に限る
+    old_root = re.compile(
+        re.escape(str(Path(source_path).parent).encode("utf-8")) + rb"(?=[/\\\"'\s]|$)"
+    )
+    new_root = str(venv_path.parent).encode("utf-8")
+    for path in dict.fromkeys(targets):
+        try:
+            content = path.read_bytes()
+        except OSError:
+            continue
+        if b"\0" in content[:1024]:
+            continue
+        replaced = old_root.sub(lambda _: new_root, content)
+        if replaced == content:
+            continue
+        # hardlink の場合にキャッシュ側を書き換えないよう、別ファイルとして作り直す
+        mode = path.stat().st_mode
+        path.unlink()
+        path.write_bytes(replaced)
+        path.chmod(mode)
+
+
+def get_dep_cache_dir() -> Path:
+    """依存キャッシュのディレクトリを取得する"""
+    path = get_cache_dir() / "deps"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def get_dep_cache_limit() -> int:
+    """依存キャッシュの上限バイト数を取得する"""
+    result = run_command(
+        ["git", "config", "--type=int", "--get", "hiho.depCacheLimit"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return _DEFAULT_LIMIT_BYTES
+    return int(result.stdout.strip())
+
+
+def _cache_key(lockfile_path: Path) -> str:
+    """ロックファイル名と内容のハッシュからキャッシュキーを作る"""
+    import hashlib
+
+    digest = hashlib.sha256(lockfile_path.read_bytes()).hexdigest()
+    return f"{lockfile_path.name}-{digest[:32]}"
+
+
+def _read_meta(entry: Path) -> DepCacheMeta | None:
+    """キャッシュエントリのメタデータを読む。未完成や壊れたエントリは None を返す"""
+    try:
+        return json.loads((entry / _META_FILE_NAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _tree_size(path: Path) -> int:
+    """ディレクトリ以下のファイルサイズの合計を求める"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "store":
+        store_dependencies(Path(sys.argv[2]), sys.argv[3])
+    else:
+        print("使い方: python -m base.dep_cache store <repo_root> <lockfile>", file=sys.stderr)
+        sys.exit(1)
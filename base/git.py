@@ -1,13 +1,52 @@
-"""Git 操作のユーティリティ関数を提供する"""
+"""Git 操作のユーティリティ関数を提供する
 
+fork のブランチの fetch 方法は `git config hiho.fetchProfile <名前>` で選ぶ（FETCH_PROFILES を参照）。
+未設定なら、origin が partial clone の promisor であれば blobless、そうでなければ default を使う。
+`git config hiho.fetchDepth N` を設定すると、どのプロファイルでも履歴を N コミットに絞る。
+"""
+
+import atexit
 import shutil
 import subprocess
 import sys
+import threading
+from pathlib import Path
+from typing import TypedDict
+
+from base.daemon import get_or_compute
+from base.metrics import phase
+from base.process import run_command, trace_span
+from base.worktree_manager import get_git_common_dir
+
+
+class FetchProfile(TypedDict):
+    """fetch の取り方を表す型"""
+
+    filter: str | None
+    no_tags: bool
+    negotiate_with_origin: bool
+
+
+FETCH_PROFILES: dict[str, FetchProfile] = {
+    # 素の git fetch と同じ
+    "full": FetchProfile(filter=None, no_tags=False, negotiate_with_origin=False),
+    # タグを取らず、origin の履歴を持っていることをサーバーに伝えて差分だけ受け取る
+    "default": FetchProfile(filter=None, no_tags=True, negotiate_with_origin=True),
+    # さらにファイルの中身はチェックアウトするときに必要な分だけ取りに行く
+    "blobless": FetchProfile(filter="blob:none", no_tags=True, negotiate_with_origin=True),
+}
+
+# 先行 fetch した PR 番号ごとの受信バイト数。失敗した場合は None
+_prefetched: dict[int, int | None] = {}
+# 実行中の先行 fetch の git プロセスと、取り消された PR 番号
+_prefetch_processes: dict[int, subprocess.Popen] = {}
+_prefetch_cancelled: set[int] = set()
+_prefetch_lock = threading.Lock()
 
 
 def is_git_repository() -> bool:
     """カレントディレクトリが git リポジトリ内かどうかを判定する"""
-    result = subprocess.run(
+    result = run_command(
         ["git", "rev-parse", "--git-dir"],
         capture_output=True,
     )
@@ -22,16 +61,308 @@ def check_commands(commands: list[str]) -> None:
             sys.exit(1)
 
 
-def fetch_remote_branch(remote_name: str, branch_name: str) -> None:
-    """リモートブランチを fetch する"""
-    result = subprocess.run(
-        ["git", "fetch", remote_name, branch_name],
+def fetch_remote_branch(
+    remote_name: str,
+    branch_name: str,
+    pr_number: int | None = None,
+    local_branch: str | None = None,
+    prefetch: threading.Thread | None = None,
+) -> None:
+    """
+    リモートブランチを fetch して refs/remotes/<remote_name>/<branch_name> を更新する。
+    pr_number を指定すると、まず origin の refs/pull/<pr_number>/head から取り、失敗したら fork から取る。
+    local_branch を指定すると、同じ fetch でローカルブランチも作成または fast-forward で更新する。
+    prefetch に start_pull_request_prefetch の戻り値を渡すと、先行 fetch が成功していればそれを使って通信しない。
+    """
+    targets = [f"refs/remotes/{remote_name}/{branch_name}"]
+    if local_branch is not None:
+        targets.append(f"refs/heads/{local_branch}")
+
+    if prefetch is not None and pr_number is not None:
+        prefetch.join()
+        if _prefetched.get(pr_number) is not None and _attach_prefetched(pr_number, targets):
+            print(
+                f"ブランチ '{remote_name}/{branch_name}' を先行fetchした origin の refs/pull/{pr_number}/head から作成しました"
+            )
+            return
+
+    profile_name, profile, depth = get_fetch_profile()
+    sources = [(remote_name, f"refs/heads/{branch_name}")]
+    if pr_number is not None and remote_name != "origin":
+        sources.insert(0, ("origin", f"refs/pull/{pr_number}/head"))
+
+    for source_remote, source_ref in sources:
+        received = _fetch_refs(source_remote, source_ref, targets, profile, depth)
+        if received is not None:
+            print(
+                f"ブランチ '{remote_name}/{branch_name}' を {source_remote} の {source_ref} からfetchしました"
+                f" (受信: {_format_bytes(received)}, プロファイル: {profile_name})"
+            )
+            return
+
+    raise Exception(
+        f"リモート '{remote_name}' のブランチ '{branch_name}' のfetchに失敗しました"
+    )
+
+
+def start_pull_request_prefetch(pr_number: int) -> threading.Thread:
+    """
+    origin の refs/pull/<pr_number>/head の fetch を別スレッドで始める。
+    PR の情報を取得している間に通信を済ませておき、fork のブランチが分かったらスレッドを fetch_remote_branch に渡す。
+    使わないことが分かったら cancel_pull_request_prefetch で止める。
+    """
+    thread = threading.Thread(
+        target=_prefetch_pull_request, args=(pr_number,), name="prefetch", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def cancel_pull_request_prefetch(prefetch: threading.Thread, pr_number: int) -> None:
+    """
+    先行 fetch を止め、取り込み済みなら ref を消す。
+    exec の後に裏で git fetch が続いて ref が残らないよう、使わないことが分かったらアシスタントの起動前に呼ぶ。
+    """
+    _stop_prefetch(pr_number)
+    prefetch.join()
+    _discard_prefetched(pr_number)
+
+
+def get_fetch_profile() -> tuple[str, FetchProfile, int | None]:
+    """設定から fetch プロファイルの名前・中身と、履歴を絞る深さを取得する"""
+    values = get_or_compute("fetch_config", _read_fetch_config)
+
+    name = values.get("hiho.fetchprofile")
+    if name is None:
+        name = "blobless" if values.get("remote.origin.promisor") == "true" else "default"
+    if name not in FETCH_PROFILES:
+        raise Exception(
+            f"hiho.fetchProfile には {', '.join(FETCH_PROFILES)} のいずれかを指定してください: {name}"
+        )
+
+    depth_text = values.get("hiho.fetchdepth")
+    if depth_text is not None and not depth_text.isdigit():
+        raise Exception(f"hiho.fetchDepth には正の整数を指定してください: {depth_text}")
+    depth = int(depth_text) if depth_text else None
+    return name, FETCH_PROFILES[name], depth or None
+
+
+def build_fetch_options(profile: FetchProfile, remote_name: str, depth: int | None) -> list[str]:
+    """fetch プロファイルを git fetch のオプションに変換する"""
+    options: list[str] = []
+    if profile["no_tags"]:
+        options.append("--no-tags")
+    if profile["filter"] is not None:
+        options.append(f"--filter={profile['filter']}")
+    if profile["negotiate_with_origin"]:
+        # fork の履歴の大半は origin と共通なので、origin と取得先の既知のコミットだけを交渉に使う
+        options.append("--negotiation-tip=refs/remotes/origin/*")
+        if remote_name != "origin":
+            options.append(f"--negotiation-tip=refs/remotes/{remote_name}/*")
+    if depth is not None:
+        options.append(f"--depth={depth}")
+    return options
+
+
+def _fetch_refs(
+    remote_name: str, source_ref: str, targets: list[str], profile: FetchProfile, depth: int | None
+) -> int | None:
+    """
+    source_ref を fetch して targets の ref を更新し、受信したバイト数を返す。失敗したら None を返す。
+    targets の先頭は強制的に更新し、残りは fast-forward できる場合だけ更新する。
+    """
+    packs_before = _list_packs()
+    result = run_command(
+        _build_fetch_command(remote_name, source_ref, targets, profile, depth),
         capture_output=True,
     )
+    if result.returncode != 0:
+        return None
+    return sum(size for name, size in _list_packs().items() if name not in packs_before)
 
+
+def _build_fetch_command(
+    remote_name: str, source_ref: str, targets: list[str], profile: FetchProfile, depth: int | None
+) -> list[str]:
+    """source_ref を targets に取り込む git fetch のコマンドを組み立てる"""
+    return [
+        "git",
+        # 受け取ったオブジェクトを loose に展開させず、パックの大きさを受信量として測れるようにする
+        "-c",
+        "fetch.unpackLimit=1",
+        "fetch",
+        *build_fetch_options(profile, remote_name, depth),
+        remote_name,
+        f"+{source_ref}:{targets[0]}",
+        *(f"{source_ref}:{ref}" for ref in targets[1:]),
+    ]
+
+
+def _prefetch_pull_request(pr_number: int) -> None:
+    """
+    origin の PR の head を先行 fetch 用の ref に取り込み、受信したバイト数（失敗や取り消しなら None）を記録する。
+    途中で止められるよう、run_command ではなく Popen で起動する。
+    """
+    received = None
+    # 設定の誤りなどはこの後の通常の fetch で改めて報告されるので、ここでは失敗として扱うだけにする
+    try:
+        with phase("git_prefetch"), trace_span("git fetch (prefetch)", pr_number=pr_number):
+            profile_name, profile, depth = get_fetch_profile()
+            command = _build_fetch_command(
+                "origin", f"refs/pull/{pr_number}/head", [_prefetch_ref(pr_number)], profile, depth
+            )
+            packs_before = _list_packs()
+            with _prefetch_lock:
+                if pr_number in _prefetch_cancelled:
+                    return
+                process = subprocess.Popen(
+                    command,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+                _prefetch_processes[pr_number] = process
+            if process.wait() == 0:
+                received = sum(
+                    size for name, size in _list_packs().items() if name not in packs_before
+                )
+    except Exception:
+        received = None
+    _prefetched[pr_number] = received
+    if received is not None and pr_number not in _prefetch_cancelled:
+        # 標準出力は PR の情報の表示と混ざるので、進捗は標準エラーに出す
+        print(
+            f"origin の refs/pull/{pr_number}/head を先行fetchしました"
+            f" (受信: {_format_bytes(received)}, プロファイル: {profile_name})",
+            file=sys.stderr,
+        )
+
+
+def _stop_prefetch(pr_number: int) -> None:
+    """先行 fetch を取り消し、git fetch が実行中なら終了させる"""
+    with _prefetch_lock:
+        _prefetch_cancelled.add(pr_number)
+        process = _prefetch_processes.get(pr_number)
+        if process is not None and process.poll() is None:
+            process.terminate()
+
+
+def _discard_prefetched(pr_number: int) -> None:
+    """先行 fetch の ref が作られていれば消す。片付け済みの先行 fetch は終了時の片付けの対象から外す"""
+    with _prefetch_lock:
+        _prefetch_processes.pop(pr_number, None)
+    if _prefetched.pop(pr_number, None) is not None:
+        run_command(["git", "update-ref", "-d", _prefetch_ref(pr_number)], capture_output=True)
+
+
+def _cancel_remaining_prefetches() -> None:
+    """sys.exit などで途中終了する場合に、使われなかった先行 fetch を止めて ref を片付ける"""
+    for pr_number, process in list(_prefetch_processes.items()):
+        _stop_prefetch(pr_number)
+        # スレッドが結果を記録する前に終了する場合もあるので、fetch の終了コードで ref の有無を判断する
+        if process.wait() == 0:
+            run_command(["git", "update-ref", "-d", _prefetch_ref(pr_number)], capture_output=True)
+
+
+def _attach_prefetched(pr_number: int, targets: list[str]) -> bool:
+    """先行 fetch した PR の head を、リポジトリ内の fetch で targets の ref に付け替える"""
+    prefetch_ref = _prefetch_ref(pr_number)
+    result = run_command(
+        [
+            "git",
+            "fetch",
+            "--no-tags",
+            ".",
+            f"+{prefetch_ref}:{targets[0]}",
+            *(f"{prefetch_ref}:{ref}" for ref in targets[1:]),
+        ],
+        capture_output=True,
+    )
+    _discard_prefetched(pr_number)
+    return result.returncode == 0
+
+
+def _prefetch_ref(pr_number: int) -> str:
+    """
+    先行 fetch した PR の head を置く ref を返す。
+    使わなかった場合も cancel_pull_request_prefetch か終了時の片付けで消す。
+    """
+    return f"refs/hiho/prefetch/pull/{pr_number}"
+
+
+def _read_fetch_config() -> dict[str, str]:
+    """fetch プロファイルに関わる設定を 1 回の git config で読む。キーは小文字になる"""
+    result = run_command(
+        [
+            "git",
+            "config",
+            "--get-regexp",
+            r"^(hiho\.fetch(profile|depth)|remote\.origin\.promisor)$",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    return dict(line.split(" ", 1) for line in result.stdout.splitlines() if " " in line)
+
+
+def _list_packs() -> dict[str, int]:
+    """オブジェクトのパックファイルの名前と大きさを取得する"""
+    pack_dir = Path(get_git_common_dir()) / "objects" / "pack"
+    try:
+        return {path.name: path.stat().st_size for path in pack_dir.glob("*.pack")}
+    except OSError:
+        return {}
+
+
+def _format_bytes(size: int) -> str:
+    """バイト数を読みやすい単位に変換する"""
+    value = float(size)
+    for unit in ("B", "KiB", "MiB"):
+        if value < 1024:
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} GiB"
+
+
+def get_upstream_index() -> dict[str, dict[str, str]]:
+    """
+    ローカルブランチを upstream で引ける索引を {リモート名: {リモートのブランチ名: ローカルブランチ名}} の形で返す。
+    git branch -vv と違って ahead/behind を数えないので、ブランチが多くても 1 回の for-each-ref で済む。
+    """
+    return get_or_compute("upstream_index", _read_upstream_index)
+
+
+def find_local_branch_for_remote(remote_name: str, remote_branch: str) -> str | None:
+    """リモートブランチを upstream に持つローカルブランチを検索する"""
+    return get_upstream_index().get(remote_name, {}).get(remote_branch)
+
+
+def _read_upstream_index() -> dict[str, dict[str, str]]:
+    """for-each-ref で全ローカルブランチの upstream を読み、索引を作る"""
+    result = run_command(
+        [
+            "git",
+            "for-each-ref",
+            "--format=%(refname:short)%00%(upstream:remotename)%00%(upstream:remoteref)",
+            "refs/heads",
+        ],
+        capture_output=True,
+        encoding="utf-8",
+        errors="replace",
+    )
+    index: dict[str, dict[str, str]] = {}
     if result.returncode != 0:
-        raise Exception(
-            f"リモート '{remote_name}' のブランチ '{branch_name}' のfetchに失敗しました"
+        return index
+
+    for line in result.stdout.splitlines():
+        local_branch, remote_name, remote_ref = line.split("\0")
+        # upstream が無いブランチや、ローカルのブランチを upstream にしているものは対象外
+        if not remote_name or remote_name == "." or not remote_ref.startswith("refs/heads/"):
+            continue
+        index.setdefault(remote_name, {}).setdefault(
+            remote_ref.removeprefix("refs/heads/"), local_branch
         )
+    return index
+
 
-    print(f"ブランチ '{remote_name}/{branch_name}' をfetchしました")
+atexit.register(_cancel_remaining_prefetches)
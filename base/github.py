@@ -1,8 +1,47 @@
 """GitHub API 操作のユーティリティ関数を提供する"""
 
-import json
-import subprocess
-from typing import TypedDict
+import functools
+import os
+import re
+from pathlib import Path
+from typing import Any, TypedDict
+from urllib.parse import quote
+
+from base.github_api import graphql, request, rest
+from base.cache import FieldTtl, get_fields
+from base.daemon import get_or_compute
+from base.process import run_command
+
+_REMOTE_URL_PATTERN = re.compile(
+    r"[:/](?P<owner>[^/:]+)/(?P<repo>[^/]+?)(?:\.git)?/?$"
+)
+
+_MINUTE = 60
+_HOUR = 60 * _MINUTE
+_DAY = 24 * _HOUR
+
+# フィールドごとの (fresh_ttl, stale_ttl)。変わらない事実は長く、変わり得るものは短く持つ
+_REPO_TTLS: dict[str, FieldTtl] = {
+    "owner": (7 * _DAY, 90 * _DAY),
+    "name": (7 * _DAY, 90 * _DAY),
+}
+_USER_TTLS: dict[str, FieldTtl] = {
+    "login": (_DAY, 30 * _DAY),
+}
+_PR_FORK_TTLS: dict[str, FieldTtl] = {
+    "fork_owner": (_DAY, 30 * _DAY),
+    "fork_repo": (_DAY, 30 * _DAY),
+    "branch": (_DAY, 30 * _DAY),
+}
+_PR_DETAIL_TTLS: dict[str, FieldTtl] = {
+    **_PR_FORK_TTLS,
+    "author": (30 * _DAY, 90 * _DAY),
+    "maintainer_can_modify": (5 * _MINUTE, _HOUR),
+}
+
+
+# デーモンに預けた GitHub の値を使い続ける時間。maintainer_can_modify の鮮度に合わせる
+_DAEMON_TTL = 5 * _MINUTE
 
 
 class PRDetail(TypedDict):
@@ -15,90 +54,278 @@ class PRDetail(TypedDict):
     maintainer_can_modify: bool
 
 
+class PRContext(TypedDict):
+    """PR 関連スクリプトが必要とする viewer・リポジトリ・PR の情報をまとめた型"""
+
+    viewer: str
+    org: str
+    repo: str
+    number: int
+    author: str
+    fork_owner: str
+    fork_repo: str
+    branch: str
+    maintainer_can_modify: bool
+
+
+_PR_CONTEXT_QUERY = """
+query($owner: String!, $repo: String!, $number: Int!) {
+  viewer { login }
+  repository(owner: $owner, name: $repo) {
+    owner { login }
+    name
+    pullRequest(number: $number) {
+      author { login }
+      headRefName
+      headRepository { name owner { login } }
+      maintainerCanModify
+    }
+  }
+}
+"""
+
+
 def get_current_org_repo() -> tuple[str, str]:
     """現在のリポジトリの org と repo を取得する"""
-    result = subprocess.run(
-        ["gh", "repo", "view", "--json", "owner,name"],
-        capture_output=True,
-        text=True,
+    values = get_or_compute(
+        "org_repo",
+        lambda: get_fields("repo", _repo_cache_key(), _REPO_TTLS, _fetch_current_org_repo),
+        ttl=_DAEMON_TTL,
     )
-    if result.returncode != 0:
-        raise Exception("現在のリポジトリ情報を取得できませんでした")
+    return values["owner"], values["name"]
+
 
-    data = json.loads(result.stdout)
-    return data["owner"]["login"], data["name"]
+def _fetch_current_org_repo() -> dict[str, Any]:
+    """リモート URL から対象リポジトリを特定し、API で正式な org と repo を取得する"""
+    owner, repo = _resolve_remote_repo()
+    try:
+        data = rest("GET", f"repos/{owner}/{repo}")
+    except Exception as e:
+        raise Exception("現在のリポジトリ情報を取得できませんでした") from e
+    return {"owner": data["owner"]["login"], "name": data["name"]}
 
 
 def get_current_user() -> str:
     """現在の GitHub ユーザー名を取得する"""
-    result = subprocess.run(
-        ["gh", "api", "user", "--jq", ".login"],
-        capture_output=True,
-        text=True,
+    key = _user_cache_key()
+    values = get_or_compute(
+        f"user:{key}",
+        lambda: get_fields("user", key, _USER_TTLS, _fetch_current_user),
+        ttl=_DAEMON_TTL,
     )
-    if result.returncode != 0:
-        raise Exception("現在のGitHubユーザーを取得できませんでした")
+    return values["login"]
 
-    return result.stdout.strip()
+
+def _fetch_current_user() -> dict[str, Any]:
+    """API で現在の GitHub ユーザー名を取得する"""
+    try:
+        data = rest("GET", "user")
+    except Exception as e:
+        raise Exception("現在のGitHubユーザーを取得できませんでした") from e
+    return {"login": data["login"]}
 
 
 def get_pr_fork_info(pr_number: int) -> tuple[str, str, str]:
     """PR の fork owner/repo/branch を取得する"""
-    result = subprocess.run(
-        [
-            "gh",
-            "pr",
-            "view",
-            str(pr_number),
-            "--json",
-            "headRepositoryOwner,headRepository,headRefName",
-        ],
+    values = get_fields(
+        "pr",
+        _pr_cache_key(pr_number),
+        _PR_FORK_TTLS,
+        lambda: _fetch_pr_detail(pr_number),
+    )
+    return values["fork_owner"], values["fork_repo"], values["branch"]
+
+
+def get_pr_detail(pr_number: int) -> PRDetail:
+    """PR の author, fork 情報, maintainerCanModify を一括取得する"""
+    values = get_fields(
+        "pr",
+        _pr_cache_key(pr_number),
+        _PR_DETAIL_TTLS,
+        lambda: _fetch_pr_detail(pr_number),
+    )
+    return PRDetail(
+        author=values["author"],
+        fork_owner=values["fork_owner"],
+        fork_repo=values["fork_repo"],
+        branch=values["branch"],
+        maintainer_can_modify=values["maintainer_can_modify"],
+    )
+
+
+def _fetch_pr_detail(pr_number: int) -> dict[str, Any]:
+    """API で PR の詳細情報を取得する"""
+    org, repo = get_current_org_repo()
+    try:
+        data = rest("GET", f"repos/{org}/{repo}/pulls/{pr_number}")
+    except Exception as e:
+        raise Exception(f"PR #{pr_number} の情報を取得できませんでした") from e
+
+    head_repo = data["head"]["repo"]
+    if head_repo is None:
+        raise Exception(f"PR #{pr_number} の fork リポジトリが見つかりませんでした")
+    return {
+        "author": data["user"]["login"],
+        "fork_owner": head_repo["owner"]["login"],
+        "fork_repo": head_repo["name"],
+        "branch": data["head"]["ref"],
+        "maintainer_can_modify": data["maintainer_can_modify"],
+    }
+
+
+def fetch_pr_context(pr_number: int) -> PRContext:
+    """viewer・リポジトリ・PR の情報を 1 回の GraphQL リクエストでまとめて取得する"""
+    return get_or_compute(
+        f"pr_context:{pr_number}:{_user_cache_key()}",
+        lambda: _load_pr_context(pr_number),
+        ttl=_DAEMON_TTL,
+    )
+
+
+def _load_pr_context(pr_number: int) -> PRContext:
+    """ディスクキャッシュと GraphQL から PR の情報を組み立てる"""
+    fetch = functools.cache(lambda: _fetch_pr_context(pr_number))
+    repo = get_fields("repo", _repo_cache_key(), _REPO_TTLS, lambda: fetch()["repo"])
+    user = get_fields("user", _user_cache_key(), _USER_TTLS, lambda: fetch()["user"])
+    pr = get_fields(
+        "pr", _pr_cache_key(pr_number), _PR_DETAIL_TTLS, lambda: fetch()["pr"]
+    )
+    return PRContext(
+        viewer=user["login"],
+        org=repo["owner"],
+        repo=repo["name"],
+        number=pr_number,
+        author=pr["author"],
+        fork_owner=pr["fork_owner"],
+        fork_repo=pr["fork_repo"],
+        branch=pr["branch"],
+        maintainer_can_modify=pr["maintainer_can_modify"],
+    )
+
+
+def _fetch_pr_context(pr_number: int) -> dict[str, dict[str, Any]]:
+    """GraphQL で viewer・リポジトリ・PR を取得し、キャッシュの名前空間ごとに分けて返す"""
+    owner, repo = _resolve_remote_repo()
+    try:
+        data = graphql(
+            _PR_CONTEXT_QUERY, {"owner": owner, "repo": repo, "number": pr_number}
+        )
+    except Exception as e:
+        raise Exception(f"PR #{pr_number} の情報を取得できませんでした") from e
+
+    repository = data["repository"]
+    pull_request = repository["pullRequest"]
+    if pull_request is None or pull_request["headRepository"] is None:
+        raise Exception(f"PR #{pr_number} の情報を取得できませんでした")
+
+    head_repository = pull_request["headRepository"]
+    return {
+        "repo": {"owner": repository["owner"]["login"], "name": repository["name"]},
+        "user": {"login": data["viewer"]["login"]},
+        "pr": {
+            "author": (pull_request["author"] or {"login": "ghost"})["login"],
+            "fork_owner": head_repository["owner"]["login"],
+            "fork_repo": head_repository["name"],
+            "branch": pull_request["headRefName"],
+            "maintainer_can_modify": pull_request["maintainerCanModify"],
+        },
+    }
+
+
+def _resolve_remote_repo() -> tuple[str, str]:
+    """gh と同じ優先順位でリモートを選び、その URL から owner と repo を取り出す"""
+    result = run_command(
+        ["git", "config", "--get-regexp", r"^remote\."],
         capture_output=True,
         text=True,
     )
-    if result.returncode != 0:
-        raise Exception(f"PR #{pr_number} の情報を取得できませんでした")
+    urls: dict[str, str] = {}
+    resolved: list[str] = []
+    for line in result.stdout.splitlines():
+        key, _, value = line.partition(" ")
+        if key.endswith(".url"):
+            urls[key[len("remote.") : -len(".url")]] = value
+        elif key.endswith(".gh-resolved") and value == "base":
+            resolved.append(key[len("remote.") : -len(".gh-resolved")])
 
-    data = json.loads(result.stdout)
-    fork_owner = data["headRepositoryOwner"]["login"]
-    fork_repo = data["headRepository"]["name"]
-    branch_name = data["headRefName"]
+    priority = resolved + ["upstream", "github", "origin"]
+    names = sorted(
+        urls,
+        key=lambda name: priority.index(name) if name in priority else len(priority),
+    )
+    for name in names:
+        match = _REMOTE_URL_PATTERN.search(urls[name])
+        if match:
+            return match.group("owner"), match.group("repo")
 
-    return fork_owner, fork_repo, branch_name
+    raise Exception("現在のリポジトリ情報を取得できませんでした")
 
 
-def get_pr_detail(pr_number: int) -> PRDetail:
-    """PR の author, fork 情報, maintainerCanModify を一括取得する"""
-    result = subprocess.run(
-        [
-            "gh",
-            "pr",
-            "view",
-            str(pr_number),
-            "--json",
-            "author,headRepositoryOwner,headRepository,headRefName,maintainerCanModify",
-        ],
+def find_remote_for_repo(owner: str, repo: str) -> str | None:
+    """owner/repo を指すリモート名を探す。見つからなければ None を返す"""
+    result = run_command(
+        ["git", "config", "--get-regexp", r"^remote\..*\.url$"],
         capture_output=True,
         text=True,
     )
     if result.returncode != 0:
-        raise Exception(f"PR #{pr_number} の情報を取得できませんでした")
+        return None
 
-    data = json.loads(result.stdout)
-    return PRDetail(
-        author=data["author"]["login"],
-        fork_owner=data["headRepositoryOwner"]["login"],
-        fork_repo=data["headRepository"]["name"],
-        branch=data["headRefName"],
-        maintainer_can_modify=data["maintainerCanModify"],
+    for line in result.stdout.splitlines():
+        key, _, url = line.partition(" ")
+        match = _REMOTE_URL_PATTERN.search(url)
+        if (
+            match
+            and match.group("owner").lower() == owner.lower()
+            and match.group("repo").lower() == repo.lower()
+        ):
+            return key[len("remote.") : -len(".url")]
+    return None
+
+
+@functools.cache
+def _repo_cache_key() -> str:
+    """リポジトリのルートと gh が参照するリモートの URL からキャッシュキーを作る"""
+    root = run_command(
+        ["git", "rev-parse", "--show-toplevel"],
+        capture_output=True,
+        text=True,
+    )
+    remotes = run_command(
+        ["git", "config", "--get-regexp", r"^remote\.(upstream|github|origin)\.url$"],
+        capture_output=True,
+        text=True,
     )
+    return f"{root.stdout.strip()}\n{remotes.stdout.strip()}"
+
+
+def _user_cache_key() -> str:
+    """gh の認証設定の更新時刻からキャッシュキーを作る。gh auth switch で切り替わる"""
+    import hashlib
+
+    config_dir = os.environ.get("GH_CONFIG_DIR") or str(
+        Path.home() / ".config" / "gh"
+    )
+    hosts_file = Path(config_dir) / "hosts.yml"
+    try:
+        mtime = hosts_file.stat().st_mtime_ns
+    except OSError:
+        mtime = 0
+    token = os.environ.get("GH_TOKEN") or os.environ.get("GITHUB_TOKEN") or ""
+    token_hint = hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+    return f"{hosts_file}\n{mtime}\n{token_hint}"
+
+
+def _pr_cache_key(pr_number: int) -> str:
+    """リポジトリと PR 番号からキャッシュキーを作る"""
+    return f"{_repo_cache_key()}\n#{pr_number}"
 
 
 def add_fork_remote(fork_owner: str, repo_name: str) -> str:
     """fork リモートを追加する"""
     remote_name = fork_owner
 
-    check_result = subprocess.run(
+    check_result = run_command(
         ["git", "remote", "get-url", remote_name],
         capture_output=True,
     )
@@ -107,7 +334,7 @@ def add_fork_remote(fork_owner: str, repo_name: str) -> str:
         print(f"リモート '{remote_name}' は既に存在します")
         return remote_name
 
-    result = subprocess.run(
+    result = run_command(
         [
             "git",
             "remote",
@@ -123,3 +350,44 @@ def add_fork_remote(fork_owner: str, repo_name: str) -> str:
 
     print(f"リモート '{remote_name}' を追加しました")
     return remote_name
+
+
+def relay_branch(
+    source_owner: str,
+    source_repo: str,
+    dest_owner: str,
+    dest_repo: str,
+    branch: str,
+    dest_branch: str | None = None,
+    force: bool = False,
+) -> str | None:
+    """
+    同じ fork ネットワーク内のリポジトリ間で、ブランチを refs API だけでサーバー側に移す。
+    移動先のブランチ名は dest_branch（省略時は branch）で、無ければ作成し、あれば fast-forward する。移した SHA を返す。
+    force を指定すると、移動先に残っていたブランチを fast-forward できなくても上書きする。
+    オブジェクトが移動先から見えない・fast-forward できない・権限が無いなどで移せなかった場合は None を返す。
+    """
+    ref = f"heads/{quote(branch, safe='/')}"
+    dest_branch = dest_branch or branch
+    dest_ref = f"heads/{quote(dest_branch, safe='/')}"
+    source = request("GET", f"repos/{source_owner}/{source_repo}/git/ref/{ref}")
+    if source["status"] != 200 or not isinstance(source["data"], dict):
+        return None
+    sha = source["data"]["object"]["sha"]
+
+    updated = request(
+        "PATCH",
+        f"repos/{dest_owner}/{dest_repo}/git/refs/{dest_ref}",
+        {"sha": sha, "force": force},
+    )
+    if updated["status"] == 200:
+        return sha
+
+    created = request(
+        "POST",
+        f"repos/{dest_owner}/{dest_repo}/git/refs",
+        {"ref": f"refs/heads/{dest_branch}", "sha": sha},
+    )
+    if created["status"] == 201:
+        return sha
+    return None
@@ -0,0 +1,266 @@
+"""gh を毎回起動せずに GitHub の REST / GraphQL API を呼ぶ HTTP クライアントを提供する"""
+
+from __future__ import annotations
+
+import functools
+import json
+import os
+import threading
+from typing import TYPE_CHECKING, Any, TypedDict
+from urllib.parse import urljoin, urlsplit
+
+from base.cache import is_cache_disabled, read_fields, store_fields
+from base.process import run_command
+
+if TYPE_CHECKING:
+    import http.client
+
+_DEFAULT_API_URL = "https://api.github.com"
+_TIMEOUT = 30
+_MAX_IDLE_PER_HOST = 8
+_REDIRECT_STATUSES = {301, 302, 307, 308}
+# 送信後に失敗しても、送り直して副作用が重ならないメソッド
+_IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+class ApiResponse(TypedDict):
+    """API レスポンスを表す型"""
+
+    status: int
+    headers: dict[str, str]
+    data: Any
+
+
+_idle_connections: dict[tuple[str, str, int], list[http.client.HTTPConnection]] = {}
+_pool_lock = threading.Lock()
+
+
+def get_api_base_url() -> str:
+    """REST API のベース URL を取得する。HIHO_GITHUB_API_URL でスタブサーバーに差し替えられる"""
+    return os.environ.get("HIHO_GITHUB_API_URL", _DEFAULT_API_URL).rstrip("/")
+
+
+def get_graphql_url() -> str:
+    """GraphQL API の URL を取得する"""
+    url = os.environ.get("HIHO_GITHUB_GRAPHQL_URL")
+    if url:
+        return url
+    base = get_api_base_url()
+    if base.endswith("/api/v3"):
+        return base[: -len("/v3")] + "/graphql"
+    return base + "/graphql"
+
+
+@functools.cache
+def get_token() -> str:
+    """API トークンを取得する。環境変数が無ければ gh の認証情報を使う"""
+    token = os.environ.get("GH_TOKEN") or os.environ.get("GITHUB_TOKEN")
+    if token:
+        return token
+
+    result = run_command(
+        ["gh", "auth", "token"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0 or not result.stdout.strip():
+        raise Exception("GitHubのトークンを取得できませんでした。gh auth login を実行してください")
+    return result.stdout.strip()
+
+
+def request(
+    method: str,
+    path: str,
+    body: Any = None,
+    headers: dict[str, str] | None = None,
+    idempotent: bool | None = None,
+) -> ApiResponse:
+    """
+    API にリクエストを送る。HTTP ステータスによる例外は送出しない。
+    idempotent は送信後に接続が切れたとき送り直してよいかどうかで、省略時はメソッドから決める。
+    """
+    url = path if "://" in path else f"{get_api_base_url()}/{path.lstrip('/')}"
+    request_headers = {
+        "Accept": "application/vnd.github+json",
+        "Authorization": f"Bearer {get_token()}",
+        "User-Agent": "hiho_scripts",
+        "X-GitHub-Api-Version": "2022-11-28",
+    }
+    if headers:
+        request_headers.update(headers)
+    payload = None
+    if body is not None:
+        payload = json.dumps(body).encode("utf-8")
+        request_headers["Content-Type"] = "application/json"
+
+    if idempotent is None:
+        idempotent = method in _IDEMPOTENT_METHODS
+
+    for _ in range(5):
+        status, response_headers, raw = _send(method, url, payload, request_headers, idempotent)
+        if status in _REDIRECT_STATUSES and "location" in response_headers:
+            redirected = urljoin(url, response_headers["location"])
+            # 別のホストへのリダイレクトにはトークンを渡さない
+            if urlsplit(redirected).netloc != urlsplit(url).netloc:
+                request_headers.pop("Authorization", None)
+            url = redirected
+            continue
+        break
+
+    data: Any = None
+    if raw:
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            data = raw.decode("utf-8", errors="replace")
+    return ApiResponse(status=status, headers=response_headers, data=data)
+
+
+def conditional_get(path: str, namespace: str, immutable: bool = False) -> ApiResponse:
+    """
+    前回の ETag を If-None-Match に付けて GET する。
+    304 の場合やネットワークに繋がらない場合は、ディスクに保存しておいた前回の結果を返す。
+    immutable なリソース（SHA 指定の blob など）は保存済みならリクエスト自体を省く。
+    キャッシュが無効化されている場合は保存済みの結果を使わずに取得し直す。
+    """
+    key = f"{get_api_base_url()}/{path}"
+    cached = None if is_cache_disabled() else read_fields(namespace, key).get("response")
+    if immutable and cached:
+        return _cached_response(cached["value"])
+    headers = {}
+    if cached and cached["value"]["etag"]:
+        headers["If-None-Match"] = cached["value"]["etag"]
+
+    try:
+        response = request("GET", path, headers=headers)
+    except OSError:
+        if cached:
+            return _cached_response(cached["value"])
+        raise
+
+    if response["status"] == 304 and cached:
+        return _cached_response(cached["value"])
+    if response["status"] == 200 and "etag" in response["headers"]:
+        store_fields(
+            namespace,
+            key,
+            {"response": {"etag": response["headers"]["etag"], "data": response["data"]}},
+        )
+    return response
+
+
+def rest(method: str, path: str, body: Any = None) -> Any:
+    """REST API を呼び、失敗した場合は例外を送出する"""
+    response = request(method, path, body)
+    if response["status"] >= 400:
+        raise Exception(
+            f"GitHub API {method} {path} が失敗しました "
+            f"(HTTP {response['status']}): {_error_message(response)}"
+        )
+    return response["data"]
+
+
+def graphql(query: str, variables: dict[str, Any]) -> dict[str, Any]:
+    """GraphQL API を呼び、data を返す"""
+    # クエリは読み取りだけなので、接続が切れたら送り直してよい
+    response = request(
+        "POST",
+        get_graphql_url(),
+        {"query": query, "variables": variables},
+        idempotent=not query.lstrip().startswith("mutation"),
+    )
+    data = response["data"]
+    if response["status"] >= 400 or not isinstance(data, dict):
+        raise Exception(
+            f"GitHub GraphQL API が失敗しました "
+            f"(HTTP {response['status']}): {_error_message(response)}"
+        )
+    if data.get("errors"):
+        messages = ", ".join(error.get("message", "") for error in data["errors"])
+        raise Exception(f"GitHub GraphQL API がエラーを返しました: {messages}")
+    return data["data"]
+
+
+def _cached_response(cached: dict[str, Any]) -> ApiResponse:
+    """保存しておいた結果から ApiResponse を組み立てる"""
+    return ApiResponse(
+        status=200, headers={"etag": cached["etag"]}, data=cached["data"]
+    )
+
+
+def _error_message(response: ApiResponse) -> str:
+    """エラーレスポンスから表示用のメッセージを取り出す"""
+    data = response["data"]
+    if isinstance(data, dict) and "message" in data:
+        return str(data["message"])
+    return str(data)
+
+
+def _send(
+    method: str, url: str, payload: bytes | None, headers: dict[str, str], idempotent: bool
+) -> tuple[int, dict[str, str], bytes]:
+    """
+    プールした接続でリクエストを送る。再利用した接続が切れていた場合は 1 回だけ張り直す。
+    切れた接続への送信はサーバーが処理済みかどうか分からず送り直せないので、
+    idempotent でないリクエストは再利用せず新しい接続で送る。
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme
+    host = parts.hostname or ""
+    port = parts.port or (443 if scheme == "https" else 80)
+    target = parts.path or "/"
+    if parts.query:
+        target += f"?{parts.query}"
+    pool_key = (scheme, host, port)
+
+    # http.client は ssl ごと読み込むと重いので、キャッシュで済まなかったときだけ import する
+    import http.client
+
+    for attempt in range(2):
+        connection, reused = _acquire_connection(pool_key, reuse=idempotent)
+        try:
+            connection.request(method, target, body=payload, headers=headers)
+            response = connection.getresponse()
+            raw = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            if reused and attempt == 0:
+                continue
+            raise
+        response_headers = {name.lower(): value for name, value in response.getheaders()}
+        if response.will_close:
+            connection.close()
+        else:
+            _release_connection(pool_key, connection)
+        return response.status, response_headers, raw
+
+    raise Exception(f"GitHub API への接続に失敗しました: {url}")
+
+
+def _acquire_connection(
+    pool_key: tuple[str, str, int], reuse: bool = True
+) -> tuple[http.client.HTTPConnection, bool]:
+    """アイドル接続を取り出す。無いか reuse が False なら新しく作る"""
+    with _pool_lock:
+        idle = _idle_connections.get(pool_key)
+        if reuse and idle:
+            return idle.pop(), True
+
+    import http.client
+
+    scheme, host, port = pool_key
+    if scheme == "https":
+        return http.client.HTTPSConnection(host, port, timeout=_TIMEOUT), False
+    return http.client.HTTPConnection(host, port, timeout=_TIMEOUT), False
+
+
+def _release_connection(
+    pool_key: tuple[str, str, int], connection: http.client.HTTPConnection
+) -> None:
+    """接続をプールに戻す"""
+    with _pool_lock:
+        idle = _idle_connections.setdefault(pool_key, [])
+        if len(idle) < _MAX_IDLE_PER_HOST:
+            idle.append(connection)
+            return
+    connection.close()
@@ -0,0 +1,34 @@
+"""中断しても途中から再開できるよう、処理の完了ステップをディスクに記録するジャーナルを提供する"""
+
+import json
+from pathlib import Path
+from typing import Any
+from urllib.parse import quote
+
+from base.cache import get_state_dir, write_json_atomic
+
+
+def get_journal_path(name: str) -> Path:
+    """ジャーナルファイルのパスを取得する"""
+    return get_state_dir() / "journals" / f"{quote(name, safe='')}.json"
+
+
+def load_journal(name: str) -> dict[str, Any]:
+    """記録済みのステップを読み込む。無い・壊れている場合は空とみなす"""
+    try:
+        data = json.loads(get_journal_path(name).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def record_step(name: str, step: str, value: Any = True) -> None:
+    """ステップの完了を記録する。書き込みはアトミックなので途中で落ちても壊れない"""
+    steps = load_journal(name)
+    steps[step] = value
+    write_json_atomic(get_journal_path(name), steps)
+
+
+def clear_journal(name: str) -> None:
+    """処理が最後まで終わったジャーナルを削除する"""
+    get_journal_path(name).unlink(missing_ok=True)
@@ -0,0 +1,206 @@
+"""
+各コマンドのフェーズごとの所要時間を ~/.local/state/hiho/metrics.jsonl に追記し、統計を表示する
+表示: hiho stats [--since 7d] [--repo <名前またはパス>] [--command <名前>]
+
+1 行に 1 フェーズの計測を書く。リポジトリは同名の別リポジトリと区別できるよう、元リポジトリの絶対パスで記録する。
+ファイルが _MAX_BYTES を超えたら 1 世代だけ残してローテーションする。
+"""
+
+import atexit
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TypedDict
+
+from base.cache import get_state_dir
+from base.process import trace_span
+
+_MAX_BYTES = 1024 * 1024
+_PERCENTILES = (50, 95, 99)
+_UNITS = {"m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+class PhaseRecord(TypedDict):
+    """1 回のフェーズの計測を表す型。キーはファイルを小さく保つために短くしている"""
+
+    t: int
+    c: str
+    r: str
+    p: str
+    ms: float
+
+
+_pending: list[PhaseRecord] = []
+_lock = threading.Lock()
+
+
+def get_metrics_path() -> Path:
+    """計測を追記するファイルのパスを取得する"""
+    return get_state_dir() / "metrics.jsonl"
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """with ブロックの所要時間をフェーズ name として記録する。プロファイル中は trace にも区間を残す"""
+    start = time.perf_counter()
+    with trace_span(name):
+        try:
+            yield
+        finally:
+            record_phase(name, time.perf_counter() - start)
+
+
+def record_phase(name: str, seconds: float) -> None:
+    """フェーズの所要時間を書き出し待ちに加える"""
+    record = PhaseRecord(
+        t=int(time.time()),
+        c=Path(sys.argv[0]).stem,
+        r="",
+        p=name,
+        ms=round(seconds * 1000, 1),
+    )
+    with _lock:
+        _pending.append(record)
+
+
+def flush_metrics() -> None:
+    """書き出し待ちの計測をファイルに追記する。exec でプロセスが置き換わる前にも呼ぶ"""
+    with _lock:
+        records = list(_pending)
+        _pending.clear()
+    if not records:
+        return
+
+    repo = _get_repo_path()
+    lines = "".join(
+        json.dumps({**record, "r": repo}, ensure_ascii=False, separators=(",", ":")) + "\n"
+        for record in records
+    )
+    path = get_metrics_path()
+    # 計測の記録に失敗しても本来の処理は止めない
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists() and path.stat().st_size > _MAX_BYTES:
+            os.replace(path, path.with_name(f"{path.name}.1"))
+        with path.open("a", encoding="utf-8") as f:
+            f.write(lines)
+    except OSError:
+        pass
+
+
+def _get_repo_path() -> str:
+    """カレントディレクトリを含むリポジトリの絶対パスを、worktree でも元リポジトリのパスで返す"""
+    cwd = Path.cwd()
+    for directory in [cwd, *cwd.parents]:
+        dot_git = directory / ".git"
+        if dot_git.is_dir():
+            return str(directory.resolve())
+        if dot_git.is_file():
+            git_dir = directory / dot_git.read_text(encoding="utf-8").strip().removeprefix("gitdir: ")
+            try:
+                common_dir = (git_dir / (git_dir / "commondir").read_text(encoding="utf-8").strip()).resolve()
+            except OSError:
+                return str(directory.resolve())
+            return str(common_dir.parent if common_dir.name == ".git" else common_dir)
+    return ""
+
+
+def load_records(since: float) -> list[PhaseRecord]:
+    """ローテーション済みのファイルも含めて、since 以降の計測を読み込む"""
+    path = get_metrics_path()
+    records: list[PhaseRecord] = []
+    for source in [path.with_name(f"{path.name}.1"), path]:
+        try:
+            lines = source.read_text(encoding="utf-8").splitlines()
+        except OSError:
+            continue
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            # 追記の途中で切れた行などが JSON として読めてしまう場合もあるので、形の合わない計測は飛ばす
+            if not _is_phase_record(record):
+                continue
+            if record["t"] >= since:
+                records.append(record)
+    return records
+
+
+def _is_phase_record(record: object) -> bool:
+    """読み込んだ値が PhaseRecord の形をしているかを判定する"""
+    return (
+        isinstance(record, dict)
+        and isinstance(record.get("t"), int)
+        and all(isinstance(record.get(key), str) for key in ("c", "r", "p"))
+        and isinstance(record.get("ms"), (int, float))
+    )
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """昇順に並んだ値の p パーセンタイルを nearest-rank 法で求める"""
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def parse_duration(text: str) -> float:
+    """30m・24h・7d のような期間を秒に変換する"""
+    unit = _UNITS.get(text[-1:])
+    if unit is None or not text[:-1].isdigit():
+        raise ValueError(f"期間は 30m・24h・7d のように指定してください: {text}")
+    return int(text[:-1]) * unit
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="フェーズごとの所要時間の件数と p50/p95/p99 をリポジトリ別に表示する"
+    )
+    parser.add_argument("--since", default="7d", help="集計する期間（デフォルト: 7d）")
+    parser.add_argument("--repo", help="集計するリポジトリの名前または絶対パス")
+    parser.add_argument("--command", help="集計するコマンド名（例: ai_code）")
+    args = parser.parse_args()
+    try:
+        since = time.time() - parse_duration(args.since)
+    except ValueError as e:
+        parser.error(str(e))
+
+    groups: dict[tuple[str, str], list[float]] = {}
+    for record in load_records(since):
+        if args.repo and args.repo not in (record["r"], Path(record["r"]).name):
+            continue
+        if args.command and record["c"] != args.command:
+            continue
+        groups.setdefault((record["p"], record["r"] or "-"), []).append(record["ms"])
+    if not groups:
+        print(f"直近 {args.since} の計測はありません ({get_metrics_path()})")
+        return
+
+    header = ("フェーズ", "リポジトリ", "件数", *(f"p{p}" for p in _PERCENTILES))
+    rows = []
+    for (phase_name, repo), values in sorted(groups.items()):
+        values.sort()
+        rows.append(
+            (
+                phase_name,
+                repo,
+                str(len(values)),
+                *(f"{percentile(values, p):.0f} ms" for p in _PERCENTILES),
+            )
+        )
+    widths = [max(len(row[i]) for row in [header, *rows]) for i in range(len(header))]
+    for row in [header, *rows]:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+
+atexit.register(flush_metrics)
+
+if __name__ == "__main__":
+    main()
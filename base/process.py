@@ -0,0 +1,169 @@
+"""
+外部コマンドの起動を 1 か所にまとめ、プロファイル時に所要時間を記録する
+
+HIHO_PROFILE=<path> を設定するか --profile <path> を渡すと、起動したコマンドの argv・cwd・開始終了時刻・
+終了コード・出力サイズを Chrome の trace event 形式の JSON に書き出す。chrome://tracing や Perfetto で開ける。
+書き出しはプロセスの終了時と、アシスタントを exec する直前に行う。
+"""
+
+import atexit
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+_profile_path: str | None = os.environ.get("HIHO_PROFILE") or None
+_events: list[dict[str, Any]] = []
+_open_events: dict[int, dict[str, Any]] = {}
+_named_threads: set[int] = set()
+_lock = threading.Lock()
+
+
+def enable_profile(path: str) -> None:
+    """プロファイルを有効にし、書き出し先を設定する"""
+    global _profile_path
+    _profile_path = path
+
+
+def run_command(command: list[str], **kwargs: Any) -> subprocess.CompletedProcess:
+    """subprocess.run と同じ引数でコマンドを実行し、プロファイル中なら trace event を記録する"""
+    if _profile_path is None:
+        return subprocess.run(command, **kwargs)
+
+    args: dict[str, Any] = {"argv": command, "cwd": str(kwargs.get("cwd") or os.getcwd())}
+    event = _begin(_command_label(command), "subprocess", args)
+    try:
+        result = subprocess.run(command, **kwargs)
+    except Exception as e:
+        args["error"] = type(e).__name__
+        _end(event)
+        raise
+    args["returncode"] = result.returncode
+    args["stdout_bytes"] = _output_size(result.stdout)
+    args["stderr_bytes"] = _output_size(result.stderr)
+    _end(event)
+    return result
+
+
+@contextmanager
+def trace_span(name: str, **args: Any) -> Iterator[None]:
+    """with ブロックの処理時間を 1 つの区間として記録する"""
+    if _profile_path is None:
+        yield
+        return
+    event = _begin(name, "span", args)
+    try:
+        yield
+    finally:
+        _end(event)
+
+
+def record_spawn(command: list[str], cwd: str | None = None, name: str | None = None) -> None:
+    """終了を待たないコマンドの起動や exec を、時刻だけの event として記録する"""
+    if _profile_path is None:
+        return
+    event = _new_event(
+        name or _command_label(command), "spawn", {"argv": command, "cwd": cwd or os.getcwd()}
+    )
+    event.update({"ph": "i", "s": "t"})
+    with _lock:
+        _events.append(event)
+
+
+def flush_profile() -> None:
+    """記録した event を書き出す。exec でプロセスが置き換わる前にも呼ぶ"""
+    if _profile_path is None:
+        return
+    # exec の直前に書き出す場合、裏のスレッドで実行中のコマンドはその時点までの区間として残す
+    now = _now_us()
+    with _lock:
+        events = list(_events) + [
+            {**event, "dur": now - event["ts"], "args": {**event["args"], "unfinished": True}}
+            for event in _open_events.values()
+        ]
+    path = Path(_profile_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(
+        json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, ensure_ascii=False),
+        encoding="utf-8",
+    )
+    os.replace(tmp_path, path)
+    print(f"プロファイルを書き出しました: {path}", file=sys.stderr)
+
+
+def _begin(name: str, category: str, args: dict[str, Any]) -> dict[str, Any]:
+    """区間の開始を記録し、終了時に渡す event を返す"""
+    event = _new_event(name, category, args)
+    event["ph"] = "X"
+    with _lock:
+        _open_events[id(event)] = event
+    return event
+
+
+def _end(event: dict[str, Any]) -> None:
+    """区間を閉じて、書き出す event に加える"""
+    event["dur"] = _now_us() - event["ts"]
+    with _lock:
+        _open_events.pop(id(event), None)
+        _events.append(event)
+
+
+def _new_event(name: str, category: str, args: dict[str, Any]) -> dict[str, Any]:
+    """スレッド名の metadata を必要に応じて追加し、現在時刻の event を作る"""
+    thread = threading.current_thread()
+    tid = threading.get_native_id()
+    with _lock:
+        if tid not in _named_threads:
+            _named_threads.add(tid)
+            _events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": {"name": thread.name},
+                }
+            )
+    return {
+        "name": name,
+        "cat": category,
+        "ts": _now_us(),
+        "pid": os.getpid(),
+        "tid": tid,
+        "args": args,
+    }
+
+
+def _command_label(command: list[str]) -> str:
+    """trace に表示する名前として、コマンド名と最初のサブコマンドを返す"""
+    rest = iter(command[1:])
+    for word in rest:
+        if word in ("-c", "-C"):
+            next(rest, None)
+        elif not word.startswith("-"):
+            return f"{Path(command[0]).name} {word}"
+    return Path(command[0]).name
+
+
+def _output_size(output: str | bytes | None) -> int | None:
+    """出力のバイト数を返す。取り込んでいなければ None を返す"""
+    if output is None:
+        return None
+    if isinstance(output, str):
+        return len(output.encode("utf-8"))
+    return len(output)
+
+
+def _now_us() -> int:
+    """別プロセスの trace と並べられるよう、エポックからのマイクロ秒を返す"""
+    return time.time_ns() // 1000
+
+
+atexit.register(flush_profile)
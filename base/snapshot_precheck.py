@@ -0,0 +1,99 @@
+"""スナップショットに影響する入力が前回のスナップショット更新から変わったかを調べる
+
+対象のパスはリポジトリごとに `git config --add hiho.snapshotInputPath <path>` で設定する。
+未設定の場合は判定できないので、常に変化ありとみなす。
+"""
+
+
+from base.cache import is_cache_disabled, read_fields, store_fields
+from base.github_api import rest
+from base.process import run_command
+
+_COMPARE_FILE_LIMIT = 300
+
+
+def get_snapshot_input_paths() -> list[str]:
+    """スナップショットに影響するパスの一覧を設定から取得する"""
+    result = run_command(
+        ["git", "config", "--get-all", "hiho.snapshotInputPath"],
+        capture_output=True,
+        text=True,
+    )
+    paths = [line.strip().strip("/") for line in result.stdout.splitlines()]
+    return sorted(path for path in paths if path)
+
+
+def get_last_snapshot_commit(org: str, repo: str, pr_number: int) -> str | None:
+    """前回スナップショットの更新に成功したときの PR ブランチの HEAD SHA を取得する"""
+    fields = read_fields("snapshot_commits", f"{org}/{repo}#{pr_number}")
+    return fields["sha"]["value"] if "sha" in fields else None
+
+
+def record_snapshot_commit(org: str, repo: str, pr_number: int, sha: str) -> None:
+    """スナップショットが最新であることを確認できたコミットを記録する"""
+    store_fields("snapshot_commits", f"{org}/{repo}#{pr_number}", {"sha": sha})
+
+
+def has_snapshot_input_changes(
+    repo_owner: str, repo_name: str, base_sha: str, head_sha: str, paths: list[str]
+) -> bool:
+    """
+    base_sha から head_sha までに paths 以下が変わったかを返す。
+    両方のコミットが手元にあればツリーハッシュを比べ、無ければ compare API を 1 回だけ呼ぶ。
+    結果は head_sha ごとにキャッシュする。
+    """
+    key = f"{repo_owner}/{repo_name}@{head_sha}"
+    cached = None if is_cache_disabled() else read_fields("snapshot_precheck", key).get("result")
+    if cached and cached["value"]["base"] == base_sha and cached["value"]["paths"] == paths:
+        return cached["value"]["changed"]
+
+    changed = _compare_local(base_sha, head_sha, paths)
+    if changed is None:
+        changed = _compare_remote(repo_owner, repo_name, base_sha, head_sha, paths)
+
+    store_fields(
+        "snapshot_precheck",
+        key,
+        {"result": {"base": base_sha, "paths": paths, "changed": changed}},
+    )
+    return changed
+
+
+def _compare_local(base_sha: str, head_sha: str, paths: list[str]) -> bool | None:
+    """手元の git で paths のツリーハッシュを比べる。コミットが手元に無ければ None を返す"""
+    listings = []
+    for sha in (base_sha, head_sha):
+        result = run_command(
+            ["git", "ls-tree", "--full-tree", f"{sha}^{{commit}}", "--", *paths],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            return None
+        listings.append(result.stdout)
+    return listings[0] != listings[1]
+
+
+def _compare_remote(
+    repo_owner: str, repo_name: str, base_sha: str, head_sha: str, paths: list[str]
+) -> bool:
+    """compare API の変更ファイル一覧に paths 以下が含まれるかを調べる"""
+    # 前回のコミットが force push で消えた (404/422) などで比べられない場合も、更新を止めないよう変化ありとみなす
+    try:
+        data = rest("GET", f"repos/{repo_owner}/{repo_name}/compare/{base_sha}...{head_sha}")
+    except Exception as e:
+        print(f"変更の有無を確認できなかったため、ワークフローを実行します: {e}")
+        return True
+    # 履歴が書き換えられた場合や一覧が切り詰められた場合は判定できないので変化ありとみなす
+    if data["status"] not in ("ahead", "identical"):
+        return True
+    files = data.get("files", [])
+    if len(files) >= _COMPARE_FILE_LIMIT:
+        return True
+
+    prefixes = tuple(f"{path}/" for path in paths)
+    for file in files:
+        for filename in (file["filename"], file.get("previous_filename")):
+            if filename and (filename in paths or filename.startswith(prefixes)):
+                return True
+    return False
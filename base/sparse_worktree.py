@@ -0,0 +1,189 @@
+"""巨大なリポジトリ向けに sparse-checkout した worktree を扱うユーティリティを提供する
+
+対象ディレクトリはリポジトリごとに `git config --add hiho.sparsePath <dir>` で設定する。
+未設定の場合はプロンプト中に現れるパスから推定する。
+"""
+
+import re
+import sys
+import time
+from pathlib import Path
+from typing import TypedDict
+
+from base.background import spawn_detached
+from base.cache import get_state_dir
+from base.process import run_command
+
+_PATH_TOKEN_PATTERN = re.compile(r"[\w.\-]+(?:/[\w.\-]+)+/?|[\w\-]+\.[A-Za-z0-9]{1,8}")
+_HYDRATE_DELAY_SECONDS = 30
+_HYDRATE_ATTEMPTS = 10
+_HYDRATE_RETRY_SECONDS = 5
+
+
+class SparseStats(TypedDict):
+    """sparse-checkout によって書き込みを省いたファイルの統計を表す型"""
+
+    total_files: int
+    total_bytes: int
+    skipped_files: int
+    skipped_bytes: int
+
+
+def get_sparse_profile(prompt: str, treeish: str) -> list[str]:
+    """リポジトリの設定、なければプロンプト中のパスから cone モードのディレクトリ一覧を決める"""
+    result = run_command(
+        ["git", "config", "--get-all", "hiho.sparsePath"],
+        capture_output=True,
+        text=True,
+    )
+    configured = [line.strip().strip("/") for line in result.stdout.splitlines()]
+    configured = [path for path in configured if path]
+    if configured:
+        return configured
+    return infer_sparse_dirs(prompt, treeish)
+
+
+def infer_sparse_dirs(prompt: str, treeish: str) -> list[str]:
+    """プロンプトに書かれたパスのうち、ツリー上に存在するものを含むディレクトリを返す"""
+    candidates = {
+        token.strip("/").removeprefix("./")
+        for token in _PATH_TOKEN_PATTERN.findall(prompt)
+    }
+    if not candidates:
+        return []
+
+    result = run_command(
+        ["git", "ls-tree", "-z", "--full-tree", treeish, "--", *sorted(candidates)],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return []
+
+    dirs: set[str] = set()
+    for record in result.stdout.split("\0"):
+        if not record:
+            continue
+        meta, _, path = record.partition("\t")
+        object_type = meta.split()[1]
+        directory = path if object_type == "tree" else str(Path(path).parent)
+        if directory != ".":
+            dirs.add(directory)
+    return sorted(dirs)
+
+
+def apply_sparse_checkout(worktree_path: Path, dirs: list[str]) -> bool:
+    """--no-checkout で作った worktree に cone モードの sparse-checkout を設定してチェックアウトする"""
+    set_result = run_command(
+        ["git", "sparse-checkout", "set", "--cone", "--", *dirs],
+        cwd=worktree_path,
+        capture_output=True,
+    )
+    if set_result.returncode != 0:
+        return False
+
+    checkout_result = run_command(
+        ["git", "checkout"],
+        cwd=worktree_path,
+        capture_output=True,
+    )
+    return checkout_result.returncode == 0
+
+
+def compute_sparse_stats(worktree_path: Path) -> SparseStats:
+    """index の skip-worktree のエントリを数え、HEAD の全ファイルのうち書き込みを省いた件数とバイト数を求める"""
+    flags = run_command(
+        ["git", "ls-files", "-t", "-z"],
+        cwd=worktree_path,
+        capture_output=True,
+        text=True,
+    )
+    # cone の親ディレクトリ直下のファイルも書き出されるので、パスではなく git の判定を使う
+    skipped = {
+        record[2:] for record in flags.stdout.split("\0") if record.startswith("S ")
+    }
+
+    result = run_command(
+        ["git", "ls-tree", "-r", "-l", "-z", "HEAD"],
+        cwd=worktree_path,
+        capture_output=True,
+        text=True,
+    )
+    stats = SparseStats(total_files=0, total_bytes=0, skipped_files=0, skipped_bytes=0)
+    for record in result.stdout.split("\0"):
+        if not record:
+            continue
+        meta, _, path = record.partition("\t")
+        size_field = meta.split()[-1]
+        size = int(size_field) if size_field.isdigit() else 0
+        stats["total_files"] += 1
+        stats["total_bytes"] += size
+        if path in skipped:
+            stats["skipped_files"] += 1
+            stats["skipped_bytes"] += size
+    return stats
+
+
+def start_background_hydration(worktree_path: Path) -> None:
+    """残りのファイルを、アシスタントの起動後に別プロセスでチェックアウトする"""
+    spawn_detached("base.sparse_worktree", ["hydrate", str(worktree_path)])
+
+
+def hydrate(worktree_path: Path) -> None:
+    """
+    少し待ってから sparse-checkout を解除し、残りのファイルを書き出す。
+    アシスタントが git を使っていて index.lock が取れない間はやり直し、最後まで失敗したらログに残す。
+    """
+    time.sleep(_HYDRATE_DELAY_SECONDS)
+    for attempt in range(_HYDRATE_ATTEMPTS):
+        result = run_command(
+            ["git", "sparse-checkout", "disable"],
+            cwd=worktree_path,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode == 0:
+            return
+        if "index.lock" not in result.stderr or attempt + 1 == _HYDRATE_ATTEMPTS:
+            break
+        time.sleep(_HYDRATE_RETRY_SECONDS)
+
+    # git のエラーは助言が複数行続くので、1 行に収まるよう最初の行だけ残す
+    _log_hydrate_failure(worktree_path, (result.stderr.strip().splitlines() or [""])[0])
+
+
+def get_hydrate_log_path() -> Path:
+    """sparse-checkout の解除に失敗したことを記録するログのパスを取得する"""
+    return get_state_dir() / "sparse_hydrate.log"
+
+
+def _log_hydrate_failure(worktree_path: Path, message: str) -> None:
+    """別プロセスで失敗を伝える先が無いので、worktree が sparse のまま残ったことをログに追記する"""
+    path = get_hydrate_log_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    timestamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+    with path.open("a", encoding="utf-8") as f:
+        f.write(
+            f"{timestamp} {worktree_path}: sparse-checkout を解除できませんでした。"
+            f"`git sparse-checkout disable` を手動で実行してください: {message}\n"
+        )
+
+
+def format_bytes(size: int) -> str:
+    """バイト数を読みやすい単位に変換する"""
+    if size < 1024:
+        return f"{size} B"
+    value = size / 1024
+    for unit in ["KiB", "MiB"]:
+        if value < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} GiB"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "hydrate":
+        hydrate(Path(sys.argv[2]))
+    else:
+        print("使い方: python -m base.sparse_worktree hydrate <worktree_path>", file=sys.stderr)
+        sys.exit(1)
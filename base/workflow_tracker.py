@@ -0,0 +1,145 @@
+"""GitHub Actions のワークフロー実行を、条件付きリクエストと適応的な間隔でポーリングして追跡する"""
+
+import time
+from collections.abc import Callable, Iterator
+from datetime import datetime
+from typing import Any, TypedDict
+from urllib.parse import quote
+
+from base.github_api import request
+
+_FIND_INTERVAL = (1.0, 5.0)
+_WATCH_INTERVAL = (2.0, 30.0)
+_BACKOFF_FACTOR = 1.5
+_FAST_PHASE_SECONDS = 60
+
+
+class PollState(TypedDict):
+    """条件付きリクエストのために前回の ETag と結果を保持する型"""
+
+    etag: str | None
+    data: Any
+
+
+class WatchedRun(TypedDict):
+    """まとめて見張るワークフロー実行を表す型"""
+
+    repo_owner: str
+    repo_name: str
+    run_id: int
+
+
+def new_poll_state() -> PollState:
+    """空のポーリング状態を作る"""
+    return PollState(etag=None, data=None)
+
+
+def poll(path: str, state: PollState) -> tuple[Any, bool]:
+    """If-None-Match 付きで GET し、(結果, 前回から変化したか) を返す。304 はレート制限に数えられない"""
+    headers = {"If-None-Match": state["etag"]} if state["etag"] else None
+    response = request("GET", path, headers=headers)
+    if response["status"] == 304:
+        return state["data"], False
+    if response["status"] != 200:
+        raise Exception(
+            f"GitHub API GET {path} が失敗しました (HTTP {response['status']})"
+        )
+    state["etag"] = response["headers"].get("etag")
+    state["data"] = response["data"]
+    return response["data"], True
+
+
+def find_dispatched_run(
+    repo_owner: str,
+    repo_name: str,
+    workflow: str,
+    branch: str,
+    after: datetime,
+    timeout: float = 120,
+) -> int:
+    """after 以降に workflow_dispatch で作られた実行を探し、run ID を返す"""
+    path = (
+        f"repos/{repo_owner}/{repo_name}/actions/workflows/{workflow}/runs"
+        f"?branch={quote(branch, safe='')}&event=workflow_dispatch&per_page=5"
+    )
+    state = new_poll_state()
+    interval, max_interval = _FIND_INTERVAL
+    deadline = time.monotonic() + timeout
+
+    while True:
+        data, _ = poll(path, state)
+        for run in data["workflow_runs"]:
+            created_at = datetime.fromisoformat(run["created_at"].replace("Z", "+00:00"))
+            if created_at >= after:
+                return run["id"]
+
+        if time.monotonic() + interval > deadline:
+            raise Exception(f"ワークフロー実行が{timeout:.0f}秒以内に見つかりませんでした")
+        time.sleep(interval)
+        interval = min(interval * _BACKOFF_FACTOR, max_interval)
+
+
+def wait_for_run(repo_owner: str, repo_name: str, run_id: int) -> str:
+    """実行が終わるまでジョブ単位の進捗を表示しながら待ち、conclusion を返す"""
+    run = WatchedRun(repo_owner=repo_owner, repo_name=repo_name, run_id=run_id)
+    _, conclusion = next(watch_runs([run], lambda _, progress: print(progress)))
+    print(f"ワークフロー (run ID: {run_id}) が終了しました: {conclusion}")
+    return conclusion
+
+
+def watch_runs(
+    runs: list[WatchedRun], on_progress: Callable[[WatchedRun, str], None]
+) -> Iterator[tuple[WatchedRun, str]]:
+    """
+    複数の実行を 1 つのループでまとめてポーリングし、終わったものから (実行, conclusion) を返す。
+    ジョブ単位の進捗が変わるたびに on_progress を呼ぶ。
+    どれかの状態が変わった直後と開始直後は短い間隔で、変化が無い間は徐々に間隔を広げてポーリングする。
+    """
+    # 実行ごとの (実行, 実行のポーリング状態, ジョブのポーリング状態)。実行 ID は GitHub 全体で一意なのでキーにする
+    watching = {run["run_id"]: (run, new_poll_state(), new_poll_state()) for run in runs}
+    last_progress: dict[int, str] = {}
+    min_interval, max_interval = _WATCH_INTERVAL
+    interval = min_interval
+    started = time.monotonic()
+
+    while watching:
+        changed = False
+        for run_id, (run, run_state, jobs_state) in list(watching.items()):
+            run_path = f"repos/{run['repo_owner']}/{run['repo_name']}/actions/runs/{run_id}"
+            data, run_changed = poll(run_path, run_state)
+            if data["status"] == "completed":
+                del watching[run_id]
+                yield run, data["conclusion"] or "unknown"
+                continue
+
+            jobs, jobs_changed = poll(f"{run_path}/jobs?per_page=100", jobs_state)
+            progress = format_job_progress(jobs["jobs"])
+            if progress != last_progress.get(run_id):
+                on_progress(run, progress)
+                last_progress[run_id] = progress
+            changed = changed or run_changed or jobs_changed
+        if not watching:
+            return
+
+        if changed or time.monotonic() - started < _FAST_PHASE_SECONDS:
+            interval = min_interval
+        else:
+            interval = min(interval * _BACKOFF_FACTOR, max_interval)
+        time.sleep(interval)
+
+
+def format_job_progress(jobs: list[dict[str, Any]]) -> str:
+    """ジョブ一覧から進捗の 1 行表示を作る"""
+    completed = sum(1 for job in jobs if job["status"] == "completed")
+    running = [job["name"] for job in jobs if job["status"] == "in_progress"]
+    failed = [
+        job["name"]
+        for job in jobs
+        if job["status"] == "completed" and job["conclusion"] not in ("success", "skipped")
+    ]
+    parts = [f"ジョブ {completed}/{len(jobs)} 完了"]
+    if running:
+        parts.append(f"実行中: {', '.join(running)}")
+    if failed:
+        parts.append(f"失敗: {', '.join(failed)}")
+    return " / ".join(parts)
@@ -1,19 +1,49 @@
 """Git worktree 操作のユーティリティ関数を提供する"""
 
-import subprocess
+import functools
+import sys
 from pathlib import Path
 
+from base.daemon import get_or_compute
+from base.process import run_command
+from base.sparse_worktree import apply_sparse_checkout
+from base.worktree_registry import lookup_worktree, register_worktree
+
 
 def get_repo_root() -> str:
     """git リポジトリのルートパスを取得する"""
-    result = subprocess.run(
-        ["git", "rev-parse", "--show-toplevel"],
+    return _get_repo_paths()[0]
+
+
+def get_git_common_dir() -> str:
+    """全 worktree で共有される git ディレクトリの絶対パスを取得する"""
+    return _get_repo_paths()[1]
+
+
+@functools.cache
+def _get_repo_paths() -> tuple[str, str]:
+    """リポジトリのルートと共有 git ディレクトリを、デーモンが動いていればそこから取得する"""
+    repo_root, git_common_dir = get_or_compute("repo_paths", _read_repo_paths)
+    return repo_root, git_common_dir
+
+
+def _read_repo_paths() -> tuple[str, str]:
+    """リポジトリのルートと共有 git ディレクトリを 1 回の git 呼び出しで取得する"""
+    result = run_command(
+        [
+            "git",
+            "rev-parse",
+            "--path-format=absolute",
+            "--show-toplevel",
+            "--git-common-dir",
+        ],
         capture_output=True,
         text=True,
     )
     if result.returncode != 0:
         raise Exception("リポジトリのルートを取得できませんでした")
-    return result.stdout.strip()
+    repo_root, git_common_dir = result.stdout.splitlines()
+    return repo_root, git_common_dir
 
 
 def get_worktree_path(branch_name: str) -> Path:
@@ -24,51 +54,65 @@ def get_worktree_path(branch_name: str) -> Path:
 
 
 def worktree_exists(worktree_path: Path) -> bool:
-    """指定したパスの worktree が存在するかどうかを確認する"""
-    result = subprocess.run(
-        ["git", "worktree", "list", "--porcelain"],
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode != 0:
-        return False
-
-    for line in result.stdout.splitlines():
-        if line.startswith("worktree "):
-            path = line.split(" ", 1)[1]
-            if Path(path).resolve() == worktree_path.resolve():
-                return True
-    return False
+    """指定したパスの worktree が存在するかどうかをレジストリで確認する"""
+    return lookup_worktree(worktree_path, get_git_common_dir()) is not None
 
 
-def create_worktree(worktree_path: Path, branch_name: str) -> bool:
-    """既存のブランチで worktree を作成する"""
+def create_worktree(
+    worktree_path: Path,
+    branch_name: str,
+    pr_number: int | None = None,
+    sparse_dirs: list[str] | None = None,
+) -> bool:
+    """既存のブランチで worktree を作成する。sparse_dirs を指定すると cone モードの sparse-checkout にする"""
     worktree_path.parent.mkdir(parents=True, exist_ok=True)
 
-    result = subprocess.run(
-        ["git", "worktree", "add", str(worktree_path), branch_name],
+    no_checkout = ["--no-checkout"] if sparse_dirs is not None else []
+    result = run_command(
+        ["git", "worktree", "add", *no_checkout, str(worktree_path), branch_name],
         capture_output=True,
     )
-    return result.returncode == 0
+    if result.returncode != 0:
+        return False
+    if sparse_dirs is not None and not apply_sparse_checkout(worktree_path, sparse_dirs):
+        _remove_worktree(worktree_path)
+        return False
+
+    register_created_worktree(worktree_path, branch_name, pr_number)
+    return True
 
 
 def create_new_branch_worktree(
-    worktree_path: Path, branch_name: str, base_branch: str | None
+    worktree_path: Path,
+    branch_name: str,
+    base_branch: str | None,
+    pr_number: int | None = None,
+    sparse_dirs: list[str] | None = None,
 ) -> bool:
-    """新しいブランチで worktree を作成する"""
+    """新しいブランチで worktree を作成する。sparse_dirs を指定すると cone モードの sparse-checkout にする"""
     worktree_path.parent.mkdir(parents=True, exist_ok=True)
 
+    no_checkout = ["--no-checkout"] if sparse_dirs is not None else []
     if base_branch is None:
-        result = subprocess.run(
-            ["git", "worktree", "add", str(worktree_path), "-b", branch_name],
+        result = run_command(
+            [
+                "git",
+                "worktree",
+                "add",
+                *no_checkout,
+                str(worktree_path),
+                "-b",
+                branch_name,
+            ],
             capture_output=True,
         )
     else:
-        result = subprocess.run(
+        result = run_command(
             [
                 "git",
                 "worktree",
                 "add",
+                *no_checkout,
                 str(worktree_path),
                 "-b",
                 branch_name,
@@ -76,12 +120,41 @@ def create_new_branch_worktree(
             ],
             capture_output=True,
         )
-    return result.returncode == 0
+    if result.returncode != 0:
+        return False
+    if sparse_dirs is not None and not apply_sparse_checkout(worktree_path, sparse_dirs):
+        _remove_worktree(worktree_path)
+        run_command(["git", "branch", "-D", branch_name], capture_output=True)
+        return False
+
+    register_created_worktree(worktree_path, branch_name, pr_number)
+    return True
+
+
+def _remove_worktree(worktree_path: Path) -> None:
+    """作成途中で失敗した worktree を取り除く"""
+    run_command(
+        ["git", "worktree", "remove", "--force", str(worktree_path)],
+        capture_output=True,
+    )
+
+
+def register_created_worktree(
+    worktree_path: Path, branch_name: str, pr_number: int | None
+) -> None:
+    """作成した worktree を起動元スクリプト名とともにレジストリへ記録する"""
+    register_worktree(
+        worktree_path,
+        branch_name,
+        get_git_common_dir(),
+        Path(sys.argv[0]).stem or None,
+        pr_number,
+    )
 
 
 def branch_exists(branch_name: str) -> bool:
     """指定したブランチが存在するかどうかを確認する"""
-    result = subprocess.run(
+    result = run_command(
         ["git", "rev-parse", "--verify", branch_name],
         capture_output=True,
     )
@@ -0,0 +1,192 @@
+"""事前にチェックアウトしておいた worktree のプールを提供する
+
+プールのサイズは `git config hiho.poolSize K`、対象のベースブランチは
+`git config --add hiho.poolBase <branch>` で設定する（未設定なら現在の worktree のブランチ）。
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+from base.background import spawn_detached
+from base.process import run_command
+from base.worktree_manager import get_repo_root, register_created_worktree
+
+_POOL_DIR_NAME = ".pool"
+_LOCK_FILE_NAME = ".refill.lock"
+_STALE_LOCK_SECONDS = 600
+
+
+def take_pooled_worktree(
+    worktree_path: Path, branch_name: str, base_branch: str | None
+) -> bool:
+    """
+    プールから worktree を 1 つ取り出して worktree_path に移動し、新しいブランチを作成する。
+    取り出せなかった場合は False を返す。取り出した分は裏で補充する。
+    """
+    if get_pool_size() <= 0:
+        return False
+
+    base = base_branch or _get_head_branch()
+    # HEAD は worktree ごとに異なるので、移動前に呼び出し元の HEAD を SHA で固定しておく
+    start_point = base_branch or _rev_parse("HEAD")
+    if start_point is None:
+        return False
+
+    taken = False
+    for slot in _list_slots(base):
+        worktree_path.parent.mkdir(parents=True, exist_ok=True)
+        moved = run_command(
+            ["git", "worktree", "move", str(slot), str(worktree_path)],
+            capture_output=True,
+        )
+        if moved.returncode != 0:
+            continue
+
+        switched = run_command(
+            ["git", "switch", "-q", "-c", branch_name, start_point],
+            cwd=worktree_path,
+            capture_output=True,
+        )
+        if switched.returncode != 0:
+            run_command(
+                ["git", "worktree", "remove", "--force", str(worktree_path)],
+                capture_output=True,
+            )
+            break
+
+        register_created_worktree(worktree_path, branch_name, None)
+        taken = True
+        break
+
+    start_background_refill()
+    return taken
+
+
+def get_pool_size() -> int:
+    """ベースブランチごとに保持する worktree の数を取得する"""
+    result = run_command(
+        ["git", "config", "--get", "hiho.poolSize"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return 0
+    try:
+        return int(result.stdout.strip())
+    except ValueError:
+        return 0
+
+
+def get_pool_bases() -> list[str]:
+    """プールを用意するベースブランチの一覧を取得する"""
+    result = run_command(
+        ["git", "config", "--get-all", "hiho.poolBase"],
+        capture_output=True,
+        text=True,
+    )
+    bases = result.stdout.split()
+    return bases or [_get_head_branch()]
+
+
+def start_background_refill() -> None:
+    """プールの補充を、呼び出し元の exec 後も生き残る別プロセスで開始する"""
+    spawn_detached("base.worktree_pool", ["refill"], cwd=get_repo_root())
+
+
+def refill_pool() -> None:
+    """各ベースブランチのプールを規定数まで補充し、ベースが進んだ worktree を追従させる"""
+    import secrets
+
+    size = get_pool_size()
+    if size <= 0:
+        return
+
+    pool_dir = _get_pool_dir()
+    pool_dir.mkdir(parents=True, exist_ok=True)
+    lock_path = pool_dir / _LOCK_FILE_NAME
+    try:
+        if time.time() - lock_path.stat().st_mtime > _STALE_LOCK_SECONDS:
+            lock_path.unlink(missing_ok=True)
+    except OSError:
+        pass
+    try:
+        lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return
+
+    try:
+        os.write(lock_fd, str(os.getpid()).encode())
+        for base in get_pool_bases():
+            base_sha = _rev_parse(base)
+            if base_sha is None:
+                continue
+
+            slots = _list_slots(base)
+            for slot in slots:
+                if _rev_parse("HEAD", cwd=slot) != base_sha:
+                    run_command(
+                        ["git", "checkout", "-q", "--detach", base_sha],
+                        cwd=slot,
+                        capture_output=True,
+                    )
+
+            for _ in range(size - len(slots)):
+                slot = pool_dir / quote(base, safe="") / secrets.token_hex(4)
+                slot.parent.mkdir(parents=True, exist_ok=True)
+                run_command(
+                    ["git", "worktree", "add", "-q", "--detach", str(slot), base_sha],
+                    capture_output=True,
+                )
+    finally:
+        os.close(lock_fd)
+        lock_path.unlink(missing_ok=True)
+
+
+def _get_pool_dir() -> Path:
+    """プールの置き場所を取得する"""
+    return Path(f"{get_repo_root()}.worktrees") / _POOL_DIR_NAME
+
+
+def _list_slots(base: str) -> list[Path]:
+    """ベースブランチに対応するプール内の worktree を列挙する"""
+    base_dir = _get_pool_dir() / quote(base, safe="")
+    try:
+        return sorted(path for path in base_dir.iterdir() if (path / ".git").exists())
+    except OSError:
+        return []
+
+
+def _get_head_branch() -> str:
+    """現在の worktree のブランチ名を取得する。detached なら HEAD を返す"""
+    result = run_command(
+        ["git", "symbolic-ref", "--short", "HEAD"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return "HEAD"
+    return result.stdout.strip()
+
+
+def _rev_parse(ref: str, cwd: Path | None = None) -> str | None:
+    """ref のコミット SHA を取得する"""
+    result = run_command(
+        ["git", "rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}"],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["refill"]:
+        refill_pool()
+    else:
+        print("使い方: python -m base.worktree_pool refill", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,200 @@
+"""全リポジトリの worktree を記録するレジストリを提供する"""
+
+import json
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TypedDict
+
+from base.cache import get_state_dir, write_json_atomic
+
+# 引くたびに書き込まないよう、last_used はこの間隔より古くなったときだけ更新する
+_TOUCH_INTERVAL_SECONDS = 60 * 60
+
+
+class WorktreeEntry(TypedDict):
+    """レジストリに記録する worktree の情報を表す型"""
+
+    path: str
+    branch: str
+    repo: str
+    git_common_dir: str
+    script: str | None
+    pr_number: int | None
+    last_used: float
+
+
+def get_registry_path() -> Path:
+    """レジストリファイルのパスを取得する"""
+    return get_state_dir() / "worktrees.json"
+
+
+def lookup_worktree(worktree_path: Path, git_common_dir: str) -> WorktreeEntry | None:
+    """
+    パスに対応する worktree を O(1) で引く。
+    git の worktrees/ 管理ディレクトリと食い違うエントリは削除し、
+    レジストリに無くても git 上は存在する worktree は取り込んでから返す。
+    last_used は _TOUCH_INTERVAL_SECONDS ごとにしか更新せず、変化が無ければファイルを書かない。
+    """
+    key = str(worktree_path)
+    entry = _load_entries().get(key)
+
+    if not is_git_worktree(worktree_path, git_common_dir):
+        if entry is not None:
+            with _locked():
+                entries = _load_entries()
+                if entries.pop(key, None) is not None:
+                    _save_entries(entries)
+        return None
+
+    now = time.time()
+    if entry is not None and now - entry["last_used"] < _TOUCH_INTERVAL_SECONDS:
+        return entry
+
+    with _locked():
+        entries = _load_entries()
+        entry = entries.get(key) or WorktreeEntry(
+            path=key,
+            branch=read_worktree_branch(worktree_path) or "",
+            repo=str(Path(git_common_dir).parent),
+            git_common_dir=git_common_dir,
+            script=None,
+            pr_number=None,
+            last_used=now,
+        )
+        entry["last_used"] = now
+        entries[key] = entry
+        _save_entries(entries)
+    return entry
+
+
+def register_worktree(
+    worktree_path: Path,
+    branch: str,
+    git_common_dir: str,
+    script: str | None,
+    pr_number: int | None,
+) -> None:
+    """作成した worktree をレジストリに記録する"""
+    with _locked():
+        entries = _load_entries()
+        entries[str(worktree_path)] = WorktreeEntry(
+            path=str(worktree_path),
+            branch=branch,
+            repo=str(Path(git_common_dir).parent),
+            git_common_dir=git_common_dir,
+            script=script,
+            pr_number=pr_number,
+            last_used=time.time(),
+        )
+        _save_entries(entries)
+
+
+def update_worktree_branch(worktree_path: Path, branch: str) -> None:
+    """worktree のブランチ名を更新する（ブランチをリネームしたとき用）"""
+    with _locked():
+        entries = _load_entries()
+        entry = entries.get(str(worktree_path))
+        if entry is None or entry["branch"] == branch:
+            return
+        entry["branch"] = branch
+        _save_entries(entries)
+
+
+def list_worktrees(repo: str | None = None) -> list[WorktreeEntry]:
+    """
+    記録済みの worktree を最近使った順に返す。repo を指定するとそのリポジトリのものだけを返す。
+    git の worktrees/ 管理ディレクトリが消えたエントリは取り除く。
+    """
+    with _locked():
+        entries = _load_entries()
+        alive = {
+            key: entry
+            for key, entry in entries.items()
+            if is_git_worktree(Path(entry["path"]), entry["git_common_dir"])
+        }
+        if len(alive) != len(entries):
+            _save_entries(alive)
+
+    result = [entry for entry in alive.values() if repo is None or entry["repo"] == repo]
+    return sorted(result, key=lambda entry: entry["last_used"], reverse=True)
+
+
+def is_git_worktree(worktree_path: Path, git_common_dir: str) -> bool:
+    """
+    worktree の .git ファイルと git の worktrees/<id>/gitdir が互いを指しているかをファイルだけで確認する。
+    git worktree list と違ってサブプロセスも全エントリの resolve も不要。
+    """
+    admin_dir = _read_admin_dir(worktree_path)
+    if admin_dir is None:
+        return False
+    if admin_dir.parent != Path(git_common_dir) / "worktrees":
+        return False
+    try:
+        gitdir = (admin_dir / "gitdir").read_text(encoding="utf-8").strip()
+    except OSError:
+        return False
+    return Path(gitdir) == worktree_path / ".git"
+
+
+def read_worktree_branch(worktree_path: Path) -> str | None:
+    """worktree の HEAD が指すブランチ名を管理ディレクトリから読む"""
+    admin_dir = _read_admin_dir(worktree_path)
+    if admin_dir is None:
+        return None
+    try:
+        head = (admin_dir / "HEAD").read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    prefix = "ref: refs/heads/"
+    return head[len(prefix) :] if head.startswith(prefix) else None
+
+
+def _read_admin_dir(worktree_path: Path) -> Path | None:
+    """worktree の .git ファイルから管理ディレクトリのパスを読む"""
+    try:
+        content = (worktree_path / ".git").read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    prefix = "gitdir: "
+    if not content.startswith(prefix):
+        return None
+    admin_dir = Path(content[len(prefix) :])
+    if not admin_dir.is_absolute():
+        admin_dir = worktree_path / admin_dir
+    return admin_dir
+
+
+@contextmanager
+def _locked() -> Iterator[None]:
+    """
+    レジストリの読み込みから書き込みまでを排他する。
+    本体・プールの補充・ブランチ名の変更の各プロセスが同時に書いても記録が失われないようにする。
+    ファイル自体は置き換えで書くので、ロックには別のファイルを使う。
+    """
+    import fcntl
+
+    lock_path = get_registry_path().with_name("worktrees.lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with lock_path.open("a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _load_entries() -> dict[str, WorktreeEntry]:
+    """レジストリファイルを読み込む。壊れている場合は空とみなす"""
+    try:
+        data = json.loads(get_registry_path().read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    worktrees = data.get("worktrees") if isinstance(data, dict) else None
+    return worktrees if isinstance(worktrees, dict) else {}
+
+
+def _save_entries(entries: dict[str, WorktreeEntry]) -> None:
+    """レジストリファイルを書き込む"""
+    write_json_atomic(get_registry_path(), {"worktrees": entries})
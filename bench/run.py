@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+ローカルの bare リポジトリと偽の gh / claude / codex を使って、各コマンドを端から端まで計測する
+使い方: python bench/run.py [--runs 3] [--latency-ms 50] [--update-baseline] [シナリオ...]
+
+ai_code 系はアシスタントが起動するまでの時間を、update_voicevox_pr_snapshots は終了までの時間を測り、
+フェーズごとの時間とサブプロセスの起動回数を bench/baseline.json と比べる。
+"""
+
+import argparse
+import json
+import os
+import pty
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import TypedDict
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(REPO_DIR))
+
+from bench.stub_github import RequestRecord, StubGitHub
+from bench.world import World, build_world
+
+BASELINE_PATH = REPO_DIR / "bench" / "baseline.json"
+
+_DEFAULT_RUNS = 3
+_DEFAULT_LATENCY_MS = 50
+_DEFAULT_CI_SECONDS = 1.0
+_TIMEOUT_SECONDS = 120
+# 時間はこの割合とこのミリ秒数の両方を超えて遅くなったときだけ退行とみなす
+_TOLERANCE = 0.2
+_TOLERANCE_MS = 10.0
+
+
+class Scenario(TypedDict):
+    """計測するコマンドと、どこまでを計測するかを表す型"""
+
+    command: list[str]
+    until_exec: bool
+
+
+class Measurement(TypedDict):
+    """1 回の計測結果を表す型。時間はミリ秒"""
+
+    phases: dict[str, float]
+    subprocesses: dict[str, int]
+
+
+SCENARIOS: dict[str, Scenario] = {
+    "ai_code": Scenario(
+        command=["ai_code.py", "--ai", "claude", "ベンチマーク用のタスク"], until_exec=True
+    ),
+    "ai_code_checkout_pr": Scenario(
+        command=["ai_code_checkout_pr.py", "pull/1", "をレビューする"], until_exec=True
+    ),
+    "ai_code_counter_pr": Scenario(
+        command=["ai_code_counter_pr.py", "pull/1", "に追加の修正をする"], until_exec=True
+    ),
+    "update_voicevox_pr_snapshots_others": Scenario(
+        command=["update_voicevox_pr_snapshots.py", "1"], until_exec=False
+    ),
+    "update_voicevox_pr_snapshots_own": Scenario(
+        command=["update_voicevox_pr_snapshots.py", "2"], until_exec=False
+    ),
+}
+
+
+def main() -> None:
+    args = parse_arguments()
+
+    stub = StubGitHub(args.latency_ms, args.ci_seconds)
+    stub.start()
+    results: dict[str, Measurement] = {}
+    try:
+        for name in args.scenarios:
+            measurements = [measure(name, stub, args) for _ in range(args.runs)]
+            results[name] = summarize(measurements)
+            print_measurement(name, results[name])
+    finally:
+        stub.stop()
+
+    if args.update_baseline:
+        BASELINE_PATH.write_text(
+            json.dumps(results, indent=2, ensure_ascii=False) + "\n", encoding="utf-8"
+        )
+        print(f"✓ ベースラインを更新しました: {BASELINE_PATH}")
+        return
+
+    if not BASELINE_PATH.exists():
+        print("ベースラインがありません。--update-baseline で作成してください")
+        return
+    baseline: dict[str, Measurement] = json.loads(BASELINE_PATH.read_text(encoding="utf-8"))
+    regressions = [
+        message
+        for name, measurement in results.items()
+        if name in baseline
+        for message in compare(name, measurement, baseline[name])
+    ]
+    if regressions:
+        print("エラー: ベースラインから退行しました:", file=sys.stderr)
+        for message in regressions:
+            print(f"  {message}", file=sys.stderr)
+        sys.exit(1)
+    print("✓ ベースラインからの退行はありません")
+
+
+def parse_arguments() -> argparse.Namespace:
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(
+        description="偽の git / gh / claude / codex を使って各コマンドの所要時間を計測する"
+    )
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        help="計測するシナリオ（省略時はすべて）",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=_DEFAULT_RUNS,
+        help=f"シナリオごとの計測回数。中央値を使う（デフォルト: {_DEFAULT_RUNS}）",
+    )
+    parser.add_argument(
+        "--latency-ms",
+        type=int,
+        default=_DEFAULT_LATENCY_MS,
+        help=f"GitHub API と codex exec の応答にかける時間（デフォルト: {_DEFAULT_LATENCY_MS} ms）",
+    )
+    parser.add_argument(
+        "--ci-seconds",
+        type=float,
+        default=_DEFAULT_CI_SECONDS,
+        help=f"ワークフロー実行が終わるまでの時間（デフォルト: {_DEFAULT_CI_SECONDS} 秒）",
+    )
+    parser.add_argument("--branches", type=int, default=500, help="リモートとローカルのブランチ数")
+    parser.add_argument("--worktrees", type=int, default=5, help="既存の worktree 数")
+    parser.add_argument("--files", type=int, default=2000, help="リポジトリのファイル数")
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="比較せずに、今回の結果をベースラインとして保存する",
+    )
+    args = parser.parse_args()
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"不明なシナリオです: {', '.join(unknown)}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    return args
+
+
+def measure(name: str, stub: StubGitHub, args: argparse.Namespace) -> Measurement:
+    """新しく作った一式の中でシナリオを 1 回実行し、フェーズごとの時間と起動回数を求める"""
+    scenario = SCENARIOS[name]
+    root = Path(tempfile.mkdtemp(prefix="hiho-bench-"))
+    try:
+        world = build_world(
+            root, stub.url, args.branches, args.worktrees, args.files, args.latency_ms
+        )
+        stub.reset(world["github_dir"])
+        started, finished = run_scenario(world, scenario)
+        return analyze(world, scenario, stub.requests, started, finished)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def run_scenario(world: World, scenario: Scenario) -> tuple[float, float]:
+    """
+    コマンドを疑似端末に繋いで実行し、(開始時刻, 終了時刻) を返す。
+    アシスタントを起動するシナリオでは、偽のアシスタントが記録した起動時刻を終了時刻とする。
+    """
+    primary, secondary = pty.openpty()
+    output_path = world["root"] / "output.log"
+    command = [sys.executable, str(REPO_DIR / scenario["command"][0]), *scenario["command"][1:]]
+    with output_path.open("wb") as output:
+        started = time.time()
+        process = subprocess.Popen(
+            command,
+            cwd=world["work_dir"],
+            env=world["env"],
+            stdin=secondary,
+            stdout=output,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+        try:
+            returncode = process.wait(timeout=_TIMEOUT_SECONDS)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            raise Exception(f"{_TIMEOUT_SECONDS} 秒以内に終わりませんでした\n{_tail(output_path)}")
+        finished = time.time()
+    os.close(primary)
+    os.close(secondary)
+
+    if scenario["until_exec"]:
+        if not world["exec_mark_path"].exists():
+            raise Exception(f"アシスタントが起動しませんでした\n{_tail(output_path)}")
+        return started, float(world["exec_mark_path"].read_text(encoding="utf-8"))
+    if returncode != 0:
+        raise Exception(f"終了コード {returncode} で失敗しました\n{_tail(output_path)}")
+    return started, finished
+
+
+def analyze(
+    world: World,
+    scenario: Scenario,
+    requests: list[RequestRecord],
+    started: float,
+    finished: float,
+) -> Measurement:
+    """偽のコマンドと GitHub の代役の記録から、フェーズごとの時間と起動回数を求める"""
+    events: list[tuple[float, str]] = []
+    if world["log_path"].exists():
+        for line in world["log_path"].read_text(encoding="utf-8").splitlines():
+            at, name, _ = line.split("\t", 2)
+            if at and float(at) <= finished:
+                events.append((float(at), name))
+    requests = [request for request in requests if request["at"] <= finished]
+
+    subprocesses = Counter(name for _, name in events)
+    subprocesses["api_requests"] = len(requests)
+
+    first_activity = min(
+        [at for at, _ in events] + [request["at"] for request in requests], default=finished
+    )
+    phases = {"startup": first_activity - started}
+    if scenario["until_exec"]:
+        phases["until_exec"] = finished - first_activity
+    else:
+        dispatches = [r["at"] for r in requests if r["path"].endswith("/dispatches")]
+        run_polls = [r["at"] for r in requests if "/actions/runs/" in r["path"]]
+        if dispatches and run_polls:
+            phases["until_dispatch"] = dispatches[0] - first_activity
+            phases["ci_wait"] = run_polls[-1] - dispatches[0]
+            phases["after_ci"] = finished - run_polls[-1]
+        else:
+            phases["work"] = finished - first_activity
+    phases["total"] = finished - started
+
+    return Measurement(
+        phases={name: seconds * 1000 for name, seconds in phases.items()},
+        subprocesses=dict(sorted(subprocesses.items())),
+    )
+
+
+def summarize(measurements: list[Measurement]) -> Measurement:
+    """複数回の計測結果を、値ごとの中央値にまとめる"""
+    phase_names = measurements[0]["phases"]
+    command_names = sorted({name for m in measurements for name in m["subprocesses"]})
+    return Measurement(
+        phases={
+            name: round(statistics.median(m["phases"][name] for m in measurements), 1)
+            for name in phase_names
+        },
+        subprocesses={
+            name: round(statistics.median(m["subprocesses"].get(name, 0) for m in measurements))
+            for name in command_names
+        },
+    )
+
+
+def compare(name: str, current: Measurement, baseline: Measurement) -> list[str]:
+    """ベースラインより遅くなったフェーズと、起動回数が増えたコマンドを列挙する"""
+    messages = []
+    for phase, base_ms in baseline["phases"].items():
+        current_ms = current["phases"].get(phase)
+        if current_ms is None:
+            continue
+        if current_ms > base_ms * (1 + _TOLERANCE) and current_ms - base_ms > _TOLERANCE_MS:
+            messages.append(f"{name} {phase}: {base_ms:.1f} ms → {current_ms:.1f} ms")
+    for command, base_count in baseline["subprocesses"].items():
+        current_count = current["subprocesses"].get(command, 0)
+        if current_count > base_count:
+            messages.append(f"{name} {command} の起動回数: {base_count} → {current_count}")
+    for command in current["subprocesses"].keys() - baseline["subprocesses"].keys():
+        messages.append(f"{name} {command} の起動回数: 0 → {current['subprocesses'][command]}")
+    return messages
+
+
+def print_measurement(name: str, measurement: Measurement) -> None:
+    """1 シナリオの結果を表示する"""
+    phases = ", ".join(f"{phase} {ms:.1f} ms" for phase, ms in measurement["phases"].items())
+    counts = ", ".join(f"{command} {count}" for command, count in measurement["subprocesses"].items())
+    print(f"{name}: {phases}")
+    print(f"  起動回数: {counts}")
+
+
+def _tail(path: Path, lines: int = 20) -> str:
+    """出力の末尾を返す"""
+    return "\n".join(path.read_text(encoding="utf-8", errors="replace").splitlines()[-lines:])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""ベンチマーク用に、ローカルの bare リポジトリを裏に持つ GitHub API の代役を立てる"""
+
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, TypedDict
+from urllib.parse import unquote, urlsplit
+
+from bench.world import PULL_REQUESTS, REPO_NAME, UPSTREAM_OWNER, VIEWER, get_bare_repo
+
+# CI が積むコミットの作者。計測を実行する人の git 設定に依存しないようにする
+_CI_IDENTITY = {
+    "GIT_AUTHOR_NAME": "github-actions[bot]",
+    "GIT_AUTHOR_EMAIL": "github-actions[bot]@users.noreply.github.com",
+    "GIT_COMMITTER_NAME": "github-actions[bot]",
+    "GIT_COMMITTER_EMAIL": "github-actions[bot]@users.noreply.github.com",
+}
+
+
+class RequestRecord(TypedDict):
+    """受け付けたリクエストの時刻とパスを表す型"""
+
+    at: float
+    method: str
+    path: str
+
+
+class StubGitHub:
+    """
+    REST と GraphQL の必要な部分だけを実装した GitHub の代役。
+    ディスパッチされたワークフローは ci_seconds 後に成功し、ブランチに 1 コミットを積む。
+    """
+
+    def __init__(self, latency_ms: int, ci_seconds: float) -> None:
+        self.latency = latency_ms / 1000
+        self.ci_seconds = ci_seconds
+        self.github_dir: Path | None = None
+        self.requests: list[RequestRecord] = []
+        self._runs: dict[int, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                stub._handle(self, "GET")
+
+            def do_POST(self) -> None:
+                stub._handle(self, "POST")
+
+            def do_PATCH(self) -> None:
+                stub._handle(self, "PATCH")
+
+            def do_DELETE(self) -> None:
+                stub._handle(self, "DELETE")
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self) -> None:
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self, github_dir: Path) -> None:
+        """新しい計測用の一式に切り替え、記録を消す"""
+        with self._lock:
+            self.github_dir = github_dir
+            self.requests = []
+            self._runs = {}
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str) -> None:
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = json.loads(handler.rfile.read(length)) if length else None
+        parts = urlsplit(handler.path)
+        path = parts.path.strip("/")
+        with self._lock:
+            self.requests.append(RequestRecord(at=time.time(), method=method, path=path))
+        time.sleep(self.latency)
+
+        status, data = self._route(method, path, parts.query, body)
+        raw = b"" if data is None else json.dumps(data).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(raw)))
+        handler.end_headers()
+        handler.wfile.write(raw)
+
+    def _route(
+        self, method: str, path: str, query: str, body: Any
+    ) -> tuple[int, Any]:
+        if method == "POST" and path == "graphql":
+            return 200, {"data": self._pr_context(body["variables"]["number"])}
+        if method == "GET" and path == "user":
+            return 200, {"login": VIEWER}
+
+        match = re.fullmatch(r"repos/([^/]+)/([^/]+)(?:/(.*))?", path)
+        if match is None:
+            return 404, {"message": "Not Found"}
+        owner, repo, rest = match.group(1), match.group(2), match.group(3) or ""
+
+        if method == "GET" and rest == "":
+            return 200, {"owner": {"login": owner}, "name": repo}
+        if method == "GET" and (pr := re.fullmatch(r"pulls/(\d+)", rest)):
+            return self._pull(int(pr.group(1)))
+        if method == "GET" and rest.startswith("git/ref/heads/"):
+            return self._get_ref(owner, unquote(rest.removeprefix("git/ref/heads/")))
+        if method == "PATCH" and rest.startswith("git/refs/heads/"):
+            return self._update_ref(owner, unquote(rest.removeprefix("git/refs/heads/")), body)
+        if method == "POST" and rest == "git/refs":
+            return self._create_ref(owner, body)
+        if method == "DELETE" and rest.startswith("git/refs/heads/"):
+            branch = unquote(rest.removeprefix("git/refs/heads/"))
+            self._git(owner, "update-ref", "-d", f"refs/heads/{branch}")
+            return 204, None
+        if method == "GET" and (commit := re.fullmatch(r"commits/([0-9a-f]+)", rest)):
+            parents = self._git(owner, "rev-parse", f"{commit.group(1)}^@").split()
+            return 200, {"sha": commit.group(1), "parents": [{"sha": sha} for sha in parents]}
+        if method == "POST" and rest.endswith("/dispatches"):
+            return self._dispatch(owner, body["ref"])
+        if method == "GET" and rest.startswith("actions/workflows/") and rest.endswith("/runs"):
+            branch = unquote(re.search(r"branch=([^&]*)", query).group(1))
+            return 200, {"workflow_runs": self._list_runs(owner, branch)}
+        if method == "GET" and (run := re.fullmatch(r"actions/runs/(\d+)(/jobs)?", rest)):
+            return self._get_run(int(run.group(1)), run.group(2) is not None)
+        return 404, {"message": "Not Found"}
+
+    def _pr_context(self, number: int) -> dict[str, Any]:
+        author, branch = PULL_REQUESTS[number]
+        return {
+            "viewer": {"login": VIEWER},
+            "repository": {
+                "owner": {"login": UPSTREAM_OWNER},
+                "name": REPO_NAME,
+                "pullRequest": {
+                    "author": {"login": author},
+                    "headRefName": branch,
+                    "maintainerCanModify": True,
+                    "headRepository": {"owner": {"login": author}, "name": REPO_NAME},
+                },
+            },
+        }
+
+    def _pull(self, number: int) -> tuple[int, Any]:
+        if number not in PULL_REQUESTS:
+            return 404, {"message": "Not Found"}
+        author, branch = PULL_REQUESTS[number]
+        return 200, {
+            "user": {"login": author},
+            "head": {
+                "ref": branch,
+                "repo": {"owner": {"login": author}, "name": REPO_NAME},
+            },
+            "maintainer_can_modify": True,
+        }
+
+    def _get_ref(self, owner: str, branch: str) -> tuple[int, Any]:
+        sha = self._resolve(owner, f"refs/heads/{branch}")
+        if sha is None:
+            return 404, {"message": "Not Found"}
+        return 200, {"ref": f"refs/heads/{branch}", "object": {"sha": sha}}
+
+    def _update_ref(self, owner: str, branch: str, body: Any) -> tuple[int, Any]:
+        current = self._resolve(owner, f"refs/heads/{branch}")
+        if current is None:
+            return 422, {"message": "Reference does not exist"}
+        ancestor = subprocess.run(
+            ["git", "merge-base", "--is-ancestor", current, body["sha"]],
+            cwd=self._repo(owner),
+        )
+        if ancestor.returncode != 0 and not body.get("force"):
+            return 422, {"message": "Update is not a fast forward"}
+        self._git(owner, "update-ref", f"refs/heads/{branch}", body["sha"])
+        return 200, {"object": {"sha": body["sha"]}}
+
+    def _create_ref(self, owner: str, body: Any) -> tuple[int, Any]:
+        if self._resolve(owner, body["ref"]) is not None:
+            return 422, {"message": "Reference already exists"}
+        self._git(owner, "update-ref", body["ref"], body["sha"])
+        return 201, {"ref": body["ref"], "object": {"sha": body["sha"]}}
+
+    def _dispatch(self, owner: str, branch: str) -> tuple[int, Any]:
+        with self._lock:
+            run_id = len(self._runs) + 1
+            self._runs[run_id] = {
+                "owner": owner,
+                "branch": branch,
+                "created": time.time(),
+                "completed": False,
+            }
+        return 204, None
+
+    def _list_runs(self, owner: str, branch: str) -> list[dict[str, Any]]:
+        with self._lock:
+            runs = [
+                (run_id, run)
+                for run_id, run in self._runs.items()
+                if run["owner"] == owner and run["branch"] == branch
+            ]
+        return [
+            {
+                "id": run_id,
+                "created_at": datetime.fromtimestamp(run["created"], timezone.utc)
+                .isoformat()
+                .replace("+00:00", "Z"),
+            }
+            for run_id, run in reversed(runs)
+        ]
+
+    def _get_run(self, run_id: int, jobs: bool) -> tuple[int, Any]:
+        with self._lock:
+            run = self._runs.get(run_id)
+        if run is None:
+            return 404, {"message": "Not Found"}
+
+        done = time.time() - run["created"] >= self.ci_seconds
+        if done and not run["completed"]:
+            self._push_ci_commit(run["owner"], run["branch"])
+            run["completed"] = True
+        status = "completed" if done else "in_progress"
+        if jobs:
+            return 200, {
+                "jobs": [
+                    {
+                        "name": "update-snapshots",
+                        "status": status,
+                        "conclusion": "success" if done else None,
+                    }
+                ]
+            }
+        return 200, {"id": run_id, "status": status, "conclusion": "success" if done else None}
+
+    def _push_ci_commit(self, owner: str, branch: str) -> None:
+        """CI がスナップショットを更新したコミットを積んだ状態を再現する"""
+        head = self._git(owner, "rev-parse", f"refs/heads/{branch}").strip()
+        commit = self._git(
+            owner, "commit-tree", f"{head}^{{tree}}", "-p", head, "-m", "Update snapshots"
+        ).strip()
+        self._git(owner, "update-ref", f"refs/heads/{branch}", commit)
+
+    def _resolve(self, owner: str, ref: str) -> str | None:
+        result = subprocess.run(
+            ["git", "rev-parse", "--verify", "--quiet", ref],
+            cwd=self._repo(owner),
+            capture_output=True,
+            text=True,
+        )
+        return result.stdout.strip() if result.returncode == 0 else None
+
+    def _git(self, owner: str, *args: str) -> str:
+        result = subprocess.run(
+            ["git", *args],
+            cwd=self._repo(owner),
+            env={**os.environ, **_CI_IDENTITY},
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise Exception(f"git {' '.join(args)} に失敗しました: {result.stderr.strip()}")
+        return result.stdout
+
+    def _repo(self, owner: str) -> Path:
+        if self.github_dir is None:
+            raise Exception("計測用の一式が設定されていません")
+        return get_bare_repo(self.github_dir, owner)
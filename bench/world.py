@@ -0,0 +1,263 @@
+"""ベンチマーク用に、ローカルの bare リポジトリ群と偽の git / gh / claude / codex を用意する"""
+
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from typing import TypedDict
+
+UPSTREAM_OWNER = "VOICEVOX"
+REPO_NAME = "voicevox"
+AUTHOR = "alice"
+VIEWER = "hiho-bench"
+# PR 番号と (作者, ブランチ名)
+PULL_REQUESTS = {
+    1: (AUTHOR, "feature-1"),
+    2: (VIEWER, "my-feature"),
+}
+
+
+class World(TypedDict):
+    """1 回の計測に使う一式の場所と環境変数を表す型"""
+
+    root: Path
+    github_dir: Path
+    work_dir: Path
+    log_path: Path
+    exec_mark_path: Path
+    env: dict[str, str]
+
+
+def build_world(
+    root: Path, api_url: str, branches: int, worktrees: int, files: int, latency_ms: int
+) -> World:
+    """
+    GitHub 上の upstream と 2 つの fork を bare リポジトリで再現し、upstream のクローンを作る。
+    git@github.com: と https://github.com/ は insteadOf でローカルの bare リポジトリに向ける。
+    """
+    real_git = shutil.which("git")
+    if real_git is None:
+        raise Exception("git が見つかりません")
+
+    home = root / "home"
+    github_dir = root / "github"
+    bin_dir = root / "bin"
+    for directory in [home, github_dir, bin_dir]:
+        directory.mkdir(parents=True)
+
+    gitconfig = home / ".gitconfig"
+    gitconfig.write_text(
+        "[user]\n\tname = hiho bench\n\temail = bench@example.com\n"
+        "[init]\n\tdefaultBranch = main\n"
+        "[advice]\n\tdetachedHead = false\n"
+        f'[url "{github_dir}/"]\n\tinsteadOf = git@github.com:\n\tinsteadOf = https://github.com/\n',
+        encoding="utf-8",
+    )
+    env = {
+        **os.environ,
+        "HOME": str(home),
+        "GIT_CONFIG_GLOBAL": str(gitconfig),
+        "GIT_CONFIG_NOSYSTEM": "1",
+        "GIT_TERMINAL_PROMPT": "0",
+    }
+
+    _build_repositories(root, github_dir, real_git, env, branches, files)
+    work_dir = root / "work" / REPO_NAME
+    _run(
+        [real_git, "clone", "-q", f"https://github.com/{UPSTREAM_OWNER}/{REPO_NAME}.git", str(work_dir)],
+        env,
+    )
+    _add_local_branches(work_dir, real_git, env, branches)
+    for i in range(worktrees):
+        _run(
+            [real_git, "worktree", "add", "-q", "--detach", f"{work_dir}.worktrees/existing-{i}"],
+            env,
+            cwd=work_dir,
+        )
+
+    log_path = root / "subprocess.log"
+    exec_mark_path = root / "exec_mark"
+    _write_shims(bin_dir, real_git)
+    # アシスタントは bash -lc 経由で起動され、/etc/profile が PATH を上書きするので、ログインシェルでも偽物を先に見せる
+    (home / ".bash_profile").write_text(f'export PATH="{bin_dir}:$PATH"\n', encoding="utf-8")
+
+    env.update(
+        {
+            "PATH": f"{bin_dir}{os.pathsep}{os.environ['PATH']}",
+            "XDG_CACHE_HOME": str(root / "cache"),
+            "XDG_STATE_HOME": str(root / "state"),
+            "XDG_RUNTIME_DIR": str(root / "run"),
+            "GH_TOKEN": "bench-token",
+            "HIHO_GITHUB_API_URL": api_url,
+            "HIHO_GITHUB_GRAPHQL_URL": f"{api_url}/graphql",
+            "BENCH_LOG": str(log_path),
+            "BENCH_EXEC_MARK": str(exec_mark_path),
+            "BENCH_LATENCY_MS": str(latency_ms),
+        }
+    )
+    env.pop("HIHO_NO_CACHE", None)
+    env.pop("HIHO_PROFILE", None)
+    return World(
+        root=root,
+        github_dir=github_dir,
+        work_dir=work_dir,
+        log_path=log_path,
+        exec_mark_path=exec_mark_path,
+        env=env,
+    )
+
+
+def get_bare_repo(github_dir: Path, owner: str) -> Path:
+    """owner のリポジトリに対応する bare リポジトリのパスを返す"""
+    return github_dir / owner / f"{REPO_NAME}.git"
+
+
+def _build_repositories(
+    root: Path, github_dir: Path, git: str, env: dict[str, str], branches: int, files: int
+) -> None:
+    """種リポジトリを作り、upstream と fork の bare リポジトリに複製する"""
+    seed = root / "seed"
+    _run([git, "init", "-q", str(seed)], env)
+    for i in range(files):
+        path = seed / f"src/module{i % 20}/file{i}.ts"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"export const value{i} = {i};\n", encoding="utf-8")
+    (seed / "package.json").write_text('{"name": "voicevox"}\n', encoding="utf-8")
+    _run([git, "add", "-A"], env, cwd=seed)
+    _run([git, "commit", "-q", "-m", "initial"], env, cwd=seed)
+
+    for number, (_, branch) in PULL_REQUESTS.items():
+        _run([git, "switch", "-q", "-c", branch, "main"], env, cwd=seed)
+        (seed / f"pr{number}.txt").write_text(f"PR {number}\n", encoding="utf-8")
+        _run([git, "add", "-A"], env, cwd=seed)
+        _run([git, "commit", "-q", "-m", f"PR {number}"], env, cwd=seed)
+    _run([git, "switch", "-q", "main"], env, cwd=seed)
+
+    head = _run([git, "rev-parse", "HEAD"], env, cwd=seed).strip()
+    updates = "".join(f"create refs/heads/branch-{i} {head}\n" for i in range(branches))
+    _run([git, "update-ref", "--stdin"], env, cwd=seed, input=updates)
+
+    owners = [UPSTREAM_OWNER, AUTHOR, VIEWER]
+    for owner in owners:
+        bare = get_bare_repo(github_dir, owner)
+        bare.parent.mkdir(parents=True)
+        _run([git, "clone", "-q", "--bare", str(seed), str(bare)], env)
+
+    # fork ネットワーク内でオブジェクトが共有される GitHub の挙動を alternates で再現する
+    for owner in owners:
+        bare = get_bare_repo(github_dir, owner)
+        others = [
+            str(get_bare_repo(github_dir, other) / "objects") for other in owners if other != owner
+        ]
+        (bare / "objects" / "info" / "alternates").write_text(
+            "\n".join(others) + "\n", encoding="utf-8"
+        )
+        for number, (author, branch) in PULL_REQUESTS.items():
+            # GitHub と同じく、upstream には PR の head を refs/pull/<番号>/head として置く
+            if owner == UPSTREAM_OWNER:
+                _run([git, "update-ref", f"refs/pull/{number}/head", f"refs/heads/{branch}"], env, cwd=bare)
+            if owner != author:
+                _run([git, "update-ref", "-d", f"refs/heads/{branch}"], env, cwd=bare)
+
+
+def _add_local_branches(work_dir: Path, git: str, env: dict[str, str], branches: int) -> None:
+    """origin を追跡するローカルブランチを大量に作る"""
+    updates = "".join(
+        f"create refs/heads/branch-{i} refs/remotes/origin/branch-{i}\n" for i in range(branches)
+    )
+    _run([git, "update-ref", "--stdin"], env, cwd=work_dir, input=updates)
+    with (work_dir / ".git" / "config").open("a", encoding="utf-8") as f:
+        for i in range(branches):
+            f.write(f'[branch "branch-{i}"]\n\tremote = origin\n\tmerge = refs/heads/branch-{i}\n')
+
+
+def _write_shims(bin_dir: Path, real_git: str) -> None:
+    """呼び出しを記録する git と、フィクスチャで応答する gh / claude / codex を置く"""
+    shims = {
+        "git": (
+            "#!/usr/bin/env bash\n"
+            'args="$*"\n'
+            'printf \'%s\\tgit\\t%s\\n\' "$EPOCHREALTIME" "${args//$\'\\n\'/ }" >> "$BENCH_LOG"\n'
+            f'exec "{real_git}" "$@"\n'
+        ),
+        "gh": f"#!{sys.executable}\n{_PYTHON_SHIM_PRELUDE}{_GH_SHIM}",
+        "claude": f"#!{sys.executable}\n{_PYTHON_SHIM_PRELUDE}{_ASSISTANT_SHIM}",
+        "codex": f"#!{sys.executable}\n{_PYTHON_SHIM_PRELUDE}{_CODEX_SHIM}{_ASSISTANT_SHIM}",
+    }
+    for name, content in shims.items():
+        path = bin_dir / name
+        path.write_text(content, encoding="utf-8")
+        path.chmod(0o755)
+
+
+_PYTHON_SHIM_PRELUDE = """import json, os, signal, sys, time
+name = os.path.basename(sys.argv[0])
+with open(os.environ["BENCH_LOG"], "a") as log:
+    log.write(f"{time.time()}\\t{name}\\t{' '.join(sys.argv[1:])}".replace("\\n", " ") + "\\n")
+latency = int(os.environ.get("BENCH_LATENCY_MS", "0")) / 1000
+args = sys.argv[1:]
+"""
+
+_GH_SHIM = """import urllib.error, urllib.request
+if args[:2] == ["auth", "token"]:
+    print(os.environ["GH_TOKEN"])
+    sys.exit(0)
+if not args or args[0] != "api":
+    print(f"bench gh: unsupported command: {args}", file=sys.stderr)
+    sys.exit(1)
+method, path, jq = "GET", None, None
+rest = args[1:]
+while rest:
+    arg = rest.pop(0)
+    if arg == "-X":
+        method = rest.pop(0)
+    elif arg == "--jq":
+        jq = rest.pop(0)
+    else:
+        path = arg
+time.sleep(latency)
+request = urllib.request.Request(f"{os.environ['HIHO_GITHUB_API_URL']}/{path}", method=method)
+try:
+    with urllib.request.urlopen(request) as response:
+        raw = response.read()
+except urllib.error.HTTPError as e:
+    print(f"gh: HTTP {e.code}", file=sys.stderr)
+    sys.exit(1)
+data = json.loads(raw) if raw else None
+if jq:
+    for part in jq.strip(".").replace("[", ".[").split("."):
+        data = data[int(part[1:-1])] if part.startswith("[") else data[part]
+    print(data)
+else:
+    print(raw.decode())
+"""
+
+_CODEX_SHIM = """if args[:1] == ["exec"]:
+    time.sleep(latency)
+    output = args[args.index("--output-last-message") + 1]
+    with open(output, "w") as f:
+        json.dump({"branchName": "feature/bench-task"}, f)
+    sys.exit(0)
+"""
+
+# アシスタントが起動した時刻を記録し、後に続く対話シェルごと終了させる
+_ASSISTANT_SHIM = """with open(os.environ["BENCH_EXEC_MARK"], "w") as f:
+    f.write(str(time.time()))
+os.kill(os.getppid(), signal.SIGKILL)
+"""
+
+
+def _run(
+    command: list[str],
+    env: dict[str, str],
+    cwd: Path | None = None,
+    input: str | None = None,
+) -> str:
+    """準備用のコマンドを実行し、失敗したら例外を送出する"""
+    result = subprocess.run(
+        command, cwd=cwd, env=env, input=input, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise Exception(f"{' '.join(command)} に失敗しました: {result.stderr.strip()}")
+    return result.stdout
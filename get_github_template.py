@@ -2,10 +2,53 @@
 """GitHub の Issue テンプレートまたは PR テンプレートを取得する"""
 
 import argparse
-import base64
-import json
-import subprocess
+import re
 import sys
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, TypedDict, TypeVar
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from base.github import find_remote_for_repo, get_current_org_repo
+from base.github_api import conditional_get, request
+from base.process import enable_profile, run_command
+
+T = TypeVar("T")
+
+_PROBE_WORKERS = 6
+_CACHE_NAMESPACE = "templates"
+_NEXT_LINK_PATTERN = re.compile(r'<([^>]+)>;\s*rel="next"')
+
+PR_TEMPLATE_DIR = ".github/PULL_REQUEST_TEMPLATE"
+ISSUE_TEMPLATE_DIR = ".github/ISSUE_TEMPLATE"
+
+PR_TEMPLATE_PATHS = [
+    ".github/pull_request_template.md",
+    ".github/PULL_REQUEST_TEMPLATE.md",
+    "docs/pull_request_template.md",
+    "docs/PULL_REQUEST_TEMPLATE.md",
+    "pull_request_template.md",
+    "PULL_REQUEST_TEMPLATE.md",
+]
+
+# ローカルの ls-tree で列挙する範囲。テンプレートが置かれ得る場所だけに絞る
+_TEMPLATE_TREE_PATHS = [
+    ".github",
+    "docs",
+    "pull_request_template.md",
+    "PULL_REQUEST_TEMPLATE.md",
+]
+
+
+class TemplateTree(TypedDict):
+    """テンプレート探索に使うリポジトリのファイル一覧を表す型"""
+
+    owner: str
+    repo: str
+    entries: dict[str, str]
+    local: bool
 
 
 def main() -> None:
@@ -14,14 +57,27 @@ def main() -> None:
     )
     parser.add_argument(
         "subcommand",
-        choices=["issue", "pr"],
-        help="issue: Issue テンプレートを取得、pr: PR テンプレートを取得",
+        choices=["issue", "pr", "prefetch"],
+        help="issue: Issue テンプレートを取得、pr: PR テンプレートを取得、prefetch: org のテンプレートをキャッシュに取得",
     )
     parser.add_argument("-o", "--owner", help="リポジトリのオーナー")
     parser.add_argument("-r", "--repo", help="リポジトリ名")
     parser.add_argument("-t", "--template", help="テンプレート名")
+    parser.add_argument("--org", help="prefetch の対象 org（省略時は --owner か現在のリポジトリの org）")
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="起動した外部コマンドの所要時間を Chrome の trace 形式で PATH に書き出す",
+    )
 
     args = parser.parse_args()
+    if args.profile:
+        enable_profile(args.profile)
+
+    if args.subcommand == "prefetch":
+        org = args.org or args.owner or get_repo_info(None, None)[0]
+        prefetch_org_templates(org)
+        return
 
     owner = args.owner
     repo = args.repo
@@ -36,26 +92,20 @@ def main() -> None:
 
 
 def get_repo_info(owner: str | None, repo: str | None) -> tuple[str, str]:
-    """gh コマンドでリポジトリの owner と name を取得する"""
-    result = subprocess.run(
-        ["gh", "repo", "view", "--json", "owner,name"],
-        capture_output=True,
-        text=True,
-    )
-
-    if result.returncode != 0 or not result.stdout:
+    """現在のリポジトリの owner と name を取得する"""
+    try:
+        current_owner, current_repo = get_current_org_repo()
+    except Exception:
         print(
             "エラー: リポジトリ情報を取得できませんでした。-o と -r を指定するか、Git リポジトリ内で実行してください。",
             file=sys.stderr,
         )
         sys.exit(1)
 
-    repo_info = json.loads(result.stdout)
-
     if not owner:
-        owner = repo_info["owner"]["login"]
+        owner = current_owner
     if not repo:
-        repo = repo_info["name"]
+        repo = current_repo
 
     if not owner or not repo:
         print("エラー: owner または repo を取得できませんでした。", file=sys.stderr)
@@ -65,21 +115,78 @@ def get_repo_info(owner: str | None, repo: str | None) -> tuple[str, str]:
 
 
 def gh_api(path: str) -> dict | list | None:
-    """gh api コマンドを実行して JSON 結果を返す"""
-    result = subprocess.run(
-        ["gh", "api", path],
-        capture_output=True,
-        text=True,
-    )
+    """GitHub API の GET を ETag キャッシュ付きで実行して JSON 結果を返す。失敗した場合は None を返す"""
+    try:
+        response = conditional_get(path, _CACHE_NAMESPACE, immutable="/git/blobs/" in path)
+    except Exception:
+        return None
 
-    if result.returncode != 0:
+    if response["status"] != 200:
         return None
 
-    return json.loads(result.stdout)
+    return response["data"]
+
+
+def prefetch_org_templates(org: str) -> None:
+    """org 内の全リポジトリのテンプレートを取得してキャッシュに載せる"""
+    repos = list_org_repos(org)
+    if ".github" not in repos:
+        repos.append(".github")
+
+    with ThreadPoolExecutor(max_workers=_PROBE_WORKERS) as executor:
+        counts = list(
+            executor.map(lambda repo: prefetch_repo_templates(org, repo), repos)
+        )
+
+    for repo, count in zip(repos, counts):
+        if count:
+            print(f"{org}/{repo}: {count} 件")
+    print(f"{org} の {len(repos)} リポジトリから {sum(counts)} 件のテンプレートをキャッシュしました")
+
+
+def list_org_repos(org: str) -> list[str]:
+    """org（またはユーザー）のアーカイブされていないリポジトリ名を列挙する"""
+    path: str | None = f"orgs/{org}/repos?per_page=100"
+    repos: list[str] = []
+    while path:
+        response = request("GET", path)
+        if response["status"] == 404 and path.startswith("orgs/"):
+            path = f"users/{org}/repos?per_page=100"
+            continue
+        if response["status"] != 200:
+            print(f"エラー: {org} のリポジトリ一覧を取得できませんでした。", file=sys.stderr)
+            sys.exit(1)
+        repos.extend(repo["name"] for repo in response["data"] if not repo["archived"])
+        match = _NEXT_LINK_PATTERN.search(response["headers"].get("link", ""))
+        path = match.group(1) if match else None
+    return repos
+
+
+def prefetch_repo_templates(owner: str, repo: str) -> int:
+    """リポジトリのツリーとテンプレートファイルをキャッシュに載せ、件数を返す"""
+    tree = load_remote_tree(owner, repo)
+    if tree is None:
+        return 0
+
+    paths = [path for path in tree["entries"] if is_template_path(path)]
+    for path in paths:
+        read_tree_file(tree, path)
+    return len(paths)
+
+
+def is_template_path(path: str) -> bool:
+    """テンプレートとして参照され得るパスかどうかを判定する"""
+    return (
+        path in PR_TEMPLATE_PATHS
+        or path.startswith(f"{PR_TEMPLATE_DIR}/")
+        or path.startswith(f"{ISSUE_TEMPLATE_DIR}/")
+    )
 
 
 def decode_content(content: str) -> str:
     """base64 エンコードされた文字列をデコードする"""
+    import base64
+
     return base64.b64decode(content).decode("utf-8")
 
 
@@ -94,18 +201,19 @@ def handle_issue_template(owner: str, repo: str, template: str | None) -> None:
 
 def list_issue_templates(owner: str, repo: str) -> None:
     """Issue テンプレート一覧を表示する"""
-    templates = gh_api(f"repos/{owner}/{repo}/contents/.github/ISSUE_TEMPLATE")
-    if templates and isinstance(templates, list):
-        print(f"Issue テンプレート一覧 ({owner}/{repo}):")
-        for template in templates:
-            print(template["name"])
-        return
-
-    templates = gh_api(f"repos/{owner}/.github/contents/.github/ISSUE_TEMPLATE")
-    if templates and isinstance(templates, list):
-        print(f"Issue テンプレート一覧 ({owner}/.github):")
-        for template in templates:
-            print(template["name"])
+    sources = [(owner, repo), (owner, ".github")]
+    hit = resolve_template(
+        sources,
+        lambda tree: list_tree_dir(tree, ISSUE_TEMPLATE_DIR),
+        lambda o, r: [f"repos/{o}/{r}/contents/{ISSUE_TEMPLATE_DIR}"],
+        extract_listing,
+    )
+    if hit:
+        index, names = hit
+        source_owner, source_repo = sources[index]
+        print(f"Issue テンプレート一覧 ({source_owner}/{source_repo}):")
+        for name in names:
+            print(name)
         return
 
     print("エラー: Issue テンプレートが見つかりませんでした。", file=sys.stderr)
@@ -114,18 +222,15 @@ def list_issue_templates(owner: str, repo: str) -> None:
 
 def get_issue_template(owner: str, repo: str, template: str) -> None:
     """指定した Issue テンプレートの内容を表示する"""
-    content_data = gh_api(
-        f"repos/{owner}/{repo}/contents/.github/ISSUE_TEMPLATE/{template}"
-    )
-    if content_data and isinstance(content_data, dict) and "content" in content_data:
-        print(decode_content(content_data["content"]))
-        return
-
-    content_data = gh_api(
-        f"repos/{owner}/.github/contents/.github/ISSUE_TEMPLATE/{template}"
+    path = f"{ISSUE_TEMPLATE_DIR}/{template}"
+    hit = resolve_template(
+        [(owner, repo), (owner, ".github")],
+        lambda tree: read_tree_file(tree, path),
+        lambda o, r: [f"repos/{o}/{r}/contents/{path}"],
+        extract_content,
     )
-    if content_data and isinstance(content_data, dict) and "content" in content_data:
-        print(decode_content(content_data["content"]))
+    if hit:
+        print(hit[1])
         return
 
     print(f"エラー: Issue テンプレート '{template}' が見つかりませんでした。", file=sys.stderr)
@@ -143,18 +248,15 @@ def handle_pr_template(owner: str, repo: str, template: str | None) -> None:
 
 def get_pr_template_by_name(owner: str, repo: str, template: str) -> None:
     """指定した PR テンプレートの内容を表示する"""
-    content_data = gh_api(
-        f"repos/{owner}/{repo}/contents/.github/PULL_REQUEST_TEMPLATE/{template}"
+    path = f"{PR_TEMPLATE_DIR}/{template}"
+    hit = resolve_template(
+        [(owner, repo), (owner, ".github")],
+        lambda tree: read_tree_file(tree, path),
+        lambda o, r: [f"repos/{o}/{r}/contents/{path}"],
+        extract_content,
     )
-    if content_data and isinstance(content_data, dict) and "content" in content_data:
-        print(decode_content(content_data["content"]))
-        return
-
-    content_data = gh_api(
-        f"repos/{owner}/.github/contents/.github/PULL_REQUEST_TEMPLATE/{template}"
-    )
-    if content_data and isinstance(content_data, dict) and "content" in content_data:
-        print(decode_content(content_data["content"]))
+    if hit:
+        print(hit[1])
         return
 
     print(f"エラー: PR テンプレート '{template}' が見つかりませんでした。", file=sys.stderr)
@@ -163,30 +265,211 @@ def get_pr_template_by_name(owner: str, repo: str, template: str) -> None:
 
 def get_pr_template_default(owner: str, repo: str) -> None:
     """デフォルトの PR テンプレートを検索して表示する"""
-    pr_paths = [
-        ".github/pull_request_template.md",
-        ".github/PULL_REQUEST_TEMPLATE.md",
-        "docs/pull_request_template.md",
-        "docs/PULL_REQUEST_TEMPLATE.md",
-        "pull_request_template.md",
-        "PULL_REQUEST_TEMPLATE.md",
-    ]
-
-    for path in pr_paths:
-        content_data = gh_api(f"repos/{owner}/{repo}/contents/{path}")
-        if content_data and isinstance(content_data, dict) and "content" in content_data:
-            print(decode_content(content_data["content"]))
-            return
-
-    for path in pr_paths:
-        content_data = gh_api(f"repos/{owner}/.github/contents/{path}")
-        if content_data and isinstance(content_data, dict) and "content" in content_data:
-            print(decode_content(content_data["content"]))
-            return
+    hit = resolve_template(
+        [(owner, repo), (owner, ".github")],
+        lambda tree: next(
+            (
+                read_tree_file(tree, path)
+                for path in PR_TEMPLATE_PATHS
+                if path in tree["entries"]
+            ),
+            None,
+        ),
+        lambda o, r: [f"repos/{o}/{r}/contents/{path}" for path in PR_TEMPLATE_PATHS],
+        extract_content,
+    )
+    if hit:
+        print(hit[1])
+        return
 
     print("エラー: PR テンプレートが見つかりませんでした。", file=sys.stderr)
     sys.exit(1)
 
 
+def resolve_template(
+    sources: list[tuple[str, str]],
+    find: Callable[[TemplateTree], T | None],
+    probe_paths: Callable[[str, str], list[str]],
+    extract: Callable[[Any], T | None],
+) -> tuple[int, T] | None:
+    """
+    sources を優先順に探し、最初に見つかったソースの位置と値を返す。
+    ローカルのクローン、ツリー API の順にツリーを探し、ツリーが取れなかったソース以降は contents API で探す。
+    """
+    start = 0
+    for owner, repo in sources:
+        tree = load_local_tree(owner, repo)
+        if tree is None:
+            break
+        value = find(tree)
+        if value is not None:
+            return start, value
+        start += 1
+
+    remote_trees = load_remote_trees(sources[start:])
+    for index, tree in enumerate(remote_trees, start):
+        if tree is None:
+            probe_sources = [
+                (source_index, path)
+                for source_index, (source_owner, source_repo) in enumerate(sources)
+                if source_index >= index
+                for path in probe_paths(source_owner, source_repo)
+            ]
+            hit = probe_in_priority_order([path for _, path in probe_sources], extract)
+            if hit is None:
+                return None
+            return probe_sources[hit[0]][0], hit[1]
+
+        value = find(tree)
+        if value is not None:
+            return index, value
+    return None
+
+
+def load_remote_trees(sources: list[tuple[str, str]]) -> list[TemplateTree | None]:
+    """各ソースのツリーをツリー API で並列に取得する"""
+    if not sources:
+        return []
+    with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        return list(executor.map(lambda source: load_remote_tree(*source), sources))
+
+
+def load_local_tree(owner: str, repo: str) -> TemplateTree | None:
+    """ローカルのクローンからデフォルトブランチのテンプレート関連ファイルを列挙する"""
+    remote = find_remote_for_repo(owner, repo)
+    if remote is None:
+        return None
+
+    result = run_command(
+        [
+            "git",
+            "ls-tree",
+            "-r",
+            "-z",
+            "--full-tree",
+            f"refs/remotes/{remote}/HEAD",
+            "--",
+            *_TEMPLATE_TREE_PATHS,
+        ],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return None
+
+    entries: dict[str, str] = {}
+    for record in result.stdout.split("\0"):
+        if not record:
+            continue
+        meta, _, path = record.partition("\t")
+        _, object_type, sha = meta.split()
+        if object_type == "blob":
+            entries[path] = sha
+    return TemplateTree(owner=owner, repo=repo, entries=entries, local=True)
+
+
+def load_remote_tree(owner: str, repo: str) -> TemplateTree | None:
+    """ツリー API でデフォルトブランチのファイル一覧を 1 回で取得する。判断できない場合は None"""
+    try:
+        response = conditional_get(
+            f"repos/{owner}/{repo}/git/trees/HEAD?recursive=1", _CACHE_NAMESPACE
+        )
+    except Exception:
+        return None
+
+    if response["status"] in (404, 409):
+        return TemplateTree(owner=owner, repo=repo, entries={}, local=False)
+    data = response["data"]
+    if response["status"] != 200 or not isinstance(data, dict) or data.get("truncated"):
+        return None
+
+    entries = {
+        entry["path"]: entry["sha"] for entry in data["tree"] if entry["type"] == "blob"
+    }
+    return TemplateTree(owner=owner, repo=repo, entries=entries, local=False)
+
+
+def read_tree_file(tree: TemplateTree, path: str) -> str | None:
+    """ツリー上のファイル内容を読む。ローカルなら git オブジェクトから、そうでなければ blob API から読む"""
+    sha = tree["entries"].get(path)
+    if sha is None:
+        return None
+
+    if tree["local"]:
+        return read_local_blobs([sha]).get(sha)
+
+    data = gh_api(f"repos/{tree['owner']}/{tree['repo']}/git/blobs/{sha}")
+    return extract_content(data)
+
+
+def read_local_blobs(shas: list[str]) -> dict[str, str]:
+    """git cat-file --batch で複数の blob をまとめて読む"""
+    result = run_command(
+        ["git", "cat-file", "--batch"],
+        input="".join(f"{sha}\n" for sha in shas).encode("utf-8"),
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        return {}
+
+    contents: dict[str, str] = {}
+    output = result.stdout
+    position = 0
+    while position < len(output):
+        header_end = output.index(b"\n", position)
+        header = output[position:header_end].decode("utf-8").split()
+        position = header_end + 1
+        if len(header) < 3 or header[1] == "missing":
+            continue
+        size = int(header[2])
+        contents[header[0]] = output[position : position + size].decode("utf-8")
+        position += size + 1
+    return contents
+
+
+def list_tree_dir(tree: TemplateTree, directory: str) -> list[str] | None:
+    """ツリー上のディレクトリ直下のファイル名を列挙する。無ければ None を返す"""
+    prefix = f"{directory}/"
+    names = sorted(
+        path[len(prefix) :]
+        for path in tree["entries"]
+        if path.startswith(prefix) and "/" not in path[len(prefix) :]
+    )
+    return names or None
+
+
+def probe_in_priority_order(
+    paths: list[str], extract: Callable[[Any], T | None]
+) -> tuple[int, T] | None:
+    """
+    paths を並列に取得し、優先順位（リストの順）が最も高いヒットの位置と値を返す。
+    ヒットが確定した時点で、それより優先順位の低い未着手の取得は取り消す。
+    """
+    executor = ThreadPoolExecutor(max_workers=_PROBE_WORKERS)
+    futures = [executor.submit(lambda path=path: extract(gh_api(path))) for path in paths]
+    try:
+        for index, future in enumerate(futures):
+            value = future.result()
+            if value is not None:
+                return index, value
+        return None
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def extract_content(data: Any) -> str | None:
+    """contents API のレスポンスからファイル内容を取り出す"""
+    if data and isinstance(data, dict) and "content" in data:
+        return decode_content(data["content"])
+    return None
+
+
+def extract_listing(data: Any) -> list[str] | None:
+    """contents API のレスポンスからディレクトリ直下の名前の一覧を取り出す"""
+    if data and isinstance(data, list):
+        return [entry["name"] for entry in data]
+    return None
+
+
 if __name__ == "__main__":
     main()
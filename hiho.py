@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+hiho_scripts の各コマンドを 1 つの入口から呼び出す
+使い方: hiho <サブコマンド> [引数...]
+選ばれたサブコマンドのモジュールだけを import し、他のコマンドの依存は読み込まない
+"""
+
+import importlib
+import os
+import sys
+from typing import TextIO
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# サブコマンド名と、(モジュール名, 説明) の対応
+SUBCOMMANDS = {
+    "ai_code": ("ai_code", "worktree を作成して AI CLI を起動する"),
+    "ai_code_checkout_pr": (
+        "ai_code_checkout_pr",
+        "PR のブランチを worktree にチェックアウトして AI CLI を起動する",
+    ),
+    "ai_code_counter_pr": (
+        "ai_code_counter_pr",
+        "カウンタープルリクエスト用の worktree を作成して AI CLI を起動する",
+    ),
+    "get_github_template": (
+        "get_github_template",
+        "GitHub の Issue テンプレートまたは PR テンプレートを取得する",
+    ),
+    "update_voicevox_pr_snapshots": (
+        "update_voicevox_pr_snapshots",
+        "VOICEVOX PR のスナップショットを更新する",
+    ),
+    "generate_password": ("generate_password", "パスワードを生成して stdout に出力する"),
+    "daemon": ("base.daemon", "リポジトリや GitHub の状態を保持するデーモンを操作する"),
+    "stats": ("base.metrics", "フェーズごとの所要時間の統計を表示する"),
+}
+
+
+def main() -> None:
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+        print_usage(sys.stdout if len(sys.argv) >= 2 else sys.stderr)
+        sys.exit(0 if len(sys.argv) >= 2 else 1)
+
+    name = sys.argv[1].replace("-", "_")
+    if name not in SUBCOMMANDS:
+        print(f"エラー: 不明なサブコマンドです: {sys.argv[1]}", file=sys.stderr)
+        print_usage(sys.stderr)
+        sys.exit(1)
+
+    module = importlib.import_module(SUBCOMMANDS[name][0])
+    # 各コマンドは sys.argv を自分で解析するので、単体で起動されたときと同じ形に揃える
+    sys.argv = [module.__file__, *sys.argv[2:]]
+    module.main()
+
+
+def print_usage(file: TextIO) -> None:
+    """サブコマンドの一覧を表示する"""
+    print("使い方: hiho <サブコマンド> [引数...]", file=file)
+    print("", file=file)
+    print("サブコマンド:", file=file)
+    width = max(len(name) for name in SUBCOMMANDS)
+    for name, (_, description) in SUBCOMMANDS.items():
+        print(f"  {name.ljust(width)}  {description}", file=file)
+
+
+if __name__ == "__main__":
+    main()
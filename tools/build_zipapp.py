@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""hiho コマンドを、コンパイル済みの .pyc だけを詰めた実行可能な zipapp にまとめる"""
+
+import argparse
+import py_compile
+import shutil
+import sys
+import tempfile
+import zipapp
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+_MAIN_SOURCE = "import hiho\n\nhiho.main()\n"
+
+
+def main() -> None:
+    output = parse_arguments()
+    build_zipapp(output)
+    print(f"✓ {output} を作成しました")
+
+
+def parse_arguments() -> Path:
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(
+        description="hiho コマンドをコンパイル済みの zipapp にまとめる"
+    )
+    parser.add_argument("output", type=Path, help="出力先の .pyz ファイル")
+    args = parser.parse_args()
+    return args.output
+
+
+def build_zipapp(output: Path) -> None:
+    """
+    リポジトリ直下と base/ のモジュールをこの python でコンパイルし、zipapp に詰める。
+    zipimport は zip 内に .pyc を書き戻せないので、ソースを含めずに .pyc だけを入れる。
+    .pyc はビルドした python でしか読めないため、シバンにもその python を指定する。
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        staging = Path(tmp)
+        sources = [*REPO_DIR.glob("*.py"), *(REPO_DIR / "base").glob("*.py")]
+        for source in sources:
+            relative = source.relative_to(REPO_DIR)
+            py_compile.compile(
+                str(source),
+                cfile=str(staging / relative.with_suffix(".pyc")),
+                dfile=str(relative),
+                doraise=True,
+            )
+        (staging / "__main__.py").write_text(_MAIN_SOURCE, encoding="utf-8")
+
+        output.parent.mkdir(parents=True, exist_ok=True)
+        tmp_output = output.with_name(f".{output.name}.tmp")
+        zipapp.create_archive(
+            staging, tmp_output, interpreter=sys.executable, compressed=False
+        )
+        shutil.move(tmp_output, output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+各サブコマンドの起動時の import 時間を python -X importtime で測り、予算を超えたら失敗する
+使い方: python tools/check_startup_time.py [--budget-ms 80] [--entry hiho.pyz] [サブコマンド...]
+"""
+
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(REPO_DIR))
+
+from hiho import SUBCOMMANDS
+
+_DEFAULT_BUDGET_MS = 80
+_DEFAULT_RUNS = 5
+
+
+def main() -> None:
+    entry, budget_ms, runs, names = parse_arguments()
+
+    over_budget = []
+    for name in names:
+        elapsed_ms = min(measure_import_ms(entry, name) for _ in range(runs))
+        mark = "✓" if elapsed_ms <= budget_ms else "✗"
+        print(f"{mark} {name}: {elapsed_ms:.1f} ms")
+        if elapsed_ms > budget_ms:
+            over_budget.append(name)
+
+    if over_budget:
+        print(
+            f"エラー: 起動時の import 時間が予算 ({budget_ms} ms) を超えました: {', '.join(over_budget)}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+def parse_arguments() -> tuple[Path, float, int, list[str]]:
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(
+        description="各サブコマンドの起動時の import 時間が予算内かを確認する"
+    )
+    parser.add_argument(
+        "names",
+        nargs="*",
+        help="確認するサブコマンド（省略時はすべて）",
+    )
+    parser.add_argument(
+        "--entry",
+        type=Path,
+        default=REPO_DIR / "hiho.py",
+        help="測定する hiho の入口。zipapp を測る場合は .pyz を指定する",
+    )
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=_DEFAULT_BUDGET_MS,
+        help=f"サブコマンドごとの import 時間の上限（デフォルト: {_DEFAULT_BUDGET_MS} ms）",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=_DEFAULT_RUNS,
+        help=f"測定回数。最小値で判定する（デフォルト: {_DEFAULT_RUNS}）",
+    )
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in SUBCOMMANDS]
+    if unknown:
+        parser.error(f"不明なサブコマンドです: {', '.join(unknown)}")
+    return args.entry, args.budget_ms, args.runs, args.names or list(SUBCOMMANDS)
+
+
+def measure_import_ms(entry: Path, name: str) -> float:
+    """
+    サブコマンドを --help 付きで起動し、-X importtime が出力する self 時間の合計をミリ秒で返す。
+    --help は引数を解析した時点で終了するので、モジュールの読み込みにかかる時間だけが測れる。
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", str(entry), name, "--help"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us = line.removeprefix("import time:").split("|")[0].strip()
+        if self_us.isdigit():
+            total_us += int(self_us)
+    return total_us / 1000
+
+
+if __name__ == "__main__":
+    main()
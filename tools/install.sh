@@ -21,23 +21,19 @@ bash_names=(
   stash_and_pr
 )
 
-python_cmds=(
-  hiho_ai_code
-  hiho_ai_code_checkout_pr
-  hiho_ai_code_counter_pr
-  hiho_get_github_template
-  hiho_update_voicevox_pr_snapshots
-  hiho_generate_password
+# hiho のサブコマンド。旧来の hiho_<name> コマンドは hiho <name> の別名として配置する
+python_subcommands=(
+  ai_code
+  ai_code_checkout_pr
+  ai_code_counter_pr
+  get_github_template
+  update_voicevox_pr_snapshots
+  generate_password
 )
 
-python_files=(
-  ai_code.py
-  ai_code_checkout_pr.py
-  ai_code_counter_pr.py
-  get_github_template.py
-  update_voicevox_pr_snapshots.py
-  generate_password.py
-)
+# --zipapp を付けると、コンパイル済みの zipapp をビルドしてそれを呼び出す
+use_zipapp=false
+zipapp_path="$HOME/.local/share/hiho_scripts/hiho.pyz"
 
 install_wrapper() {
   local target="$1"
@@ -114,6 +110,16 @@ check_path() {
 }
 
 main() {
+  for arg in "$@"; do
+    case "$arg" in
+      --zipapp) use_zipapp=true ;;
+      *)
+        echo "エラー: 不明なオプションです: $arg" >&2
+        exit 1
+        ;;
+    esac
+  done
+
   echo "hiho_scripts を $bin_dir に同期します..."
   echo ""
 
@@ -129,14 +135,21 @@ ${func} \"\$@\""
     install_wrapper "$bin_dir/$func" "$content"
   done
 
-  for i in "${!python_cmds[@]}"; do
-    local cmd="${python_cmds[$i]}"
-    local py_file="${python_files[$i]}"
-    local source_file="$repo_dir/${py_file}"
+  local entry="$repo_dir/hiho.py"
+  if [[ "$use_zipapp" == true ]]; then
+    python3 "$repo_dir/tools/build_zipapp.py" "$zipapp_path"
+    entry="$zipapp_path"
+  fi
+
+  install_wrapper "$bin_dir/hiho" "#!/usr/bin/env bash
+${marker}
+exec \"${entry}\" \"\$@\""
+
+  for name in "${python_subcommands[@]}"; do
     local content="#!/usr/bin/env bash
 ${marker}
-exec \"${source_file}\" \"\$@\""
-    install_wrapper "$bin_dir/$cmd" "$content"
+exec \"${entry}\" ${name} \"\$@\""
+    install_wrapper "$bin_dir/hiho_${name}" "$content"
   done
 
   echo ""
@@ -149,4 +162,4 @@ exec \"${source_file}\" \"\$@\""
   echo "完了しました。新しいシェルを開くとコマンドが使用できます。"
 }
 
-main
+main "$@"
@@ -2,150 +2,644 @@
 """VOICEVOX PR のスナップショットを更新する"""
 
 import argparse
-import json
 import sys
-import time
+import threading
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import TextIO, TypedDict
+from urllib.parse import quote
 
 sys.path.insert(0, str(Path(__file__).parent))
 
-import subprocess
-
+from base.cache import disable_cache
 from base.git import check_commands, fetch_remote_branch
-from base.github import add_fork_remote, get_current_user, get_pr_detail
-from base.pr_parser import PRInfo, parse_pr_info
+from base.github import (
+    PRContext,
+    add_fork_remote,
+    fetch_pr_context,
+    get_current_org_repo,
+    relay_branch,
+)
+from base.github_api import rest
+from base.journal import clear_journal, get_journal_path, load_journal, record_step
+from base.metrics import phase
+from base.pr_parser import parse_pr_info
+from base.process import enable_profile, run_command
+from base.snapshot_precheck import (
+    get_last_snapshot_commit,
+    get_snapshot_input_paths,
+    has_snapshot_input_changes,
+    record_snapshot_commit,
+)
+from base.workflow_tracker import WatchedRun, find_dispatched_run, wait_for_run, watch_runs
+
+WORKFLOW_FILE = "test.yml"
+
+# 並行実行時に、同じリポジトリの設定や ref を書き換える git 操作を直列化する
+_git_lock = threading.Lock()
+_thread_label = threading.local()
+# ディスパッチの成否が不明なまま中断した場合に、実行が現れるのを待つ時間
+_UNCERTAIN_DISPATCH_TIMEOUT = 30
+
+
+class SnapshotOptions(TypedDict):
+    """PR ごとの更新処理に渡すオプションを表す型"""
+
+    restart: bool
+    force: bool
+    relay: bool
+
+
+class SnapshotResult(TypedDict):
+    """PR ごとのスナップショット更新結果を表す型"""
+
+    number: int
+    author: str
+    branch: str
+    status: str
+
+
+class PendingSnapshot(TypedDict):
+    """ワークフローをディスパッチし、完了を待っている PR の状態を表す型"""
+
+    detail: PRContext
+    options: SnapshotOptions
+    journal: str
+    result: SnapshotResult
+    # 前回の実行でワークフローが完了済みなら None
+    run: WatchedRun | None
 
 
 def main() -> None:
     """VOICEVOX PR のスナップショットを更新する"""
-    pr_url = parse_arguments()
+    pr_urls, search, concurrency, options = parse_arguments()
     check_commands(["git", "gh"])
 
-    pr_info = parse_pr_info(pr_url)
-    if not pr_info:
-        if pr_url.strip().isdigit():
-            pr_info = PRInfo(number=int(pr_url.strip()))
-        else:
-            print("エラー: PR URLまたはPR番号をパースできませんでした。", file=sys.stderr)
-            print("例: https://github.com/VOICEVOX/voicevox/pull/123", file=sys.stderr)
-            print("例: 123", file=sys.stderr)
+    pr_numbers = [parse_pr_number(pr_url) for pr_url in pr_urls]
+    if search is not None:
+        pr_numbers += search_pr_numbers(search)
+    pr_numbers = list(dict.fromkeys(pr_numbers))
+    if not pr_numbers:
+        print("対象のPRがありませんでした")
+        return
+
+    if len(pr_numbers) == 1:
+        try:
+            update_pr_snapshots(pr_numbers[0], options)
+        except Exception as e:
+            print(f"エラー: {e}", file=sys.stderr)
             sys.exit(1)
+        print("スナップショットの更新が完了しました")
+        return
+
+    results = update_many_pr_snapshots(pr_numbers, concurrency, options)
+    print_summary(results)
+    if any(result["status"].startswith("失敗") for result in results):
+        sys.exit(1)
+
+
+def parse_arguments() -> tuple[list[str], str | None, int, SnapshotOptions]:
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(
+        description="VOICEVOX PR のスナップショットを更新する"
+    )
+    parser.add_argument(
+        "pr_urls",
+        nargs="*",
+        help="PR URL または PR 番号。複数指定可 (例: https://github.com/VOICEVOX/voicevox/pull/123, 123)",
+    )
+    parser.add_argument(
+        "--search",
+        help="対象の PR を検索するクエリ。open な PR に限る (例: 'label:snapshot')",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="同時にディスパッチや後処理を進める PR の数の上限。CI の完了はまとめて待つ (デフォルト: 4)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="スナップショットに影響する入力が前回から変わっていなくてもワークフローを実行する",
+    )
+    parser.add_argument(
+        "--no-relay",
+        action="store_true",
+        help="他人の PR のブランチを refs API でサーバー側に移さず、常に手元の git で fetch/push する",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="中断した処理の記録を破棄して最初からやり直す",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="GitHub メタデータのキャッシュを使わずに取得する",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="起動した外部コマンドの所要時間を Chrome の trace 形式で PATH に書き出す",
+    )
+    args = parser.parse_args()
+    if not args.pr_urls and args.search is None:
+        parser.error("PR URL、PR 番号、--search のいずれかを指定してください")
+    if args.concurrency < 1:
+        parser.error("--concurrency は1以上を指定してください")
+    if args.no_cache:
+        disable_cache()
+    if args.profile:
+        enable_profile(args.profile)
+    options = SnapshotOptions(
+        restart=args.restart, force=args.force, relay=not args.no_relay
+    )
+    return args.pr_urls, args.search, args.concurrency, options
 
-    pr_number = pr_info["number"]
-    detail = get_pr_detail(pr_number)
-    current_user = get_current_user()
+
+def parse_pr_number(pr_url: str) -> int:
+    """PR URL または PR 番号から PR 番号を取り出す"""
+    pr_info = parse_pr_info(pr_url)
+    if pr_info:
+        return pr_info["number"]
+    if pr_url.strip().isdigit():
+        return int(pr_url.strip())
+    print(f"エラー: PR URLまたはPR番号をパースできませんでした: {pr_url}", file=sys.stderr)
+    print("例: https://github.com/VOICEVOX/voicevox/pull/123", file=sys.stderr)
+    print("例: 123", file=sys.stderr)
+    sys.exit(1)
+
+
+def search_pr_numbers(query: str) -> list[int]:
+    """現在のリポジトリの open な PR を検索し、PR 番号を返す"""
+    org, repo = get_current_org_repo()
+    q = quote(f"repo:{org}/{repo} is:pr is:open {query}")
+    data = rest("GET", f"search/issues?q={q}&per_page=100")
+    numbers = [item["number"] for item in data["items"]]
+    print(f"検索にヒットしたPR: {', '.join(f'#{n}' for n in numbers) or 'なし'}")
+    return numbers
+
+
+def update_pr_snapshots(pr_number: int, options: SnapshotOptions) -> SnapshotResult:
+    """PR 1 件のスナップショットを更新する。前回中断していれば続きから再開する"""
+    result, pending = start_pr_snapshot_update(pr_number, options)
+    if pending is None:
+        return result
+    conclusion = None
+    if pending["run"] is not None:
+        with phase("workflow_wait"):
+            conclusion = wait_for_workflow_completion(pending["run"])
+    return finish_pr_snapshot_update(pending, conclusion)
+
+
+def start_pr_snapshot_update(
+    pr_number: int, options: SnapshotOptions
+) -> tuple[SnapshotResult, PendingSnapshot | None]:
+    """
+    PR 1 件のワークフローをディスパッチし、実行を見つけるところまで進める。
+    入力に変更が無くスキップした場合は、PendingSnapshot の代わりに None を返す。
+    """
+    with phase("metadata"):
+        detail = fetch_pr_context(pr_number)
+    current_user = detail["viewer"]
+    result = SnapshotResult(
+        number=pr_number, author=detail["author"], branch=detail["branch"], status=""
+    )
 
     is_own_pr = detail["author"] == current_user
 
     print(f"PR #{pr_number} のスナップショットを更新します")
     print(f"PR 作者: {detail['author']}, ブランチ: {detail['branch']}")
 
+    journal = f"update_voicevox_pr_snapshots/{detail['org']}/{detail['repo']}/{pr_number}"
+    if options["restart"]:
+        clear_journal(journal)
+    head_sha = get_branch_head_sha(detail["fork_owner"], detail["fork_repo"], detail["branch"])
+    steps = load_journal(journal)
+    # ディスパッチ前に PR が更新されていたら、記録は古いので捨てる
+    if steps and "dispatching" not in steps and steps.get("head_sha") != head_sha:
+        clear_journal(journal)
+        steps = {}
+    if steps:
+        print(f"前回中断した処理を再開します (記録: {get_journal_path(journal)})")
+    else:
+        if not options["force"] and not needs_snapshot_update(detail, head_sha):
+            result["status"] = "スキップ (入力に変更なし)"
+            return result, None
+        record_step(journal, "head_sha", head_sha)
+
     if not is_own_pr:
         if not detail["maintainer_can_modify"]:
-            print(
-                "エラー: PRのmaintainerCanModifyがfalseのため、ブランチにpushできません。",
-                file=sys.stderr,
-            )
-            print(
-                "PR作者に「Maintainers are allowed to edit this pull request」を有効化してもらってください。",
-                file=sys.stderr,
+            raise Exception(
+                "PRのmaintainerCanModifyがfalseのため、ブランチにpushできません。"
+                "PR作者に「Maintainers are allowed to edit this pull request」を有効化してもらってください。"
             )
-            sys.exit(1)
-        run_others_pr_flow(
-            current_user, detail["author"], detail["fork_repo"], detail["branch"]
+        run = start_others_pr_flow(
+            current_user,
+            detail["author"],
+            detail["fork_repo"],
+            detail["branch"],
+            pr_number,
+            journal,
+            options["relay"],
         )
     else:
-        run_own_pr_flow(detail["fork_owner"], detail["fork_repo"], detail["branch"])
+        run = start_own_pr_flow(
+            detail["fork_owner"], detail["fork_repo"], detail["branch"], journal
+        )
+    return result, PendingSnapshot(
+        detail=detail, options=options, journal=journal, result=result, run=run
+    )
 
-    print("スナップショットの更新が完了しました")
 
+def finish_pr_snapshot_update(pending: PendingSnapshot, conclusion: str | None) -> SnapshotResult:
+    """
+    ワークフローの完了後に、コミットの検証と PR ごとの後処理を行う。
+    conclusion はワークフローの結果で、前回の実行で完了済みなら None を渡す。
+    """
+    detail = pending["detail"]
+    journal = pending["journal"]
+    if detail["author"] != detail["viewer"]:
+        no_changes = finish_others_pr_flow(
+            detail["viewer"],
+            detail["author"],
+            detail["fork_repo"],
+            detail["branch"],
+            detail["number"],
+            journal,
+            pending["options"]["relay"],
+            conclusion,
+        )
+    else:
+        no_changes = finish_own_pr_flow(
+            detail["fork_owner"], detail["fork_repo"], detail["branch"], journal, conclusion
+        )
 
-def parse_arguments() -> str:
-    """コマンドライン引数を解析する"""
-    parser = argparse.ArgumentParser(
-        description="VOICEVOX PR のスナップショットを更新する"
-    )
-    parser.add_argument(
-        "pr_url",
-        help="PR URL または PR 番号 (例: https://github.com/VOICEVOX/voicevox/pull/123, 123)",
+    clear_journal(journal)
+    record_snapshot_commit(
+        detail["org"],
+        detail["repo"],
+        detail["number"],
+        get_branch_head_sha(detail["fork_owner"], detail["fork_repo"], detail["branch"]),
     )
-    args = parser.parse_args()
-    return args.pr_url
+    result = pending["result"]
+    result["status"] = "変更なし" if no_changes else "更新"
+    return result
 
 
-def run_own_pr_flow(fork_owner: str, fork_repo: str, branch: str) -> None:
-    """自分の PR のスナップショットを更新する"""
-    print("自分のPRです。ワークフローをディスパッチします...")
-    old_head_sha = get_branch_head_sha(fork_owner, fork_repo, branch)
+def needs_snapshot_update(detail: PRContext, head_sha: str) -> bool:
+    """前回スナップショットを更新したコミットから、スナップショットに影響する入力が変わったかを調べる"""
+    paths = get_snapshot_input_paths()
+    base_sha = get_last_snapshot_commit(detail["org"], detail["repo"], detail["number"])
+    if not paths or base_sha is None:
+        return True
 
-    dispatch_time = datetime.now(timezone.utc).isoformat()
-    dispatch_workflow(fork_owner, fork_repo, branch)
+    if base_sha != head_sha and has_snapshot_input_changes(
+        detail["fork_owner"], detail["fork_repo"], base_sha, head_sha, paths
+    ):
+        return True
 
-    run_id = find_workflow_run(fork_owner, fork_repo, branch, dispatch_time)
-    wait_for_workflow_completion(fork_owner, fork_repo, run_id)
+    print(
+        f"前回のスナップショット更新 ({base_sha[:7]}) から {', '.join(paths)} に変更が無いため、"
+        "ワークフローをスキップします (--force で強制実行)"
+    )
+    return False
 
-    validate_commit_advanced(fork_owner, fork_repo, branch, old_head_sha)
 
+def update_many_pr_snapshots(
+    pr_numbers: list[int], concurrency: int, options: SnapshotOptions
+) -> list[SnapshotResult]:
+    """
+    複数の PR を並行して更新する。
+    ディスパッチまでを concurrency 件ずつ並行して進め、走らせた実行は 1 つのループでまとめて見張る。
+    終わった実行から後処理を始めるので、全体の所要時間は CI 1 回分に近くなる。
+    """
+    from concurrent.futures import Future, ThreadPoolExecutor
 
-def run_others_pr_flow(
-    current_user: str, pr_author: str, fork_repo: str, branch: str
-) -> None:
-    """他人の PR のスナップショットを更新する"""
-    print(f"PR作者 ({pr_author}) のブランチをフェッチします...")
-    add_fork_remote(pr_author, fork_repo)
-    fetch_remote_branch(pr_author, branch)
+    print(
+        f"{len(pr_numbers)} 件のPRのスナップショットを更新します (同時実行数: {concurrency})"
+    )
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = _LabeledStream(stdout)
+    sys.stderr = _LabeledStream(stderr)
+    results: dict[int, SnapshotResult] = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            started = {
+                pr_number: executor.submit(_start_labeled, pr_number, options)
+                for pr_number in pr_numbers
+            }
+            finishing: dict[int, Future[SnapshotResult]] = {}
+            watched: list[WatchedRun] = []
+            pending_by_run: dict[int, PendingSnapshot] = {}
+            for pr_number, future in started.items():
+                try:
+                    results[pr_number], pending = future.result()
+                except Exception as e:
+                    results[pr_number] = SnapshotResult(
+                        number=pr_number, author="", branch="", status=f"失敗: {e}"
+                    )
+                    continue
+                if pending is None:
+                    continue
+                run = pending["run"]
+                if run is None:
+                    finishing[pr_number] = executor.submit(_finish_labeled, pending, None)
+                else:
+                    watched.append(run)
+                    pending_by_run[run["run_id"]] = pending
+
+            try:
+                with phase("workflow_wait"):
+                    for run, conclusion in watch_runs(
+                        watched,
+                        lambda run, progress: _print_labeled(
+                            pending_by_run[run["run_id"]]["detail"]["number"], progress
+                        ),
+                    ):
+                        pending = pending_by_run.pop(run["run_id"])
+                        pr_number = pending["detail"]["number"]
+                        _print_labeled(
+                            pr_number,
+                            f"ワークフロー (run ID: {run['run_id']}) が終了しました: {conclusion}",
+                        )
+                        finishing[pr_number] = executor.submit(_finish_labeled, pending, conclusion)
+            except Exception as e:
+                # 見張れなかった PR もジャーナルに記録が残るので、再実行すれば続きから処理できる
+                for pending in pending_by_run.values():
+                    pending["result"]["status"] = f"失敗: {e}"
+
+            for pr_number, finished in finishing.items():
+                try:
+                    results[pr_number] = finished.result()
+                except Exception as e:
+                    results[pr_number]["status"] = f"失敗: {e}"
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+    return [results[pr_number] for pr_number in pr_numbers]
+
+
+def print_summary(results: list[SnapshotResult]) -> None:
+    """PR ごとの結果を表形式で表示する"""
+    rows = [
+        (f"#{result['number']}", result["author"], result["branch"], result["status"])
+        for result in results
+    ]
+    header = ("PR", "作者", "ブランチ", "結果")
+    widths = [max(len(row[i]) for row in [header, *rows]) for i in range(3)]
+    print()
+    for row in [header, *rows]:
+        cells = [cell.ljust(width) for cell, width in zip(row, widths)]
+        print("  ".join([*cells, row[3]]))
+
+
+def _start_labeled(
+    pr_number: int, options: SnapshotOptions
+) -> tuple[SnapshotResult, PendingSnapshot | None]:
+    """出力の各行に PR 番号を付けて、PR のワークフローをディスパッチする"""
+    _thread_label.value = f"[#{pr_number}] "
+    return start_pr_snapshot_update(pr_number, options)
+
+
+def _finish_labeled(pending: PendingSnapshot, conclusion: str | None) -> SnapshotResult:
+    """出力の各行に PR 番号を付けて、ワークフロー完了後の後処理を行う"""
+    _thread_label.value = f"[#{pending['detail']['number']}] "
+    return finish_pr_snapshot_update(pending, conclusion)
+
+
+def _print_labeled(pr_number: int, text: str) -> None:
+    """実行をまとめて見張るスレッドから、PR 番号を付けて 1 行表示する"""
+    _thread_label.value = f"[#{pr_number}] "
+    try:
+        print(text)
+    finally:
+        _thread_label.value = ""
+
+
+class _LabeledStream:
+    """スレッドごとのラベルを行頭に付け、行単位で書き出す出力ストリーム"""
+
+    def __init__(self, stream: TextIO) -> None:
+        self._stream = stream
+        self._buffers = threading.local()
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> int:
+        buffer = getattr(self._buffers, "text", "") + text
+        *lines, rest_text = buffer.split("\n")
+        self._buffers.text = rest_text
+        if lines:
+            label = getattr(_thread_label, "value", "")
+            with self._lock:
+                self._stream.write("".join(f"{label}{line}\n" for line in lines))
+                self._stream.flush()
+        return len(text)
+
+    def flush(self) -> None:
+        self._stream.flush()
+
+
+def start_own_pr_flow(
+    fork_owner: str, fork_repo: str, branch: str, journal: str
+) -> WatchedRun | None:
+    """自分の PR のワークフローをディスパッチし、実行を返す。前回の実行で完了済みなら None を返す"""
+    print("自分のPRです。ワークフローをディスパッチします...")
+    return start_snapshot_workflow(fork_owner, fork_repo, branch, journal)
 
-    print(f"自分のフォーク ({current_user}) にpushします...")
-    add_fork_remote(current_user, fork_repo)
-    git_push(current_user, f"{pr_author}/{branch}:refs/heads/{branch}")
 
-    old_head_sha = get_branch_head_sha(current_user, fork_repo, branch)
+def finish_own_pr_flow(
+    fork_owner: str, fork_repo: str, branch: str, journal: str, conclusion: str | None
+) -> bool:
+    """自分の PR のワークフローの結果を検証する。変更なしの場合は True を返す"""
+    return finish_snapshot_workflow(fork_owner, fork_repo, branch, journal, conclusion)
+
+
+def start_others_pr_flow(
+    current_user: str,
+    pr_author: str,
+    fork_repo: str,
+    branch: str,
+    pr_number: int,
+    journal: str,
+    relay: bool,
+) -> WatchedRun | None:
+    """
+    他人の PR のブランチを自分のフォークの一時ブランチに移し、ワークフローをディスパッチして実行を返す。
+    前回の実行で完了済みなら None を返す。
+    relay が有効なら、フォーク間のブランチの受け渡しを refs API でサーバー側だけで済ませ、
+    オブジェクトが見えないなどで失敗した場合だけ手元の git で fetch/push する。
+    """
+    temp_branch = get_temp_branch_name(pr_number)
+    steps = load_journal(journal)
+    if "pushed_to_fork" not in steps:
+        # 中断した前回の実行で一時ブランチが残っていても進められるよう、一時ブランチは上書きする
+        if relay and relay_branch(
+            pr_author, fork_repo, current_user, fork_repo, branch, temp_branch, force=True
+        ):
+            print(f"PR作者 ({pr_author}) のブランチを自分のフォーク ({current_user}) にサーバー側で移しました")
+        else:
+            with _git_lock:
+                print(f"PR作者 ({pr_author}) のブランチをフェッチします...")
+                add_fork_remote(pr_author, fork_repo)
+                with phase("git_fetch"):
+                    fetch_remote_branch(pr_author, branch)
+
+                print(f"自分のフォーク ({current_user}) にpushします...")
+                add_fork_remote(current_user, fork_repo)
+                git_push(current_user, f"+{pr_author}/{branch}:refs/heads/{temp_branch}")
+        record_step(journal, "pushed_to_fork")
 
     print("ワークフローをディスパッチします...")
-    dispatch_time = datetime.now(timezone.utc).isoformat()
-    dispatch_workflow(current_user, fork_repo, branch)
+    return start_snapshot_workflow(current_user, fork_repo, temp_branch, journal)
+
+
+def finish_others_pr_flow(
+    current_user: str,
+    pr_author: str,
+    fork_repo: str,
+    branch: str,
+    pr_number: int,
+    journal: str,
+    relay: bool,
+    conclusion: str | None,
+) -> bool:
+    """
+    他人の PR のワークフローの結果を検証し、更新されたブランチを PR 作者のフォークに戻して一時ブランチを消す。
+    変更なしの場合は True を返す。
+    """
+    temp_branch = get_temp_branch_name(pr_number)
+    steps = load_journal(journal)
+    no_changes = finish_snapshot_workflow(current_user, fork_repo, temp_branch, journal, conclusion)
+    if no_changes:
+        if "temp_branch_deleted" not in steps:
+            delete_remote_branch(current_user, fork_repo, temp_branch)
+            record_step(journal, "temp_branch_deleted")
+        return True
 
-    run_id = find_workflow_run(current_user, fork_repo, branch, dispatch_time)
-    wait_for_workflow_completion(current_user, fork_repo, run_id)
+    if "pushed_back" not in steps:
+        if relay and relay_branch(
+            current_user, fork_repo, pr_author, fork_repo, temp_branch, branch
+        ):
+            print(f"更新されたブランチをPR作者 ({pr_author}) のフォークにサーバー側で移しました")
+        else:
+            if "fetched" not in steps:
+                with _git_lock:
+                    print("更新されたブランチをフェッチします...")
+                    with phase("git_fetch"):
+                        fetch_remote_branch(current_user, temp_branch)
+                record_step(journal, "fetched")
+
+            with _git_lock:
+                print(f"PR作者 ({pr_author}) のブランチにpushします...")
+                add_fork_remote(pr_author, fork_repo)
+                git_push(pr_author, f"{current_user}/{temp_branch}:{branch}")
+        record_step(journal, "pushed_back")
+
+    if "temp_branch_deleted" not in steps:
+        print("自分のフォーク上の一時ブランチを削除します...")
+        delete_remote_branch(current_user, fork_repo, temp_branch)
+        record_step(journal, "temp_branch_deleted")
+    return False
 
-    no_changes = validate_commit_advanced(current_user, fork_repo, branch, old_head_sha)
-    if no_changes:
-        delete_remote_branch(current_user, fork_repo, branch)
-        return
 
-    print("更新されたブランチをフェッチします...")
-    fetch_remote_branch(current_user, branch)
+def get_temp_branch_name(pr_number: int) -> str:
+    """
+    他人の PR を自分のフォークで更新するときの一時ブランチ名を返す。
+    別の fork から同じ名前のブランチ（patch-1 など）で出された PR を並行して処理しても、
+    push 先やワークフロー実行が混ざらないよう PR 番号で区別する。
+    """
+    return f"update-snapshots-pr-{pr_number}"
+
+
+def start_snapshot_workflow(
+    repo_owner: str, repo_name: str, branch: str, journal: str
+) -> WatchedRun | None:
+    """
+    ワークフローをディスパッチして実行を見つけ、返す。前回の実行で完了済みなら None を返す。
+    各段階をジャーナルに記録し、再実行時は記録済みの段階を飛ばす。
+    ディスパッチ前に意図を記録しておき、ディスパッチの成否が不明な場合は実行を探してから判断する。
+    """
+    steps = load_journal(journal)
+    if "completed" in steps:
+        return None
+
+    if "dispatching" in steps and "dispatched" not in steps and "run_id" not in steps:
+        print("前回のディスパッチが完了したか不明なため、ワークフロー実行を探します...")
+        try:
+            run_id = find_dispatched_run(
+                repo_owner,
+                repo_name,
+                WORKFLOW_FILE,
+                branch,
+                datetime.fromisoformat(steps["dispatching"]["at"]),
+                timeout=_UNCERTAIN_DISPATCH_TIMEOUT,
+            )
+        except Exception:
+            print("ワークフロー実行が見つからないため、ディスパッチし直します")
+            del steps["dispatching"]
+        else:
+            record_step(journal, "run_id", run_id)
+            steps["run_id"] = run_id
+
+    if "dispatching" not in steps:
+        dispatching = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "old_head_sha": get_branch_head_sha(repo_owner, repo_name, branch),
+        }
+        record_step(journal, "dispatching", dispatching)
+        dispatch_workflow(repo_owner, repo_name, branch)
+        record_step(journal, "dispatched")
+        steps = load_journal(journal)
+    else:
+        print("記録済みのディスパッチから再開します")
+
+    run_id = steps.get("run_id")
+    if run_id is None:
+        with phase("workflow_find"):
+            run_id = find_workflow_run(
+                repo_owner, repo_name, branch, steps["dispatching"]["at"]
+            )
+        record_step(journal, "run_id", run_id)
 
-    print(f"PR作者 ({pr_author}) のブランチにpushします...")
-    git_push(pr_author, f"{current_user}/{branch}:{branch}")
+    return WatchedRun(repo_owner=repo_owner, repo_name=repo_name, run_id=run_id)
 
-    print("自分のフォーク上の一時ブランチを削除します...")
-    delete_remote_branch(current_user, fork_repo, branch)
+
+def finish_snapshot_workflow(
+    repo_owner: str, repo_name: str, branch: str, journal: str, conclusion: str | None
+) -> bool:
+    """
+    ワークフローの結果を記録し、コミットの追加を検証する。変更なしの場合は True を返す。
+    conclusion が None なら、ジャーナルに記録済みの結果を使う。
+    """
+    steps = load_journal(journal)
+    if "validated" in steps:
+        return steps["validated"]["no_changes"]
+
+    if "completed" not in steps:
+        if conclusion != "success":
+            # 失敗した実行は再開しても結果が変わらないので、次回は最初からやり直す
+            clear_journal(journal)
+            raise Exception(f"ワークフロー (run ID: {steps['run_id']}) が失敗しました ({conclusion})")
+        record_step(journal, "completed")
+
+    no_changes = validate_commit_advanced(
+        repo_owner, repo_name, branch, steps["dispatching"]["old_head_sha"]
+    )
+    record_step(journal, "validated", {"no_changes": no_changes})
+    return no_changes
 
 
 def dispatch_workflow(repo_owner: str, repo_name: str, branch: str) -> None:
     """test.yml ワークフローをディスパッチする"""
-    result = subprocess.run(
-        [
-            "gh",
-            "workflow",
-            "run",
-            "test.yml",
-            "--repo",
-            f"{repo_owner}/{repo_name}",
-            "--ref",
-            branch,
-            "-f",
-            "update_snapshots=true",
-        ],
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode != 0:
-        raise Exception(
-            f"ワークフローのディスパッチに失敗しました: {result.stderr.strip()}"
+    try:
+        rest(
+            "POST",
+            f"repos/{repo_owner}/{repo_name}/actions/workflows/{WORKFLOW_FILE}/dispatches",
+            {"ref": branch, "inputs": {"update_snapshots": "true"}},
         )
+    except Exception as e:
+        raise Exception(f"ワークフローのディスパッチに失敗しました: {e}") from e
     print("ワークフローをディスパッチしました")
 
 
@@ -154,88 +648,32 @@ def find_workflow_run(
 ) -> int:
     """ディスパッチ後のワークフロー実行を検索する"""
     print("ワークフロー実行を検索中...")
-    deadline = time.time() + 120
-    after_dt = datetime.fromisoformat(after_time)
-
-    while time.time() < deadline:
-        result = subprocess.run(
-            [
-                "gh",
-                "run",
-                "list",
-                "--workflow=test.yml",
-                f"--branch={branch}",
-                "--repo",
-                f"{repo_owner}/{repo_name}",
-                "--json",
-                "databaseId,status,event,createdAt",
-                "--limit",
-                "5",
-            ],
-            capture_output=True,
-            text=True,
-        )
-        if result.returncode != 0:
-            raise Exception(
-                f"ワークフロー実行一覧の取得に失敗しました: {result.stderr.strip()}"
-            )
-
-        runs = json.loads(result.stdout)
-        for run in runs:
-            if run["event"] != "workflow_dispatch":
-                continue
-            created_at = datetime.fromisoformat(run["createdAt"].replace("Z", "+00:00"))
-            if created_at >= after_dt:
-                run_id = run["databaseId"]
-                print(f"ワークフロー実行を発見しました (run ID: {run_id})")
-                return run_id
-
-        print("ワークフロー実行を待機中... (5秒後に再試行)")
-        time.sleep(5)
-
-    raise Exception("ワークフロー実行が120秒以内に見つかりませんでした")
+    run_id = find_dispatched_run(
+        repo_owner,
+        repo_name,
+        WORKFLOW_FILE,
+        branch,
+        datetime.fromisoformat(after_time),
+    )
+    print(f"ワークフロー実行を発見しました (run ID: {run_id})")
+    return run_id
 
 
-def wait_for_workflow_completion(repo_owner: str, repo_name: str, run_id: int) -> None:
-    """ワークフローの完了を待機する"""
+def wait_for_workflow_completion(run: WatchedRun) -> str:
+    """ワークフローの完了を待機し、conclusion を返す"""
     print("ワークフローの完了を待機しています...")
-    result = subprocess.run(
-        [
-            "gh",
-            "run",
-            "watch",
-            str(run_id),
-            "--repo",
-            f"{repo_owner}/{repo_name}",
-            "--exit-status",
-        ],
-    )
-    if result.returncode != 0:
-        print(
-            f"エラー: ワークフロー (run ID: {run_id}) が失敗しました。",
-            file=sys.stderr,
-        )
-        sys.exit(1)
+    return wait_for_run(run["repo_owner"], run["repo_name"], run["run_id"])
 
 
 def get_branch_head_sha(repo_owner: str, repo_name: str, branch: str) -> str:
     """リモートブランチの HEAD SHA を取得する"""
-    result = subprocess.run(
-        [
-            "gh",
-            "api",
-            f"repos/{repo_owner}/{repo_name}/git/ref/heads/{branch}",
-            "--jq",
-            ".object.sha",
-        ],
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode != 0:
-        raise Exception(
-            f"ブランチ '{branch}' のHEAD SHAの取得に失敗しました: {result.stderr.strip()}"
+    try:
+        data = rest(
+            "GET", f"repos/{repo_owner}/{repo_name}/git/ref/heads/{quote(branch, safe='/')}"
         )
-    return result.stdout.strip()
+    except Exception as e:
+        raise Exception(f"ブランチ '{branch}' のHEAD SHAの取得に失敗しました: {e}") from e
+    return data["object"]["sha"]
 
 
 def validate_commit_advanced(
@@ -250,36 +688,29 @@ def validate_commit_advanced(
         )
         return True
 
-    result = subprocess.run(
-        [
-            "gh",
-            "api",
-            f"repos/{repo_owner}/{repo_name}/commits/{new_head_sha}",
-            "--jq",
-            ".parents[0].sha",
-        ],
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode != 0:
-        raise Exception(f"コミット情報の取得に失敗しました: {result.stderr.strip()}")
+    try:
+        commit = rest("GET", f"repos/{repo_owner}/{repo_name}/commits/{new_head_sha}")
+    except Exception as e:
+        raise Exception(f"コミット情報の取得に失敗しました: {e}") from e
 
-    parent_sha = result.stdout.strip()
+    parents = commit["parents"]
+    parent_sha = parents[0]["sha"] if parents else None
     if parent_sha != old_head_sha:
-        print(
-            f"エラー: 新しいコミット ({new_head_sha[:7]}) の親が期待するSHA ({old_head_sha[:7]}) と一致しません。",
-            file=sys.stderr,
+        raise Exception(
+            f"新しいコミット ({new_head_sha[:7]}) の親が期待するSHA ({old_head_sha[:7]}) と一致しません"
         )
-        sys.exit(1)
 
     print(f"コミットの追加を確認しました ({new_head_sha[:7]})")
     return False
 
 
 def git_push(remote: str, refspec: str) -> None:
-    """git push を実行する"""
-    result = subprocess.run(
-        ["git", "push", remote, refspec],
+    """
+    git push を実行する。
+    push.negotiate で相手が既に持つコミットを確かめ、thin pack で差分だけを送る。
+    """
+    result = run_command(
+        ["git", "-c", "push.negotiate=true", "push", "--thin", remote, refspec],
         capture_output=True,
         text=True,
     )
@@ -292,21 +723,10 @@ def git_push(remote: str, refspec: str) -> None:
 
 def delete_remote_branch(repo_owner: str, repo_name: str, branch: str) -> None:
     """リモートブランチを削除する"""
-    result = subprocess.run(
-        [
-            "gh",
-            "api",
-            "-X",
-            "DELETE",
-            f"repos/{repo_owner}/{repo_name}/git/refs/heads/{branch}",
-        ],
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode != 0:
-        raise Exception(
-            f"ブランチ '{branch}' の削除に失敗しました: {result.stderr.strip()}"
-        )
+    try:
+        rest("DELETE", f"repos/{repo_owner}/{repo_name}/git/refs/heads/{quote(branch, safe='/')}")
+    except Exception as e:
+        raise Exception(f"ブランチ '{branch}' の削除に失敗しました: {e}") from e
     print(f"ブランチ '{branch}' を削除しました ({repo_owner}/{repo_name})")
 
 